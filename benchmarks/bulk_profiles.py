@@ -0,0 +1,74 @@
+"""Importing a customer list: one add_user_profile call per profile vs add_user_profiles_bulk
+
+Writes the same profiles through both handlers against the fake DynamoDB,
+with a per-call latency like a real table, and reports wall-clock time,
+DynamoDB calls and what the bulk report says. --unprocessed makes the fake
+leave that share of each BatchWriteItem unprocessed so the retry path runs.
+
+    python -m benchmarks.bulk_profiles [--profiles 2000] [--latency 0.008] [--unprocessed 0.1]
+"""
+import argparse
+import contextlib
+import json
+import os
+import time
+
+from benchmarks import fakes
+from benchmarks.events import SERVER_API_KEY, http_event, ndjson_event, profile_records
+
+TABLE = "offline-user-profiles"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--profiles", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.008, help="seconds per DynamoDB call")
+    parser.add_argument("--unprocessed", type=float, default=0.1,
+                        help="share of items each BatchWriteItem leaves unprocessed")
+    parser.add_argument("--invalid-every", type=int, default=50, help="make every Nth record invalid (0 for none)")
+    args = parser.parse_args()
+
+    fakes.install(scale=0)
+    fakes.CALL_LATENCY["dynamodb"] = args.latency
+    fakes.ERROR_RATE["dynamodb.unprocessed"] = args.unprocessed
+    os.environ["USER_PROFILES_TABLE"] = TABLE
+    os.environ.setdefault("PROFILES_BULK_BACKOFF_BASE", str(args.latency))
+
+    import handler
+    import profiles
+
+    records = profile_records(args.profiles)
+    if args.invalid_every:
+        for record in records[args.invalid_every - 1::args.invalid_every]:
+            record["Email"] = "not-an-email"
+    headers = {"x-api-key": SERVER_API_KEY}
+    client = fakes._dynamodb.meta.client
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        single_written = 0
+        for record in records:
+            response = handler.add_user_profile(http_event(record, headers, path="/add-user-profile"), None)
+            single_written += response["statusCode"] == 200
+        single_s = time.perf_counter() - start
+
+        fakes.dynamodb_items(TABLE).clear()
+        event = ndjson_event(records, headers, path="/add-user-profiles/bulk")
+        start = time.perf_counter()
+        response = handler.add_user_profiles_bulk(event, None)
+        bulk_s = time.perf_counter() - start
+
+    report = json.loads(response["body"])
+    print(f"{args.profiles} profiles, {args.latency * 1000:.0f} ms per DynamoDB call, "
+          f"{args.unprocessed:.0%} unprocessed per batch, concurrency {profiles.BULK_CONCURRENCY}\n")
+    print(f"{'':<24}{'seconds':>10}{'calls':>8}{'written':>9}")
+    print(f"{'one by one':<24}{single_s:>10.2f}{args.profiles:>8}{single_written:>9}")
+    print(f"{'bulk (BatchWriteItem)':<24}{bulk_s:>10.2f}{client.batch_calls:>8}{report['written']:>9}"
+          f"   {single_s / bulk_s:.0f}x faster")
+    print(f"\nbulk report: status {response['statusCode']}, "
+          + ", ".join(f"{name} {report[name]}" for name in ("total", "written", "invalid", "superseded", "failed")))
+    print(f"items in table: {len(fakes.dynamodb_items(TABLE))}, request body {len(event['body']) / 1024:.0f} KB")
+
+
+if __name__ == "__main__":
+    main()
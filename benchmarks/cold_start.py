@@ -0,0 +1,115 @@
+"""Cold-start benchmark: import and first-invocation cost of each handler
+
+Every handler runs in a fresh interpreter with the provider SDKs replaced by
+the fakes in benchmarks/fakes.py, so the numbers only reflect which SDKs get
+imported and initialised on the way to the first response.
+
+    python -m benchmarks.cold_start [--runs 3] [--scale 1.0]
+"""
+import argparse
+import importlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HANDLERS = [
+    "chatbot",
+    "image_generator",
+    "gemini_image_generator",
+    "nano_banana_generator",
+    "gemini_chat",
+    "gemini_pro_chat",
+    "add_user_profile",
+]
+
+# Per-function environment from serverless.yml that changes init behaviour
+FUNCTION_ENV = {
+    "gemini_image_generator": {"WARM_MODELS": "imagen-3.0-generate-001"},
+    "nano_banana_generator": {"WARM_MODELS": "imagegeneration@006"},
+}
+
+# What every handler paid before providers were built lazily
+EAGER = "(eager imports)"
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _run_child(name, scale):
+    from benchmarks import fakes
+    from benchmarks.events import sample_events
+
+    fakes.install(scale=scale)
+    os.environ.setdefault("USER_PROFILES_TABLE", "offline-user-profiles")
+    os.environ.update(FUNCTION_ENV.get(name, {}))
+
+    start = time.perf_counter()
+    if name == EAGER:
+        import google.generativeai as genai
+        import langchain_openai
+        import openai
+        import vertexai
+
+        # The old handler.py imported these at module level and only used them per request
+        importlib.import_module("vertexai.preview.vision_models")
+        importlib.import_module("boto3")
+        openai.OpenAI(api_key="sk-offline")
+        genai.configure(api_key="gemini-offline")
+        vertexai.init(project="offline-project", location="us-central1")
+        langchain_openai.ChatOpenAI()
+        import_ms = (time.perf_counter() - start) * 1000
+        result = {"import_ms": import_ms, "first_ms": 0.0, "warm_ms": 0.0}
+    else:
+        import handler
+        import_ms = (time.perf_counter() - start) * 1000
+
+        function = getattr(handler, name)
+        event = sample_events()[name]
+        start = time.perf_counter()
+        function(event, None)
+        first_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        function(event, None)
+        warm_ms = (time.perf_counter() - start) * 1000
+        result = {"import_ms": import_ms, "first_ms": first_ms, "warm_ms": warm_ms}
+
+    result["sdks"] = list(fakes.imported)
+    print("RESULT " + json.dumps(result))
+
+
+def _measure(name, scale):
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.cold_start", "--child", name, "--scale", str(scale)],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    ).stdout
+    line = next(line for line in output.splitlines() if line.startswith("RESULT "))
+    return json.loads(line[len("RESULT "):])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="multiplier for the simulated SDK import/init costs")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _run_child(args.child, args.scale)
+        return
+
+    print(f"{'handler':<26}{'import ms':>11}{'1st call ms':>13}{'cold total':>12}{'warm ms':>10}  sdks")
+    for name in [EAGER] + HANDLERS:
+        runs = [_measure(name, args.scale) for _ in range(args.runs)]
+        import_ms = statistics.median(run["import_ms"] for run in runs)
+        first_ms = statistics.median(run["first_ms"] for run in runs)
+        warm_ms = statistics.median(run["warm_ms"] for run in runs)
+        sdks = ", ".join(runs[-1]["sdks"]) or "-"
+        print(f"{name:<26}{import_ms:>11.1f}{first_ms:>13.1f}{import_ms + first_ms:>12.1f}{warm_ms:>10.1f}  {sdks}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""Concurrent compare_models against calling the chat backends one after another
+
+Fake backends answer after the given latencies; one of them can be made slower
+than the deadline to show it being cancelled.
+
+    python -m benchmarks.compare_models [--gpt 0.8] [--flash 0.5] [--pro 3.0] [--deadline 2.0]
+"""
+import argparse
+import contextlib
+import json
+import os
+import time
+
+from benchmarks import fakes
+from benchmarks.events import http_event, sample_events
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--gpt", type=float, default=0.8)
+    parser.add_argument("--flash", type=float, default=0.5)
+    parser.add_argument("--pro", type=float, default=3.0)
+    parser.add_argument("--deadline", type=float, default=2.0)
+    args = parser.parse_args()
+
+    fakes.install(scale=0)
+    fakes.MODEL_LATENCY.update({"gpt-4o": args.gpt, "gemini-2.0-flash": args.flash,
+                                "gemini-3-pro-preview": args.pro})
+
+    import handler
+
+    events = sample_events()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        handler.chatbot(events["chatbot"], None)
+        handler.gemini_chat(http_event({"prompt": "Write a slogan for a bakery (sequential)"}), None)
+        handler.gemini_pro_chat(http_event({"prompt": "Write a slogan for a bakery (sequential)"}), None)
+        sequential = time.perf_counter() - start
+
+        start = time.perf_counter()
+        response = handler.compare_models(http_event({"prompt": "Write a slogan for a bakery",
+                                                      "deadline": args.deadline}), None)
+        concurrent = time.perf_counter() - start
+    body = json.loads(response["body"])
+
+    print(f"sequential, all three backends: {sequential:.2f} s")
+    print(f"compare_models, deadline {args.deadline} s: {concurrent:.2f} s")
+    for result in body["results"]:
+        print(f"  {result['backend']:<22}{result['status']:<10}{result.get('latency_ms', '-')}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Long profile contexts with and without provider-side context caching
+
+A user whose business description runs to several thousand tokens sends
+different prompts to each chat handler (response cache bypassed). The fakes
+charge --prefill seconds per 1000 input tokens they have to process, and
+tokens read from a context cache are free, like the real providers. Reports
+latency and input tokens per request with CONTEXT_CACHE_ENABLED off and on.
+
+    python -m benchmarks.context_cache [--requests 30] [--prefix-tokens 6000] [--prefill 0.05]
+"""
+import argparse
+import contextlib
+import os
+import statistics
+
+from benchmarks import fakes
+from benchmarks.events import SERVER_API_KEY, function_url_event, http_event, profile_records
+
+HANDLERS = ("chatbot", "gemini_chat", "gemini_pro_chat")
+
+
+def _event(name, number, user_id):
+    prompt = f"Write slogan number {number} for our weekend sale"
+    # A UserID is only taken from server callers
+    headers = {"cache-control": "no-cache", "x-server-key": SERVER_API_KEY}
+    if name == "chatbot":
+        return http_event({"question": prompt, "UserID": user_id}, headers)
+    if name == "gemini_pro_chat":
+        return function_url_event({"prompt": prompt, "UserID": user_id}, headers)
+    return http_event({"prompt": prompt, "UserID": user_id}, headers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=30, help="requests per handler")
+    parser.add_argument("--prefix-tokens", type=int, default=6000, help="size of the business description")
+    parser.add_argument("--prefill", type=float, default=0.05, help="seconds per 1000 uncached input tokens")
+    args = parser.parse_args()
+
+    fakes.install(scale=0)
+    os.environ["USER_PROFILES_TABLE"] = "offline-user-profiles"
+    import context_cache
+    import handler
+    import metrics
+
+    profile = dict(profile_records(1)[0])
+    sentence = "We bake sourdough, rye and challah every morning with flour from local mills. "
+    profile["OptBizChar"] = (sentence * (args.prefix_tokens * 4 // len(sentence) + 1))[:args.prefix_tokens * 4]
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        handler.add_user_profile(http_event(profile, {"x-api-key": SERVER_API_KEY}), None)
+    fakes.PREFILL["seconds_per_1k_tokens"] = args.prefill
+
+    print(f"{args.requests} requests per handler, ~{args.prefix_tokens} token context, "
+          f"{args.prefill * 1000:.0f} ms per 1k uncached input tokens\n")
+    print(f"{'handler':<18}{'context cache':>14}{'p50 ms':>9}{'input tok':>11}{'cached tok':>12}{'billed tok':>12}")
+    for enabled in (False, True):
+        context_cache.CONTEXT_CACHE_ENABLED = enabled
+        fakes._openai_prefixes.clear()
+        with metrics.capture() as documents, open(os.devnull, "w") as devnull, \
+                contextlib.redirect_stdout(devnull):
+            for number in range(args.requests):
+                for name in HANDLERS:
+                    getattr(handler, name)(_event(name, number, profile["UserID"]), None)
+        for name in HANDLERS:
+            rows = [document for document in documents if document["Function"] == name]
+            input_tokens = statistics.mean(row.get("InputTokens", 0) for row in rows)
+            cached_tokens = statistics.mean(row.get("CachedTokens", 0) for row in rows)
+            print(f"{name:<18}{'on' if enabled else 'off':>14}"
+                  f"{statistics.median(row['TotalMs'] for row in rows):>9.0f}"
+                  f"{input_tokens:>11.0f}{cached_tokens:>12.0f}{input_tokens - cached_tokens:>12.0f}")
+
+    print("\nOpenAI caches long prefixes by itself; the prompt_cache_key only keeps repeats on one cache.")
+    print(f"gemini registry: {context_cache.gemini_contexts.stats()}, "
+          f"{len(fakes.cached_contents)} Gemini caches live")
+    print(f"openai registry: {context_cache.openai_contexts.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Sample API Gateway (httpApi) and Function URL events for each handler"""
+import json
+import time
+import uuid
+
+ORIGIN = "https://broadcust.co.il"
+SERVER_API_KEY = "offline-server-key"
+
+API_DOMAIN = "abc123def4.execute-api.us-east-1.amazonaws.com"
+FUNCTION_URL_DOMAIN = "abcdefghijklmnopqrstuvwxyz012345.lambda-url.us-east-1.on.aws"
+
+
+def http_event(body, headers=None, path="/", domain=API_DOMAIN, route_key=None):
+    """Build a payload-format 2.0 event like API Gateway and Function URLs send"""
+    event_headers = {
+        "accept": "*/*",
+        "accept-encoding": "gzip, deflate, br",
+        "content-type": "application/json",
+        "host": domain,
+        "origin": ORIGIN,
+        "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/126.0 Safari/537.36",
+        "x-amzn-trace-id": "Root=1-67890abc-0123456789abcdef01234567",
+        "x-forwarded-for": "203.0.113.10",
+        "x-forwarded-port": "443",
+        "x-forwarded-proto": "https",
+    }
+    event_headers.update(headers or {})
+    raw_body = json.dumps(body)
+    now = time.time()
+    return {
+        "version": "2.0",
+        "routeKey": route_key or f"POST {path}",
+        "rawPath": path,
+        "rawQueryString": "",
+        "headers": event_headers,
+        "requestContext": {
+            "accountId": "123456789012",
+            "apiId": domain.split(".")[0],
+            "domainName": domain,
+            "domainPrefix": domain.split(".")[0],
+            "http": {
+                "method": "POST",
+                "path": path,
+                "protocol": "HTTP/1.1",
+                "sourceIp": "203.0.113.10",
+                "userAgent": event_headers["user-agent"],
+            },
+            "requestId": uuid.uuid4().hex[:16],
+            "routeKey": route_key or f"POST {path}",
+            "stage": "$default",
+            "time": time.strftime("%d/%b/%Y:%H:%M:%S +0000", time.gmtime(now)),
+            "timeEpoch": int(now * 1000),
+        },
+        "body": raw_body,
+        "isBase64Encoded": False,
+    }
+
+
+def function_url_event(body, headers=None):
+    """Event for a Lambda Function URL (same payload format, $default route)"""
+    return http_event(body, headers, domain=FUNCTION_URL_DOMAIN, route_key="$default")
+
+
+def profile_records(count, start=0):
+    """count valid user profiles with distinct UserIDs"""
+    return [{
+        "UserID": f"user-{number}",
+        "Mobile": f"+972-50-{number % 1000:03d}-{number % 10000:04d}",
+        "Email": f"owner{number}@bakery.example",
+        "RawBizChar": "Family bakery in Haifa",
+        "OptBizChar": "Artisan family bakery in Haifa known for sourdough",
+    } for number in range(start, start + count)]
+
+
+def ndjson_event(records, headers=None, path="/"):
+    """httpApi event whose body is one JSON record per line"""
+    event = http_event(None, dict({"content-type": "application/x-ndjson"}, **(headers or {})), path=path)
+    event["body"] = "\n".join(json.dumps(record) for record in records) + "\n"
+    return event
+
+
+def sample_events():
+    """One representative event per handler in serverless.yml"""
+    return {
+        "chatbot": http_event({"question": "Write a slogan for a bakery"}, path="/prompt"),
+        "image_generator": http_event({"prompt": "A bakery storefront at dawn"}, path="/generate-image"),
+        "gemini_image_generator": http_event({"prompt": "A bakery storefront at dawn"},
+                                             path="/generate-image-gemini"),
+        "nano_banana_generator": http_event({"prompt": "A bakery storefront at dawn"},
+                                            path="/generate-image-nano-banana"),
+        "gemini_chat": http_event({"prompt": "Write a slogan for a bakery"}, path="/prompt-gemini"),
+        "gemini_pro_chat": function_url_event({"prompt": "Write a campaign plan for a bakery"}),
+        "compare_models": http_event({"prompt": "Write a slogan for a bakery"}, path="/prompt-compare"),
+        "chat_session": http_event({"message": "Write a slogan for a bakery"}, path="/chat-session"),
+        "add_user_profile": http_event({
+            "UserID": "user-1",
+            "Mobile": "+972-50-123-4567",
+            "Email": "owner@bakery.example",
+            "RawBizChar": "Family bakery in Haifa",
+            "OptBizChar": "Artisan family bakery in Haifa known for sourdough",
+        }, headers={"x-api-key": SERVER_API_KEY}, path="/add-user-profile"),
+        "add_user_profiles_bulk": ndjson_event(profile_records(100), headers={"x-api-key": SERVER_API_KEY},
+                                               path="/add-user-profiles/bulk"),
+    }
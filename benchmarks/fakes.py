@@ -0,0 +1,660 @@
+"""Offline stand-ins for the provider SDKs (and conf.py) that handler.py uses
+
+install() puts a finder in front of sys.meta_path so that importing openai,
+langchain_openai, google.generativeai, vertexai, boto3 or conf yields a small
+fake module instead. Each fake sleeps for a configurable time on import, on
+its init call and on the first call to its service (opening the connection) so
+cold-start cost can be measured without network or secrets.
+Provider calls have configurable latencies (fixed or drawn from a
+distribution), error rates and status codes, hangs, and payload sizes; they
+honour the timeout the caller passes, like the SDKs do.
+"""
+import asyncio
+import base64
+import importlib.abc
+import importlib.machinery
+import io
+import math
+import os
+import random
+import sys
+import time
+
+# Seconds spent importing each SDK, roughly what we see on an arm64 Lambda
+IMPORT_COST = {
+    "openai": 0.35,
+    "langchain_openai": 1.10,
+    "google.generativeai": 0.90,
+    "vertexai": 1.40,
+    "boto3": 0.25,
+}
+
+# Seconds spent in one-off client setup calls
+INIT_COST = {
+    "genai.configure": 0.01,
+    "vertexai.init": 0.40,
+    "ImageGenerationModel.from_pretrained": 0.30,
+}
+
+# Seconds the first call to each service spends opening its connection (TLS,
+# gRPC channel); later calls reuse it, like the pooled clients in providers.py
+CONNECT_COST = {
+    "openai": 0.15,
+    "gemini": 0.20,
+    "vertex": 0.20,
+    "dynamodb": 0.05,
+}
+
+# Seconds each fake provider call takes (independent of the simulated import cost)
+CALL_LATENCY = {
+    "openai.images": 0.0,
+    "imagen": 0.0,
+    "dynamodb": 0.0,
+    "gemini.cache": 0.0,
+}
+
+# Seconds a chat/Gemini call spends per 1000 input tokens it has to process
+# (tokens read from a provider cache are free)
+PREFILL = {"seconds_per_1k_tokens": 0.0}
+
+# Extra seconds a chat/Gemini/image call takes, by model name; latencies may
+# also be zero-argument callables returning seconds (see lognormal())
+MODEL_LATENCY = {}
+
+# Probability that a call fails, by model name ("dynamodb" for table calls,
+# "dynamodb.unprocessed" for each item BatchWriteItem leaves unprocessed)
+ERROR_RATE = {}
+
+# HTTP status of those simulated errors, by name (500 if not listed); 429 and
+# 5xx are what the provider layer retries, 400 is a bad request
+ERROR_STATUS = {}
+
+# Probability that a call hangs, by model name: it sleeps HANG_SECONDS, or
+# until the timeout its caller passed and then raises FakeTimeoutError
+HANG_RATE = {}
+HANG_SECONDS = {"seconds": 300.0}
+
+# Provider calls made so far (every attempt, including failed ones), by model name
+calls = {}
+
+# Size of what the fakes return
+PAYLOAD = {
+    "chat_chars": 0,  # filler characters added to every chat answer
+    "image_bytes": 64 * 1024,
+}
+
+# Fake SDK modules loaded so far, in import order
+imported = []
+
+# Services whose connection is open
+connected = set()
+
+# Answers boto3.client("lambda").invoke(): function(FunctionName, Payload bytes) -> response payload bytes
+LAMBDA = {"invoke": None}
+
+_scale = 1.0
+_random = random.Random(0)
+
+
+class FakeProviderError(Exception):
+    """Shaped like the openai and google.api_core errors: status_code carries the HTTP status"""
+
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class FakeTimeoutError(FakeProviderError, TimeoutError):
+    """Shaped like openai.APITimeoutError and google.api_core DeadlineExceeded"""
+
+    def __init__(self, message):
+        super().__init__(message, 504)
+
+
+def seed(value):
+    _random.seed(value)
+
+
+def lognormal(median, sigma=0.5):
+    """Latency distribution with the given median (seconds) and a long right tail"""
+    return lambda: _random.lognormvariate(math.log(median), sigma) if median > 0 else 0.0
+
+
+def _seconds(latency):
+    return latency() if callable(latency) else latency
+
+
+def _model_latency(model_name):
+    return _seconds(MODEL_LATENCY.get(model_name, 0.0))
+
+
+def _maybe_fail(name):
+    rate = ERROR_RATE.get(name, 0.0)
+    if rate and _random.random() < rate:
+        raise FakeProviderError(f"Simulated {name} error", ERROR_STATUS.get(name, 500))
+
+
+def _call_seconds(name, seconds, timeout):
+    """Seconds a provider call sleeps (and whether it then times out), counting the call"""
+    calls[name] = calls.get(name, 0) + 1
+    rate = HANG_RATE.get(name, 0.0)
+    if rate and _random.random() < rate:
+        seconds += HANG_SECONDS["seconds"]
+    if timeout is not None and seconds > timeout:
+        return timeout, True
+    return seconds, False
+
+
+def _provider_call(name, seconds, timeout=None):
+    """Sleep like a provider call taking seconds; FakeTimeoutError once timeout passes"""
+    seconds, timed_out = _call_seconds(name, seconds, timeout)
+    time.sleep(seconds)
+    if timed_out:
+        raise FakeTimeoutError(f"Simulated {name} timeout after {timeout:.1f}s")
+    _maybe_fail(name)
+
+
+async def _provider_call_async(name, seconds, timeout=None):
+    seconds, timed_out = _call_seconds(name, seconds, timeout)
+    await asyncio.sleep(seconds)
+    if timed_out:
+        raise FakeTimeoutError(f"Simulated {name} timeout after {timeout:.1f}s")
+    _maybe_fail(name)
+
+
+def _answer(model_name, prompt):
+    filler = (" Fresh bread daily." * (PAYLOAD["chat_chars"] // 19 + 1))[:PAYLOAD["chat_chars"]]
+    return f"[{model_name}] {prompt}{filler}"
+
+
+def _pause(cost):
+    if cost:
+        time.sleep(cost * _scale)
+
+
+def _connect(service):
+    if service not in connected:
+        connected.add(service)
+        _pause(CONNECT_COST.get(service, 0))
+
+
+class _Obj:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+def _tokens(text):
+    return max(1, len(text) // 4)
+
+
+def _parts(prompt):
+    """Texts of a Gemini prompt: a string or a list of {"role", "parts"} contents"""
+    if isinstance(prompt, str):
+        return [prompt]
+    return [part for content in prompt for part in content["parts"]]
+
+
+# openai / langchain_openai
+
+class FakeOpenAI:
+    def __init__(self, api_key=None, **kwargs):
+        self.api_key = api_key
+        self.images = _Obj(generate=self._generate_image)
+        self.models = _Obj(list=self._list_models)
+
+    def with_options(self, **kwargs):
+        return self
+
+    def _list_models(self, **kwargs):
+        _connect("openai")
+        return _Obj(data=[_Obj(id=name) for name in ("gpt-4o", "dall-e-3")])
+
+    def _generate_image(self, model, prompt, size="1024x1024", quality="standard", n=1,
+                        response_format="url", timeout=None, **kwargs):
+        _connect("openai")
+        _provider_call(model, _seconds(CALL_LATENCY["openai.images"]) + _model_latency(model), timeout)
+        if response_format == "b64_json":
+            image = io.BytesIO()
+            FakePilImage().save(image)
+            encoded = base64.b64encode(image.getvalue()).decode("ascii")
+            return _Obj(data=[_Obj(b64_json=encoded, url=None) for _ in range(n)])
+        return _Obj(data=[_Obj(url=f"https://example.invalid/{model}/{i}.png") for i in range(n)])
+
+
+def _prefill_seconds(tokens):
+    return tokens / 1000 * PREFILL["seconds_per_1k_tokens"]
+
+
+# Prompt prefixes OpenAI would have cached, as (prompt_cache_key, prefix)
+_openai_prefixes = set()
+
+
+class FakeChatOpenAI:
+    def __init__(self, temperature=0.7, model_name="gpt-4o", streaming=False, **kwargs):
+        self.temperature = temperature
+        self.model_name = model_name
+
+    def invoke(self, question, prompt_cache_key=None, timeout=None, **kwargs):
+        message, uncached = self._message(question, prompt_cache_key)
+        _connect("openai")
+        _provider_call(self.model_name, _model_latency(self.model_name) + _prefill_seconds(uncached), timeout)
+        return message
+
+    async def ainvoke(self, question, prompt_cache_key=None, timeout=None, **kwargs):
+        message, uncached = self._message(question, prompt_cache_key)
+        _connect("openai")
+        await _provider_call_async(self.model_name, _model_latency(self.model_name) + _prefill_seconds(uncached),
+                                   timeout)
+        return message
+
+    def _message(self, question, prompt_cache_key=None):
+        # A string, or (role, text) messages; the answer echoes the last one
+        messages = [("human", question)] if isinstance(question, str) else question
+        content = _answer(self.model_name, messages[-1][1])
+        input_tokens = sum(_tokens(text) for _, text in messages)
+        # Like OpenAI, a prefix of 1024+ tokens is read from cache when it was seen before
+        prefix = "".join(text for _, text in messages[:-1])
+        cached = 0
+        if _tokens(prefix) >= 1024:
+            if (prompt_cache_key, prefix) in _openai_prefixes:
+                cached = _tokens(prefix)
+            _openai_prefixes.add((prompt_cache_key, prefix))
+        return _Obj(content=content, usage_metadata={
+            "input_tokens": input_tokens,
+            "output_tokens": _tokens(content),
+            "total_tokens": input_tokens + _tokens(content),
+            "input_token_details": {"cache_read": cached},
+        }), input_tokens - cached
+
+
+# httpx (the connection pool providers.py hands to the OpenAI clients)
+
+class FakeHttpClient:
+    def __init__(self, limits=None, timeout=None, **kwargs):
+        self.limits = limits
+        self.timeout = timeout
+
+
+# google.generativeai
+
+# Shape of a fake Gemini generation: number of chunks and seconds before each
+GENERATION = {"chunks": 1, "first_chunk_delay": 0.0, "chunk_delay": 0.0}
+
+
+class FakeStreamResponse:
+    def __init__(self, pieces):
+        self._pieces = pieces
+        self.candidates = [_Obj(finish_reason="STOP", safety_ratings=[])]
+
+    def __iter__(self):
+        for i, piece in enumerate(self._pieces):
+            time.sleep(GENERATION["first_chunk_delay"] if i == 0 else GENERATION["chunk_delay"])
+            yield _Obj(text=piece)
+
+
+# Gemini context caches by name
+cached_contents = {}
+
+
+class FakeCachedContent:
+    def __init__(self, model, system_instruction, ttl):
+        self.name = f"cachedContents/{len(cached_contents) + 1}"
+        self.model = model
+        self.system_instruction = system_instruction
+        self.expire_time = time.time() + ttl.total_seconds()
+        self.updates = 0
+
+    @classmethod
+    def create(cls, model, system_instruction=None, ttl=None, display_name=None, **kwargs):
+        time.sleep(_seconds(CALL_LATENCY["gemini.cache"]))
+        _maybe_fail("gemini.cache")
+        cached_content = cls(model, system_instruction, ttl)
+        cached_contents[cached_content.name] = cached_content
+        return cached_content
+
+    def update(self, ttl=None, **kwargs):
+        time.sleep(_seconds(CALL_LATENCY["gemini.cache"]))
+        self.expire_time = time.time() + ttl.total_seconds()
+        self.updates += 1
+
+    def delete(self):
+        time.sleep(_seconds(CALL_LATENCY["gemini.cache"]))
+        cached_contents.pop(self.name, None)
+
+
+class FakeGenerativeModel:
+    def __init__(self, model_name, system_instruction=None, cached_content=None, **kwargs):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self.cached_content = cached_content
+
+    @classmethod
+    def from_cached_content(cls, cached_content, **kwargs):
+        return cls(cached_content.model.split("/")[-1], cached_content=cached_content)
+
+    def _check_cache(self):
+        if self.cached_content is None:
+            return
+        if self.cached_content.name not in cached_contents or self.cached_content.expire_time <= time.time():
+            raise FakeProviderError(f"CachedContent not found: {self.cached_content.name}", 404)
+
+    def _cached_tokens(self):
+        return _tokens(self.cached_content.system_instruction) if self.cached_content else 0
+
+    def _prompt_tokens(self, prompt):
+        system_tokens = _tokens(self.system_instruction) if self.system_instruction else 0
+        return sum(_tokens(part) for part in _parts(prompt)) + system_tokens + self._cached_tokens()
+
+    def _latency(self, prompt):
+        return _model_latency(self.model_name) + \
+            _prefill_seconds(self._prompt_tokens(prompt) - self._cached_tokens())
+
+    def _usage(self, prompt, text):
+        return _Obj(prompt_token_count=self._prompt_tokens(prompt), candidates_token_count=_tokens(text),
+                    cached_content_token_count=self._cached_tokens())
+
+    def _pieces(self, prompt, generation_config=None):
+        answer = _answer(self.model_name, _parts(prompt)[-1])
+        # Like Gemini, the answer stops at max_output_tokens
+        max_tokens = (generation_config or {}).get("max_output_tokens")
+        pieces = [answer[:max_tokens * 4] if max_tokens else answer]
+        pieces += [f" chunk {i}" for i in range(1, GENERATION["chunks"])]
+        return pieces
+
+    def count_tokens(self, contents, request_options=None, **kwargs):
+        _connect("gemini")
+        return _Obj(total_tokens=sum(_tokens(part) for part in _parts(contents)))
+
+    def generate_content(self, prompt, generation_config=None, stream=False, request_options=None, **kwargs):
+        self._check_cache()
+        _connect("gemini")
+        _provider_call(self.model_name, self._latency(prompt), (request_options or {}).get("timeout"))
+        response = FakeStreamResponse(self._pieces(prompt, generation_config))
+        if stream:
+            return response
+        response.text = "".join(chunk.text for chunk in response)
+        response.usage_metadata = self._usage(prompt, response.text)
+        return response
+
+    async def generate_content_async(self, prompt, generation_config=None, request_options=None, **kwargs):
+        self._check_cache()
+        _connect("gemini")
+        await _provider_call_async(self.model_name, self._latency(prompt), (request_options or {}).get("timeout"))
+        response = FakeStreamResponse(self._pieces(prompt, generation_config))
+        response.text = "".join(self._pieces(prompt, generation_config))
+        response.usage_metadata = self._usage(prompt, response.text)
+        return response
+
+
+def _fake_configure(api_key=None, **kwargs):
+    _pause(INIT_COST["genai.configure"])
+
+
+def _fake_list_models():
+    return [_Obj(name=f"models/{name}") for name in ("gemini-2.0-flash", "gemini-3-pro-preview")]
+
+
+# vertexai
+
+class FakePilImage:
+    mode = "RGB"
+
+    def __init__(self, size=None):
+        self.size = PAYLOAD["image_bytes"] if size is None else size
+
+    def save(self, fp, format="PNG", **kwargs):
+        fp.write(b"\x89PNG\r\n\x1a\n" + b"\0" * self.size)
+
+
+class FakeImageGenerationModel:
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    @classmethod
+    def from_pretrained(cls, model_name):
+        _connect("vertex")
+        _pause(INIT_COST["ImageGenerationModel.from_pretrained"])
+        return cls(model_name)
+
+    def generate_images(self, prompt, number_of_images=1, **kwargs):
+        # No timeout argument: the caller has to stop waiting on its own
+        _connect("vertex")
+        _provider_call(self.model_name, _seconds(CALL_LATENCY["imagen"]) + _model_latency(self.model_name))
+        images = []
+        for _ in range(number_of_images):
+            pil_image = FakePilImage()
+            encoded = io.BytesIO()
+            pil_image.save(encoded)
+            images.append(_Obj(_pil_image=pil_image, _image_bytes=encoded.getvalue()))
+        return images
+
+
+def _fake_vertexai_init(project=None, location=None, **kwargs):
+    _pause(INIT_COST["vertexai.init"])
+
+
+# boto3
+
+# Partition keys of the tables in serverless.yml
+KEY_ATTRIBUTES = ("UserID", "CacheKey")
+
+# DynamoDB calls made so far, by operation
+dynamodb_calls = {}
+
+
+class FakeClientError(Exception):
+    """Shaped like botocore's ClientError"""
+
+    def __init__(self, code, message):
+        super().__init__(f"An error occurred ({code}): {message}")
+        self.response = {"Error": {"Code": code, "Message": message}}
+
+
+class FakeTable:
+    def __init__(self, name, items, meta):
+        self.name = name
+        self.items = items
+        self.meta = meta
+
+    @staticmethod
+    def _key(item):
+        # Sessions table: partition key SessionID, sort key Turn
+        if "SessionID" in item:
+            return item["SessionID"], int(item["Turn"])
+        return next(item[name] for name in KEY_ATTRIBUTES if name in item)
+
+    @staticmethod
+    def _call(operation="other"):
+        dynamodb_calls[operation] = dynamodb_calls.get(operation, 0) + 1
+        _connect("dynamodb")
+        time.sleep(_seconds(CALL_LATENCY["dynamodb"]))
+        _maybe_fail("dynamodb")
+
+    @staticmethod
+    def _condition(expression, item, values):
+        """attribute_not_exists(<key>), <attribute> = :value and <attribute> <= :value clauses joined by OR"""
+        for clause in expression.split(" OR "):
+            if clause.strip().startswith("attribute_not_exists("):
+                if item is None:
+                    return True
+                continue
+            operator = "<=" if "<=" in clause else "="
+            name, placeholder = (part.strip() for part in clause.split(operator))
+            if item is None or name not in item:
+                continue
+            if item[name] == values[placeholder] or (operator == "<=" and item[name] < values[placeholder]):
+                return True
+        return False
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeValues=None, **kwargs):
+        self._call("PutItem")
+        if ConditionExpression and not self._condition(ConditionExpression, self.items.get(self._key(Item)),
+                                                       ExpressionAttributeValues or {}):
+            raise FakeClientError("ConditionalCheckFailedException", "The conditional request failed")
+        self.items[self._key(Item)] = dict(Item)
+        return {}
+
+    def get_item(self, Key, **kwargs):
+        self._call("GetItem")
+        item = self.items.get(self._key(Key))
+        return {"Item": dict(item)} if item is not None else {}
+
+    def delete_item(self, Key, **kwargs):
+        self._call("DeleteItem")
+        self.items.pop(self._key(Key), None)
+        return {}
+
+    def query(self, ExpressionAttributeValues, **kwargs):
+        """The sessions query: SessionID = :session AND Turn > :through, in Turn order"""
+        self._call("Query")
+        session_id = ExpressionAttributeValues[":session"]
+        through = ExpressionAttributeValues[":through"]
+        keys = sorted(key for key in self.items
+                      if isinstance(key, tuple) and key[0] == session_id and key[1] > through)
+        return {"Items": [dict(self.items[key]) for key in keys]}
+
+
+class FakeDynamoDBClient:
+    """Low-level client (resource.meta.client); items use the {"S": value} wire format"""
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.batch_calls = 0
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        self.batch_calls += 1
+        FakeTable._call("BatchWriteItem")
+        if sum(len(requests) for requests in RequestItems.values()) > 25:
+            raise FakeProviderError("Too many items requested for the BatchWriteItem call", 400)
+        unprocessed = {}
+        for name, requests in RequestItems.items():
+            keys = [FakeTable._key(request["PutRequest"]["Item"]) for request in requests]
+            if len(set(map(str, keys))) != len(keys):
+                raise FakeProviderError("Provided list of item keys contains duplicates", 400)
+            items = self.tables.setdefault(name, {})
+            for request in requests:
+                if _random.random() < ERROR_RATE.get("dynamodb.unprocessed", 0.0):
+                    unprocessed.setdefault(name, []).append(request)
+                    continue
+                item = request["PutRequest"]["Item"]
+                items[FakeTable._key(item)["S"]] = {field: value["S"] for field, value in item.items()}
+        return {"UnprocessedItems": unprocessed}
+
+
+class FakeDynamoDB:
+    def __init__(self):
+        self.tables = {}
+        self.meta = _Obj(client=FakeDynamoDBClient(self.tables))
+
+    def Table(self, name):
+        return FakeTable(name, self.tables.setdefault(name, {}), self.meta)
+
+
+_dynamodb = FakeDynamoDB()
+
+
+class FakeLambdaClient:
+    def invoke(self, FunctionName, Payload=b"", InvocationType="RequestResponse", **kwargs):
+        return {"StatusCode": 200, "Payload": io.BytesIO(LAMBDA["invoke"](FunctionName, Payload))}
+
+
+def _fake_client(service_name, **kwargs):
+    if service_name != "lambda":
+        raise NotImplementedError(f"No fake boto3 client for {service_name}")
+    return FakeLambdaClient()
+
+
+def _build(name, module):
+    if name == "conf":
+        module.open_api_api_key = "sk-offline"
+        module.gemini_api_key = "gemini-offline"
+        module.gcp_project_id = "offline-project"
+        module.gcp_region = "us-central1"
+        module.api_secret_key = ""
+        module.server_api_key = "offline-server-key"
+    elif name == "openai":
+        module.OpenAI = FakeOpenAI
+    elif name == "httpx":
+        module.Client = FakeHttpClient
+        module.AsyncClient = FakeHttpClient
+        module.Limits = lambda **kwargs: _Obj(**kwargs)
+        module.Timeout = lambda timeout=None, **kwargs: _Obj(timeout=timeout, **kwargs)
+    elif name == "langchain_openai":
+        module.ChatOpenAI = FakeChatOpenAI
+    elif name == "google.generativeai":
+        module.configure = _fake_configure
+        module.list_models = _fake_list_models
+        module.GenerativeModel = FakeGenerativeModel
+    elif name == "google.generativeai.caching":
+        module.CachedContent = FakeCachedContent
+    elif name == "vertexai":
+        module.init = _fake_vertexai_init
+    elif name == "vertexai.preview.vision_models":
+        module.ImageGenerationModel = FakeImageGenerationModel
+    elif name == "boto3":
+        module.resource = lambda service_name, **kwargs: _dynamodb
+        module.client = _fake_client
+
+
+_MODULES = {
+    "conf": False,
+    "openai": False,
+    "httpx": False,
+    "langchain_openai": False,
+    "google": True,
+    "google.generativeai": True,
+    "google.generativeai.caching": False,
+    "vertexai": True,
+    "vertexai.preview": True,
+    "vertexai.preview.vision_models": False,
+    "boto3": False,
+}
+
+
+class _FakeFinder(importlib.abc.MetaPathFinder, importlib.abc.Loader):
+
+    def find_spec(self, fullname, path=None, target=None):
+        if fullname not in _MODULES:
+            return None
+        spec = importlib.machinery.ModuleSpec(fullname, self, is_package=_MODULES[fullname])
+        if _MODULES[fullname]:
+            spec.submodule_search_locations = []
+        return spec
+
+    def create_module(self, spec):
+        return None
+
+    def exec_module(self, module):
+        name = module.__name__
+        _pause(IMPORT_COST.get(name, 0))
+        if name in IMPORT_COST:
+            imported.append(name)
+        _build(name, module)
+
+
+_finder = _FakeFinder()
+
+
+def install(scale=1.0):
+    """Route SDK imports to the fakes; scale multiplies every simulated cost"""
+    global _scale
+    _scale = scale
+    # Every offline request comes from one client; benchmarks of admission control turn this back on
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+    if _finder not in sys.meta_path:
+        sys.meta_path.insert(0, _finder)
+
+
+def uninstall():
+    if _finder in sys.meta_path:
+        sys.meta_path.remove(_finder)
+    for name in _MODULES:
+        sys.modules.pop(name, None)
+    imported.clear()
+    connected.clear()
+
+
+def dynamodb_items(table_name):
+    """Items written to the fake DynamoDB table"""
+    return _dynamodb.tables.get(table_name, {})
+
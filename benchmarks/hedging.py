@@ -0,0 +1,62 @@
+"""Tail latency of gemini_chat with and without hedging against gpt-4o
+
+The fake gemini-2.0-flash answers in --fast seconds most of the time and in
+--slow seconds for --tail-rate of requests; the fake gpt-4o backup always
+takes --backup seconds.
+
+    python -m benchmarks.hedging [--requests 200] [--tail-rate 0.03]
+"""
+import argparse
+import contextlib
+import os
+import random
+import time
+
+from benchmarks import fakes
+from benchmarks.events import http_event
+
+
+def _percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(p / 100 * (len(ordered) - 1)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--fast", type=float, default=0.3)
+    parser.add_argument("--slow", type=float, default=2.0)
+    parser.add_argument("--tail-rate", type=float, default=0.03)
+    parser.add_argument("--backup", type=float, default=0.6)
+    args = parser.parse_args()
+
+    fakes.install(scale=0)
+    rng = random.Random(7)
+    fakes.MODEL_LATENCY.update({
+        "gemini-2.0-flash": lambda: args.slow if rng.random() < args.tail_rate else args.fast * rng.uniform(0.8, 1.2),
+        "gpt-4o": args.backup,
+    })
+
+    import hedging
+    import handler
+
+    hedging.HEDGE_MIN_SAMPLES = 10
+    rows = []
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for hedge in (False, True):
+            latencies = []
+            for i in range(args.requests):
+                event = http_event({"prompt": f"Slogan #{i} for a bakery (hedge={hedge})", "hedge": hedge})
+                start = time.perf_counter()
+                handler.gemini_chat(event, None)
+                latencies.append((time.perf_counter() - start) * 1000)
+            rows.append((hedge, latencies))
+    print(f"{'mode':<10}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for hedge, latencies in rows:
+        print(f"{'hedged' if hedge else 'plain':<10}{_percentile(latencies, 50):>9.0f}"
+              f"{_percentile(latencies, 99):>9.0f}{max(latencies):>9.0f}")
+    print(f"hedge stats: {hedging.stats('gemini-2.0-flash').summary()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Wall-clock time of batch image requests at different concurrency limits
+
+Fake DALL-E and Imagen calls take --latency seconds each, so the speedup of
+fanning a batch out over concurrent calls is visible without a provider.
+
+    python -m benchmarks.image_batch [--variants 8] [--latency 1.0]
+"""
+import argparse
+import contextlib
+import json
+import os
+import time
+
+from benchmarks import fakes
+from benchmarks.events import http_event
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--variants", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=1.0)
+    args = parser.parse_args()
+
+    fakes.install(scale=0)
+    fakes.CALL_LATENCY.update({"openai.images": args.latency, "imagen": args.latency})
+
+    import image_batch
+    import handler
+
+    image_batch.BATCH_CONCURRENCY = max(args.variants, image_batch.BATCH_CONCURRENCY)
+    image_batch.MAX_BATCH_ITEMS = max(args.variants, image_batch.MAX_BATCH_ITEMS)
+
+    print(f"{'endpoint':<26}{'concurrency':>12}{'calls':>7}{'wall s':>9}{'ok':>5}")
+    for name in ("image_generator", "gemini_image_generator"):
+        for concurrency in (1, 2, 4, args.variants):
+            event = http_event({"prompt": "A bakery storefront at dawn", "variants": args.variants,
+                                "concurrency": concurrency})
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                start = time.perf_counter()
+                response = getattr(handler, name)(event, None)
+                seconds = time.perf_counter() - start
+            body = json.loads(response["body"])
+            model = "dall-e-3" if name == "image_generator" else "imagen-3.0-generate-001"
+            calls = len(image_batch.plan(["p"], args.variants, image_batch.MAX_IMAGES_PER_CALL[model]))
+            print(f"{name:<26}{concurrency:>12}{calls:>7}{seconds:>9.2f}{body['succeeded']:>5}")
+
+
+if __name__ == "__main__":
+    main()
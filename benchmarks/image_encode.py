@@ -0,0 +1,101 @@
+"""Encode time, peak Python memory and response size per image output mode
+
+Uses a real Pillow image shaped like an Imagen result (PNG bytes plus a lazily
+decoded PIL image) and compares the original base64-in-JSON path with the
+image_output modes and formats. Needs Pillow installed.
+
+    python -m benchmarks.image_encode [--size 1024] [--runs 5]
+"""
+import argparse
+import base64
+import io
+import json
+import statistics
+import time
+import tracemalloc
+
+from PIL import Image
+
+import image_output
+
+
+class GeneratedImage:
+    """Mimics vertexai's GeneratedImage: PNG bytes, PIL image decoded on access"""
+
+    def __init__(self, png_bytes):
+        self._image_bytes = png_bytes
+
+    @property
+    def _pil_image(self):
+        return Image.open(io.BytesIO(self._image_bytes))
+
+
+def _make_image(size):
+    noise = Image.effect_noise((size, size), 48)
+    gradient = Image.linear_gradient("L").resize((size, size))
+    pil_image = Image.merge("RGB", (noise, gradient, noise.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    buffer = io.BytesIO()
+    pil_image.save(buffer, format="PNG")
+    return GeneratedImage(buffer.getvalue())
+
+
+def _legacy(generated_image):
+    img_byte_arr = io.BytesIO()
+    generated_image._pil_image.save(img_byte_arr, format='PNG')
+    img_byte_arr = img_byte_arr.getvalue()
+    image_base64 = base64.b64encode(img_byte_arr).decode('utf-8')
+    return json.dumps({
+        "image_data": f"data:image/png;base64,{image_base64}",
+        "prompt": "benchmark",
+        "model": "imagen-3.0-vertex-ai"
+    })
+
+
+def _new(generated_image, mode, fmt, quality):
+    data, content_type = image_output.encode(generated_image, fmt, quality)
+    url = "https://example.invalid/image" if mode == "presigned_url" else None
+    response = image_output.build_response(mode, data, content_type,
+                                           {"prompt": "benchmark", "model": "imagen-3.0-vertex-ai"},
+                                           {}, url=url)
+    return response["body"]
+
+
+def _measure(function, runs):
+    times, peaks = [], []
+    size = 0
+    for _ in range(runs):
+        tracemalloc.start()
+        start = time.perf_counter()
+        body = function()
+        times.append(time.perf_counter() - start)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        size = len(body)
+    return statistics.median(times), max(peaks), size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--quality", type=int, default=image_output.DEFAULT_QUALITY)
+    args = parser.parse_args()
+
+    generated_image = _make_image(args.size)
+    print(f"source PNG: {len(generated_image._image_bytes) / 1024:.0f} KiB")
+
+    cases = [("legacy base64 json", "png", lambda: _legacy(generated_image))]
+    for fmt in ("png", "jpeg", "webp"):
+        quality = None if fmt == "png" else args.quality
+        for mode in ("data_url", "binary", "presigned_url"):
+            cases.append((f"{mode} {fmt}", fmt,
+                          lambda mode=mode, fmt=fmt, quality=quality: _new(generated_image, mode, fmt, quality)))
+
+    print(f"{'mode':<24}{'encode ms':>11}{'peak KiB':>11}{'body KiB':>11}")
+    for name, fmt, function in cases:
+        seconds, peak, size = _measure(function, args.runs)
+        print(f"{name:<24}{seconds * 1000:>11.1f}{peak / 1024:>11.0f}{size / 1024:>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
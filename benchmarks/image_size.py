@@ -0,0 +1,178 @@
+"""Per-family images against the single image: size, init and first-request imports
+
+Installs with pip, the way the Dockerfile does, the dependencies of the one
+image every function used before (requirements.txt before the split) and of
+each family image in serverless.yml, each into its own directory under
+--build-dir, next to a copy of the function code and an offline conf.py.
+Family images are byte-compiled like the image build; the old image only had
+pip's bytecode for its dependencies. Installs are reused while the
+requirements do not change.
+
+Then, for every function in serverless.yml, a fresh interpreter that sees
+only its image's directory (and boto3, which the Lambda base image provides)
+times `import handler`, which is the Lambda init phase, and the imports of
+the SDKs its first request builds. The real SDKs are imported, nothing is
+called. Wheels are this machine's, not arm64, so sizes are close, not exact.
+
+    python -m benchmarks.image_size [--build-dir /tmp/image-size] [--runs 5]
+"""
+import argparse
+import compileall
+import glob
+import hashlib
+import json
+import os
+import py_compile
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# requirements.txt as it was when every function shared chatbot_image
+BEFORE = [
+    "langchain", "langchain_community", "langchain_openai", "openai", "urllib3==1.26.17",
+    "weaviate-client", "google-generativeai>=0.8.0", "google-cloud-aiplatform>=1.38.0", "pillow", "orjson",
+]
+
+# SDKs each function's first request imports (providers.py builds them lazily)
+FIRST_IMPORTS = {
+    "chatbot": ["langchain_openai"],
+    "image_generator": ["openai"],
+    "gemini_image_generator": ["vertexai", "vertexai.preview.vision_models", "PIL.Image"],
+    "nano_banana_generator": ["vertexai", "vertexai.preview.vision_models", "PIL.Image"],
+    "gemini_chat": ["google.generativeai"],
+    "gemini_pro_chat": ["google.generativeai"],
+    "compare_models": ["langchain_openai", "google.generativeai"],
+    "chat_session": ["langchain_openai"],
+    "job_status": ["boto3"],
+    "job_worker": ["boto3"],
+    "add_user_profile": ["boto3"],
+    "add_user_profiles_bulk": ["boto3"],
+}
+
+OFFLINE_CONF = '''open_api_api_key = "sk-offline"
+gemini_api_key = "gemini-offline"
+gcp_project_id = "offline-project"
+gcp_region = "us-central1"
+api_secret_key = ""
+server_api_key = "offline-server-key"
+'''
+
+CHILD = '''
+import importlib, json, sys, time
+start = time.perf_counter()
+sys.path[:0] = {paths!r}
+import handler
+init_ms = (time.perf_counter() - start) * 1000
+start = time.perf_counter()
+for name in {imports!r}:
+    importlib.import_module(name)
+print(json.dumps({{"init_ms": init_ms, "first_ms": (time.perf_counter() - start) * 1000}}))
+'''
+
+
+def serverless_images():
+    """(function -> image, image -> FAMILY) from serverless.yml; chatbot_image builds the default, full"""
+    with open(os.path.join(ROOT, "serverless.yml")) as f:
+        text = f.read()
+    families = {"chatbot_image": "full"}
+    for image, family in re.findall(r"\n      (\w+):\n        path: \./\n        buildArgs:\n          FAMILY: ([\w-]+)",
+                                    text):
+        families[image] = family
+    functions = dict(re.findall(r"\n  (\w+):\n    image:\n      name: (\w+)", text))
+    return {name: image for name, image in functions.items() if image in families}, families
+
+
+def _pip(target, requirements, compile_bytecode):
+    """pip install into target unless an earlier run installed the same requirements"""
+    stamp = os.path.join(target, ".requirements")
+    digest = hashlib.sha256(json.dumps([requirements, compile_bytecode]).encode()).hexdigest()
+    if os.path.exists(stamp) and open(stamp).read() == digest:
+        return False
+    shutil.rmtree(target, ignore_errors=True)
+    os.makedirs(target)
+    subprocess.run([sys.executable, "-m", "pip", "install", "--quiet", "--prefer-binary", "--target", target,
+                    *([] if compile_bytecode else ["--no-compile"]), *requirements], check=True)
+    with open(stamp, "w") as f:
+        f.write(digest)
+    return True
+
+
+def build(target, requirements, family):
+    """Install requirements and the function code into target, compiled like the image (family) or not"""
+    installed = _pip(target, requirements, compile_bytecode=not family)
+    for path in glob.glob(os.path.join(ROOT, "*.py")):
+        shutil.copy(path, target)
+    with open(os.path.join(target, "conf.py"), "w") as f:
+        f.write(OFFLINE_CONF)
+    app = [os.path.join(target, os.path.basename(path)) for path in glob.glob(os.path.join(ROOT, "*.py"))]
+    app.append(os.path.join(target, "conf.py"))
+    for path in app:
+        for cached in glob.glob(os.path.join(target, "__pycache__", os.path.basename(path)[:-3] + ".*.pyc")):
+            os.remove(cached)
+    if family:
+        if installed:
+            compileall.compile_dir(target, quiet=1, workers=0,
+                                   invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+        for path in app:
+            py_compile.compile(path, doraise=True, invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+
+
+def size_mb(path):
+    total = 0
+    for directory, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(directory, name)) for name in files)
+    return total / 1024 / 1024
+
+
+def measure(paths, imports, runs):
+    """Median init and first-request import ms in fresh interpreters that cannot write bytecode"""
+    env = dict(os.environ, MODEL_CATALOG_PATH="")
+    env.pop("WARM_MODELS", None)
+    rows = []
+    for _ in range(runs):
+        # -I -S: none of this machine's packages; -B: the task root is read-only on Lambda
+        output = subprocess.run([sys.executable, "-I", "-S", "-B", "-c", CHILD.format(paths=paths, imports=imports)],
+                                capture_output=True, text=True, env=env, cwd="/")
+        if output.returncode:
+            raise RuntimeError(output.stderr.strip().splitlines()[-1])
+        rows.append(json.loads(output.stdout.strip().splitlines()[-1]))
+    return statistics.median(row["init_ms"] for row in rows), statistics.median(row["first_ms"] for row in rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--build-dir", default="/tmp/image-size")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    functions, families = serverless_images()
+    runtime = os.path.join(args.build_dir, "lambda-runtime")
+    start = time.perf_counter()
+    _pip(runtime, ["boto3"], compile_bytecode=True)
+    targets = {"before": os.path.join(args.build_dir, "before")}
+    build(targets["before"], BEFORE, None)
+    for image, family in sorted(families.items()):
+        targets[image] = os.path.join(args.build_dir, image)
+        build(targets[image], ["-r", os.path.join(ROOT, "requirements", f"{family}.txt")], family)
+    print(f"built in {time.perf_counter() - start:.0f} s under {args.build_dir}\n")
+
+    print(f"{'image':<16}{'family':<14}{'MB':>8}{'files':>9}")
+    for image, target in targets.items():
+        files = sum(len(names) for _, _, names in os.walk(target))
+        print(f"{image:<16}{families.get(image, '(all, before)'):<14}{size_mb(target):>8.0f}{files:>9}")
+
+    print(f"\n{'function':<24}{'image':<16}{'init ms':>16}{'first request ms':>22}")
+    for name, image in functions.items():
+        imports = FIRST_IMPORTS.get(name, [])
+        before = measure([targets["before"], runtime], imports, args.runs)
+        after = measure([targets[image], runtime], imports, args.runs)
+        print(f"{name:<24}{image:<16}{before[0]:>7.0f} -> {after[0]:>5.0f}{before[1]:>11.0f} -> {after[1]:>6.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""Long image generations: synchronous requests against async jobs with a webhook
+
+Concurrent clients ask gemini_image_generator for images whose generation
+time is log-normal around --median seconds. Synchronously, each client holds
+its connection for the whole generation and API Gateway cuts it off at 30
+seconds. With "async": true the request returns a job ID right away; the
+local queue runs the job and a webhook server on 127.0.0.1 receives the
+signed result, while a second group of clients polls GET /jobs/{job_id}
+instead. The local queue gets a worker per job, as SQS scales out job_worker.
+"held" is the time clients spend in requests (the sync column in production
+seconds, the async ones in real milliseconds: submit and poll do not wait on
+a provider); "done" is production seconds until the result is in hand.
+Provider timeouts, the gateway cut-off and the worker's 900 second limit
+are scaled like the generation times. Last, a generation slower than
+Imagen's per-attempt timeout, sync and as a job (which must wait for it
+with a single Vertex call), and three submissions that cannot go through
+the queue as usual: an event over the SQS message limit (stored as a blob),
+the same without a blob store (413), and a queue that refuses the message
+(the job must not stay queued).
+
+    python -m benchmarks.jobs [--requests 40] [--clients 8] [--median 25] [--scale 0.01]
+"""
+import argparse
+import contextlib
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from benchmarks import fakes
+from benchmarks.events import SERVER_API_KEY, http_event
+
+GATEWAY_TIMEOUT = 30
+MODEL = "imagen-3.0-generate-001"
+
+
+def _percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(p / 100 * (len(ordered) - 1)))] if ordered else 0.0
+
+
+class _Receiver(BaseHTTPRequestHandler):
+    """Webhook endpoint: records arrival time and whether the signature checks out"""
+    deliveries = {}
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        expected = "sha256=" + hmac.new(SERVER_API_KEY.encode(), body, hashlib.sha256).hexdigest()
+        job = json.loads(body)
+        self.deliveries[job["job_id"]] = (time.perf_counter(), self.headers.get("X-Signature") == expected,
+                                          job["status"])
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def _wait(jobs, job_id):
+    job = {"status": "queued"}
+    deadline = time.time() + 60
+    while job["status"] not in jobs.DONE and time.time() < deadline:
+        time.sleep(0.01)
+        job = jobs.status(job_id)
+    return job
+
+
+def _edge_cases(handler, jobs, headers, scale):
+    """Result lines for slow generations and submissions that cannot be queued as they are
+
+    Call with stdout redirected.
+    """
+    import resilience
+
+    def submit(prompt):
+        response = handler.gemini_image_generator(http_event({"prompt": prompt, "async": True}, headers), None)
+        return response["statusCode"], json.loads(response["body"])
+
+    lines = []
+    slow = 45
+    latency, fakes.MODEL_LATENCY[MODEL] = fakes.MODEL_LATENCY[MODEL], slow * scale
+    calls = fakes.calls.get(MODEL, 0)
+    start = time.perf_counter()
+    response = handler.gemini_image_generator(http_event({"prompt": "Slow bakery poster"}, headers), None)
+    sync = (response["statusCode"], (time.perf_counter() - start) / scale, fakes.calls.get(MODEL, 0) - calls)
+    # Let the abandoned call finish so it is not counted below
+    time.sleep(slow * scale)
+    calls = fakes.calls.get(MODEL, 0)
+    start = time.perf_counter()
+    code, body = submit("Slow bakery poster, async")
+    job = _wait(jobs, body["job_id"])
+    fakes.MODEL_LATENCY[MODEL] = latency
+    timeout = resilience.ATTEMPT_TIMEOUTS[MODEL] / scale
+    lines.append(f"generation of {slow} s, Imagen timeout {timeout:.0f} s per attempt:")
+    lines.append(f"  sync {sync[0]} after {sync[1]:.1f} s, Vertex calls {sync[2]}")
+    lines.append(f"  job {job['status']} after {(time.perf_counter() - start) / scale:.1f} s, "
+                 f"Vertex calls {fakes.calls.get(MODEL, 0) - calls}")
+    large = "Bakery poster " + "with sourdough loaves " * (jobs.JOB_MAX_MESSAGE_BYTES // 20)
+    code, body = submit(large)
+    job = _wait(jobs, body["job_id"]) if code == 202 else {"status": "not queued"}
+    lines.append(f"event of {len(large) // 1024} KB: {code}, job {job['status']} (event sent as a blob)")
+
+    results, jobs.results = jobs.results, None
+    code, body = submit(large)
+    jobs.results = results
+    lines.append(f"same without a blob store: {code} {body['error']}")
+
+    def refuse(message):
+        raise RuntimeError("queue unavailable")
+
+    stored = []
+    send, put = jobs.queue.send, jobs.store.put
+    jobs.queue.send = refuse
+    jobs.store.put = lambda key, value, ttl=None: stored.append(key) or put(key, value, ttl=ttl)
+    code, body = submit("Bakery poster")
+    jobs.queue.send, jobs.store.put = send, put
+    left = [key for key in stored if jobs.status(key) is not None]
+    lines.append(f"queue refuses the message: {code} {body['error']}, jobs left queued {len(left)}")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--median", type=float, default=25.0, help="median generation seconds")
+    parser.add_argument("--sigma", type=float, default=0.4)
+    parser.add_argument("--poll", type=float, default=2.0, help="seconds between polls")
+    parser.add_argument("--scale", type=float, default=0.01, help="multiplier for every time above")
+    args = parser.parse_args()
+
+    fakes.install(scale=0)
+    fakes.seed(1)
+    fakes.MODEL_LATENCY[MODEL] = fakes.lognormal(args.median * args.scale, args.sigma)
+    os.environ.update(MODEL_CATALOG_PATH="", CACHE_STORE="local", JOB_WEBHOOK_DOMAINS="127.0.0.1",
+                      JOB_LOCAL_WORKERS=str(args.requests), JOB_LOCAL_TIMEOUT=str(900 * args.scale))
+    os.environ.setdefault("IMAGE_CACHE_DIR", "/tmp/benchmark-image-cache")
+    import handler
+    import jobs
+    import resilience
+
+    resilience.ATTEMPT_TIMEOUTS[MODEL] *= args.scale
+    resilience.API_GATEWAY_TIMEOUT *= args.scale
+    for name in ("DEADLINE_MARGIN", "MIN_ATTEMPT_SECONDS", "PROVIDER_BACKOFF", "PROVIDER_BACKOFF_CAP"):
+        setattr(resilience, name, getattr(resilience, name) * args.scale)
+
+    def reset_breakers():
+        # Each mode starts with a closed breaker, whatever the one before did to it
+        for name in resilience.breakers:
+            resilience.breakers[name] = resilience.CircuitBreaker(name, cooldown=resilience.BREAKER_COOLDOWN * scale)
+
+    # The receiver is plain HTTP on localhost
+    jobs.WEBHOOK_SCHEMES = ("https", "http")
+    server = HTTPServer(("127.0.0.1", 0), _Receiver)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    webhook = f"http://127.0.0.1:{server.server_port}/jobs"
+    headers = {"cache-control": "no-cache"}
+    scale = args.scale
+
+    def sync(number):
+        start = time.perf_counter()
+        response = handler.gemini_image_generator(http_event({"prompt": f"Bakery poster {number}"}, headers), None)
+        held = (time.perf_counter() - start) / scale
+        return held, response["statusCode"] == 200 and held <= GATEWAY_TIMEOUT
+
+    def submit(number, body):
+        start = time.perf_counter()
+        body = dict(body, prompt=f"Bakery poster {number}", **{"async": True})
+        response = handler.gemini_image_generator(http_event(body, headers), None)
+        return start, (time.perf_counter() - start) * 1000, json.loads(response["body"])["job_id"]
+
+    def polled(number):
+        start, held, job_id = submit(number, {})
+        polls = 0
+        while True:
+            polls += 1
+            poll_start = time.perf_counter()
+            job = json.loads(handler.job_status({"headers": {}, "pathParameters": {"job_id": job_id}}, None)["body"])
+            held += (time.perf_counter() - poll_start) * 1000
+            if job["status"] in jobs.DONE:
+                return held, (time.perf_counter() - start) / scale, polls, job["status"] == "succeeded"
+            time.sleep(args.poll * scale)
+
+    def pushed(number):
+        start, held, job_id = submit(number, {"webhook": webhook})
+        return start, held, job_id
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        reset_breakers()
+        with ThreadPoolExecutor(args.clients) as pool:
+            sync_rows = list(pool.map(sync, range(args.requests)))
+        reset_breakers()
+        with ThreadPoolExecutor(args.clients) as pool:
+            poll_rows = list(pool.map(polled, range(args.requests)))
+        reset_breakers()
+        with ThreadPoolExecutor(args.clients) as pool:
+            push_rows = list(pool.map(pushed, range(args.requests)))
+        deadline = time.time() + 60
+        while len(_Receiver.deliveries) < len(push_rows) and time.time() < deadline:
+            time.sleep(0.01)
+        reset_breakers()
+        edge_lines = _edge_cases(handler, jobs, headers, scale)
+    server.shutdown()
+
+    print(f"{args.requests} image requests from {args.clients} clients, generation p50 {args.median:.0f} s "
+          f"(sigma {args.sigma})\n")
+    print(f"{'mode':<14}{'held p50':>12}{'held p99':>12}{'done p50':>10}{'done p99':>10}{'ok':>8}{'extra':>22}")
+    held = [row[0] for row in sync_rows]
+    print(f"{'sync':<14}{_percentile(held, 50):>10.2f} s{_percentile(held, 99):>10.2f} s"
+          f"{_percentile(held, 50):>10.2f}{_percentile(held, 99):>10.2f}"
+          f"{sum(row[1] for row in sync_rows):>5}/{args.requests:<2}"
+          f"{sum(not row[1] for row in sync_rows):>7} failed or cut off")
+    held = [row[0] for row in poll_rows]
+    done = [row[1] for row in poll_rows]
+    print(f"{'async + poll':<14}{_percentile(held, 50):>9.2f} ms{_percentile(held, 99):>9.2f} ms"
+          f"{_percentile(done, 50):>10.2f}{_percentile(done, 99):>10.2f}"
+          f"{sum(row[3] for row in poll_rows):>5}/{args.requests:<2}"
+          f"{sum(row[2] for row in poll_rows) / len(poll_rows):>10.1f} polls per job")
+    held = [row[1] for row in push_rows]
+    done = [(_Receiver.deliveries[job_id][0] - start) / scale
+            for start, _, job_id in push_rows if job_id in _Receiver.deliveries]
+    signed = sum(delivery[1] and delivery[2] == "succeeded" for delivery in _Receiver.deliveries.values())
+    print(f"{'async + hook':<14}{_percentile(held, 50):>9.2f} ms{_percentile(held, 99):>9.2f} ms"
+          f"{_percentile(done, 50):>10.2f}{_percentile(done, 99):>10.2f}"
+          f"{signed:>5}/{args.requests:<2}{len(done):>8} webhooks delivered")
+    print()
+    for line in edge_lines:
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""Keep-warm pings and init prewarming: the first real request against later warm ones
+
+Every row runs in a fresh interpreter (a new container) with the fakes from
+benchmarks/fakes.py, which charge their simulated SDK import and setup costs
+and a connection cost on each service's first call. The row's scenario
+decides what happens before the first real request; --requests more follow
+it. "first" is what the first user waits, counting the init phase when it
+is on their path, and "warm" the median of the later requests.
+
+- cold: nothing warmed, the request pays init and every first call.
+- prewarm: WARM_MODELS and WARM_PROVIDERS from serverless.yml, warmed during init.
+- pinged: as deployed; a scheduled ping created the container before the user came.
+- idle: a warm container whose connections the providers closed while it was idle.
+- idle+ping: the same, with a ping since.
+
+Then a ping with --concurrency fans out through a fake Lambda client whose
+invocations each start another fresh interpreter, as Lambda does when the
+function's containers are busy.
+
+    python -m benchmarks.keep_warm [--requests 10] [--latency 0.0] [--concurrency 4]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TABLE = "offline-cache"
+
+# The environment serverless.yml gives each kept-warm function
+FUNCTION_ENV = {
+    "gemini_chat": {"WARM_MODELS": "gemini-2.0-flash", "WARM_PROVIDERS": "dynamodb"},
+    "gemini_pro_chat": {"WARM_MODELS": "gemini-3-pro-preview", "WARM_PROVIDERS": "dynamodb"},
+}
+SCENARIOS = ["cold", "prewarm", "pinged", "idle", "idle+ping"]
+
+
+class Context:
+    """Enough of the Lambda context for the pipeline and the ping fan-out"""
+
+    def __init__(self, name):
+        self.invoked_function_arn = f"arn:aws:lambda:us-east-1:123456789012:function:python-chatbot-api-dev-{name}"
+        self.aws_request_id = "offline"
+
+    def get_remaining_time_in_millis(self):
+        return 900000
+
+
+def _event(name, number):
+    from benchmarks.events import function_url_event, http_event
+
+    body = {"prompt": f"Write slogan {number} for a bakery"}
+    return function_url_event(body) if name == "gemini_pro_chat" else http_event(body, path="/prompt-gemini")
+
+
+def _timed(function, *args):
+    start = time.perf_counter()
+    response = function(*args)
+    return response, (time.perf_counter() - start) * 1000
+
+
+def _setup(name, scenario, args):
+    from benchmarks import fakes
+
+    fakes.install(scale=args.scale)
+    os.environ.update(MODEL_CATALOG_PATH="", CACHE_TABLE=TABLE)
+    if scenario != "cold":
+        os.environ.update(FUNCTION_ENV[name])
+    for model in ("gemini-2.0-flash", "gemini-3-pro-preview"):
+        fakes.MODEL_LATENCY[model] = args.latency
+    return fakes
+
+
+def _run_child(name, scenario, args):
+    fakes = _setup(name, scenario, args)
+    start = time.perf_counter()
+    import handler
+    init_ms = (time.perf_counter() - start) * 1000
+    function = getattr(handler, name)
+    context = Context(name)
+
+    if scenario == "container":
+        # One fanned-out ping, its event on stdin
+        response = function(json.loads(sys.stdin.read()), context)
+        print("RESULT " + json.dumps(response))
+        return
+    if scenario == "fanout":
+        def invoke(function_name, payload):
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.keep_warm", "--child", name, "container",
+                 "--scale", str(args.scale)],
+                cwd=ROOT, input=payload, capture_output=True, check=True,
+            ).stdout.decode()
+            return next(line for line in output.splitlines() if line.startswith("RESULT "))[len("RESULT "):].encode()
+
+        fakes.LAMBDA["invoke"] = invoke
+        response, ping_ms = _timed(function, {"warmup": True, "concurrency": args.concurrency}, context)
+        print("RESULT " + json.dumps(dict(json.loads(response["body"]), ping_ms=ping_ms)))
+        return
+
+    if scenario.startswith("idle"):
+        function(_event(name, 0), context)
+        # Idle past the keep-alive: the providers closed every connection
+        fakes.connected.clear()
+    ping_ms = 0.0
+    if scenario in ("pinged", "idle+ping"):
+        response, ping_ms = _timed(function, {"warmup": True}, context)
+        assert response["statusCode"] == 200, response
+    response, first_ms = _timed(function, _event(name, 1), context)
+    assert response["statusCode"] == 200, response
+    warm = [_timed(function, _event(name, number), context)[1] for number in range(2, 2 + args.requests)]
+    if scenario in ("cold", "prewarm"):
+        first_ms += init_ms
+    print("RESULT " + json.dumps({"init_ms": init_ms, "ping_ms": ping_ms, "first_ms": first_ms,
+                                  "warm_ms": statistics.median(warm)}))
+
+
+def _measure(name, scenario, args):
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.keep_warm", "--child", name, scenario, "--scale", str(args.scale),
+         "--requests", str(args.requests), "--latency", str(args.latency), "--concurrency", str(args.concurrency)],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    ).stdout
+    line = next(line for line in output.splitlines() if line.startswith("RESULT "))
+    return json.loads(line[len("RESULT "):])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=10, help="warm requests after the first")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per Gemini call")
+    parser.add_argument("--concurrency", type=int, default=4, help="containers the fan-out ping keeps warm")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplier for the simulated SDK costs")
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _run_child(*args.child, args)
+        return
+
+    print(f"{'function':<17}{'scenario':<11}{'init ms':>9}{'ping ms':>9}{'first ms':>10}{'warm ms':>9}{'first/warm':>12}")
+    for name in FUNCTION_ENV:
+        for scenario in SCENARIOS:
+            result = _measure(name, scenario, args)
+            ratio = result["first_ms"] / result["warm_ms"] if result["warm_ms"] else float("inf")
+            print(f"{name:<17}{scenario:<11}{result['init_ms']:>9.0f}{result['ping_ms']:>9.0f}"
+                  f"{result['first_ms']:>10.1f}{result['warm_ms']:>9.1f}{ratio:>11.1f}x")
+
+    print(f"\nfan-out: one ping with concurrency {args.concurrency} to gemini_chat")
+    result = _measure("gemini_chat", "fanout", args)
+    print(f"containers warmed {result['containers']}, of them cold {result['cold_containers']}, "
+          f"ping took {result['ping_ms']:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
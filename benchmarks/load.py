@@ -0,0 +1,259 @@
+"""Throughput, latency percentiles, errors, payload size, peak RSS and cold start per endpoint
+
+Each simulated Lambda container is a fresh interpreter running the real
+handlers against the fake SDKs, and a concurrency level of N runs N containers
+side by side, the way Lambda scales. Provider latencies are log-normal around
+realistic medians multiplied by --time-scale, providers fail at --error-rate,
+and answers/images have the requested sizes. Results are saved as
+benchmarks/results/<commit>.json; --compare reports the change against an
+earlier results file (or commit).
+
+    python -m benchmarks.load [--endpoints chatbot,gemini_chat] [--concurrency 1,4,16]
+                              [--requests 40] [--time-scale 0.02] [--compare <commit or file>]
+"""
+import argparse
+import contextlib
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.cold_start import FUNCTION_ENV
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+# Median seconds per provider call in production, before --time-scale
+PROVIDER_LATENCY = {
+    "gpt-4o": 1.6,
+    "gemini-2.0-flash": 0.9,
+    "gemini-3-pro-preview": 6.0,
+    "dall-e-3": 9.0,
+    "imagen-3.0-generate-001": 7.0,
+    "imagegeneration@006": 7.0,
+    "dynamodb": 0.008,
+}
+
+ENDPOINTS = [
+    "chatbot",
+    "image_generator",
+    "gemini_image_generator",
+    "nano_banana_generator",
+    "gemini_chat",
+    "gemini_pro_chat",
+    "compare_models",
+    "chat_session",
+    "add_user_profile",
+    "add_user_profiles_bulk",
+]
+
+
+def _percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(p / 100 * (len(ordered) - 1)))]
+
+
+def _run_container(config):
+    """Child process: cold start, then config["requests"] sequential invocations"""
+    from benchmarks import fakes
+    from benchmarks.events import sample_events
+
+    fakes.install(scale=config["import_scale"])
+    fakes.seed(config["seed"])
+    for name, median in PROVIDER_LATENCY.items():
+        latency = fakes.lognormal(median * config["time_scale"], config["sigma"])
+        if name == "dynamodb":
+            fakes.CALL_LATENCY["dynamodb"] = latency
+        else:
+            fakes.MODEL_LATENCY[name] = latency
+        fakes.ERROR_RATE[name] = config["error_rate"]
+    fakes.PAYLOAD.update(chat_chars=config["chat_chars"], image_bytes=config["image_kb"] * 1024)
+    os.environ.setdefault("USER_PROFILES_TABLE", "offline-user-profiles")
+    os.environ.setdefault("SESSIONS_TABLE", "offline-sessions")
+    os.environ["MODEL_CATALOG_PATH"] = ""
+    os.environ.update(FUNCTION_ENV.get(config["endpoint"], {}))
+
+    def event():
+        request = sample_events()[config["endpoint"]]
+        if not config["cache"]:
+            request["headers"]["cache-control"] = "no-cache"
+        return request
+
+    def invoke(request):
+        try:
+            return function(request, None)
+        except Exception:
+            # An unhandled error is a 502 from API Gateway / the Function URL
+            return {"statusCode": 502, "body": ""}
+
+    samples = []
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        import handler
+        function = getattr(handler, config["endpoint"])
+        invoke(event())
+        cold_ms = (time.perf_counter() - start) * 1000
+
+        for _ in range(config["requests"]):
+            request = event()
+            started = time.time()
+            start = time.perf_counter()
+            response = invoke(request)
+            samples.append((started, (time.perf_counter() - start) * 1000,
+                            response.get("statusCode", 200), len(response.get("body") or "")))
+
+    print("RESULT " + json.dumps({
+        "cold_ms": cold_ms,
+        "samples": samples,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }))
+
+
+def _run_level(config, concurrency):
+    children = []
+    for index in range(concurrency):
+        child_config = dict(config, seed=config["seed"] * 1000 + index)
+        children.append(subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.load", "--child", json.dumps(child_config)],
+            cwd=ROOT, stdout=subprocess.PIPE, text=True,
+        ))
+    results = []
+    for child in children:
+        output, _ = child.communicate()
+        line = next(line for line in output.splitlines() if line.startswith("RESULT "))
+        results.append(json.loads(line[len("RESULT "):]))
+
+    samples = [sample for result in results for sample in result["samples"]]
+    latencies = [latency for _, latency, _, _ in samples]
+    window = max(started + latency / 1000 for started, latency, _, _ in samples) - \
+        min(started for started, _, _, _ in samples)
+    return {
+        "requests": len(samples),
+        "throughput_rps": round(len(samples) / window, 2) if window > 0 else None,
+        "p50_ms": round(_percentile(latencies, 50), 2),
+        "p90_ms": round(_percentile(latencies, 90), 2),
+        "p99_ms": round(_percentile(latencies, 99), 2),
+        "max_ms": round(max(latencies), 2),
+        "error_rate": round(sum(1 for _, _, status, _ in samples if status >= 500) / len(samples), 4),
+        "rejected_rate": round(sum(1 for _, _, status, _ in samples if 400 <= status < 500) / len(samples), 4),
+        "response_bytes": round(statistics.mean(size for _, _, _, size in samples)),
+        "peak_rss_mb": round(max(result["peak_rss_kb"] for result in results) / 1024, 1),
+        "cold_start_ms": round(statistics.median(result["cold_ms"] for result in results), 1),
+    }
+
+
+def _commit():
+    def git(*args):
+        return subprocess.run(["git", *args], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    sha = git("rev-parse", "--short", "HEAD") or "unknown"
+    dirty = bool(git("status", "--porcelain", "--untracked-files=no"))
+    return sha, dirty
+
+
+def _load_results(reference):
+    path = reference if os.path.exists(reference) else os.path.join(RESULTS_DIR, f"{reference}.json")
+    with open(path) as f:
+        return json.load(f)
+
+
+def _change(new, old):
+    if new is None or not old:
+        return "     -"
+    return f"{(new - old) / old * 100:+6.1f}%"
+
+
+def _compare(results, baseline, threshold):
+    print(f"\nagainst {baseline['commit']}{' (dirty)' if baseline.get('dirty') else ''}:")
+    print(f"{'endpoint':<24}{'conc':>5}{'rps':>9}{'p50':>9}{'p99':>9}{'rss':>9}{'cold':>9}")
+    regressions = 0
+    for endpoint, levels in results["results"].items():
+        for level, row in levels.items():
+            old = baseline["results"].get(endpoint, {}).get(level)
+            if old is None:
+                continue
+            flags = []
+            if old["throughput_rps"] and row["throughput_rps"] < old["throughput_rps"] * (1 - threshold):
+                flags.append("throughput")
+            if row["p99_ms"] > old["p99_ms"] * (1 + threshold):
+                flags.append("p99")
+            if row["error_rate"] > old["error_rate"] + 0.01:
+                flags.append("errors")
+            regressions += bool(flags)
+            print(f"{endpoint:<24}{level:>5}{_change(row['throughput_rps'], old['throughput_rps']):>9}"
+                  f"{_change(row['p50_ms'], old['p50_ms']):>9}{_change(row['p99_ms'], old['p99_ms']):>9}"
+                  f"{_change(row['peak_rss_mb'], old['peak_rss_mb']):>9}"
+                  f"{_change(row['cold_start_ms'], old['cold_start_ms']):>9}"
+                  f"  {'REGRESSION: ' + ', '.join(flags) if flags else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    parser.add_argument("--concurrency", default="1,4,16", help="comma-separated container counts")
+    parser.add_argument("--requests", type=int, default=40, help="warm requests per container")
+    parser.add_argument("--time-scale", type=float, default=0.02,
+                        help="multiplier for the production provider latencies")
+    parser.add_argument("--sigma", type=float, default=0.5, help="log-normal spread of provider latencies")
+    parser.add_argument("--error-rate", type=float, default=0.01)
+    parser.add_argument("--chat-chars", type=int, default=1500)
+    parser.add_argument("--image-kb", type=int, default=1500)
+    parser.add_argument("--import-scale", type=float, default=1.0,
+                        help="multiplier for the simulated SDK import/init costs")
+    parser.add_argument("--cache", action="store_true", help="let repeated prompts hit the caches")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--compare", help="earlier results file or commit to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative change counted as a regression")
+    parser.add_argument("--no-save", action="store_true")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _run_container(json.loads(args.child))
+        return
+
+    config = {
+        "requests": args.requests,
+        "time_scale": args.time_scale,
+        "sigma": args.sigma,
+        "error_rate": args.error_rate,
+        "chat_chars": args.chat_chars,
+        "image_kb": args.image_kb,
+        "import_scale": args.import_scale,
+        "cache": args.cache,
+        "seed": args.seed,
+    }
+    levels = [int(level) for level in args.concurrency.split(",")]
+    sha, dirty = _commit()
+    results = {"commit": sha, "dirty": dirty, "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+               "config": config, "results": {}}
+
+    print(f"{'endpoint':<24}{'conc':>5}{'rps':>9}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}"
+          f"{'errors':>8}{'resp KB':>9}{'rss MB':>8}{'cold ms':>9}")
+    for endpoint in args.endpoints.split(","):
+        results["results"][endpoint] = {}
+        for level in levels:
+            row = _run_level(dict(config, endpoint=endpoint), level)
+            results["results"][endpoint][str(level)] = row
+            print(f"{endpoint:<24}{level:>5}{row['throughput_rps']:>9.1f}{row['p50_ms']:>9.1f}"
+                  f"{row['p90_ms']:>9.1f}{row['p99_ms']:>9.1f}{row['error_rate']:>8.1%}"
+                  f"{row['response_bytes'] / 1024:>9.1f}{row['peak_rss_mb']:>8.1f}{row['cold_start_ms']:>9.0f}")
+
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"{sha}{'-dirty' if dirty else ''}.json")
+        with open(path, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nsaved {os.path.relpath(path, ROOT)}")
+
+    if args.compare:
+        regressions = _compare(results, _load_results(args.compare), args.threshold)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
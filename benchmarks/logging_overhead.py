@@ -0,0 +1,86 @@
+"""Log volume and time per request: the old print() calls vs the structured logger
+
+The old path printed the whole event plus a prompt and response preview on
+every call; log.py writes short INFO records and leaves payloads to sampled
+DEBUG dumps. stdout is replaced by a byte counter so only formatting and
+write calls are timed.
+
+    python -m benchmarks.logging_overhead [--prompt-chars 20000] [--number 2000]
+"""
+import argparse
+import contextlib
+import json
+import timeit
+
+from benchmarks.events import http_event
+
+
+class Counter:
+    """stdout stand-in counting bytes and write calls"""
+
+    def __init__(self):
+        self.bytes = 0
+        self.writes = 0
+
+    def write(self, text):
+        self.bytes += len(text)
+        self.writes += 1
+
+    def flush(self):
+        pass
+
+
+def _legacy(event, prompt, response_text):
+    print('gemini chat event: ', json.dumps(event))
+    print(f'Processing prompt with Gemini: {prompt}')
+    print('Gemini finish_reason: STOP')
+    print('Gemini safety_ratings: []')
+    print(f'Gemini response length: {len(response_text)} characters (MISS)')
+    print(f'Gemini response preview: {response_text[:200]}...')
+
+
+def _structured(log, event, prompt, response_text):
+    log.start()
+    body = event["body"]
+    log.info("Request", handler="gemini_chat", path=event.get("rawPath"), body_bytes=len(body))
+    log.payload("Event", event=event)
+    log.payload("Prompt", prompt=prompt)
+    log.info("Gemini finished", model="gemini-2.0-flash", finish_reason="STOP")
+    log.debug("Gemini safety ratings", safety_ratings=[])
+    log.info("Chat answered", model="gemini-2.0-flash", cache="MISS", hedged=False,
+             response_chars=len(response_text))
+    log.payload("Chat response", response=response_text)
+    log.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--prompt-chars", type=int, default=20000)
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+
+    import log
+
+    prompt = ("Write a campaign for owner@bakery.example, call 050-123-4567. " * 400)[:args.prompt_chars]
+    event = http_event({"prompt": prompt}, path="/prompt-gemini")
+    response_text = "Fresh bread every morning. " * 200
+
+    cases = [("print (old)", lambda: _legacy(event, prompt, response_text))]
+    for rate in (0.0, 0.01, 1.0):
+        def run(rate=rate):
+            log.LOG_SAMPLE_RATE = rate
+            _structured(log, event, prompt, response_text)
+        cases.append((f"log.py sample={rate:g}", run))
+
+    print(f"{'path':<22}{'us/request':>12}{'bytes/request':>15}{'writes/request':>16}")
+    for name, function in cases:
+        counter = Counter()
+        with contextlib.redirect_stdout(counter):
+            seconds = min(timeit.repeat(function, number=args.number, repeat=3))
+        calls = args.number * 3
+        print(f"{name:<22}{seconds / args.number * 1e6:>12.1f}{counter.bytes / calls:>15.0f}"
+              f"{counter.writes / calls:>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
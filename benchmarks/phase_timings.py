@@ -0,0 +1,63 @@
+"""Per-phase p50/p99 for every handler, read back from the captured EMF output
+
+Runs the sample events through the handlers with the fake SDKs (cache bypassed
+so every request reaches the provider) and summarizes the metrics documents
+metrics.py would have written to CloudWatch.
+
+    python -m benchmarks.phase_timings [--requests 50] [--latency 0.05]
+"""
+import argparse
+import contextlib
+import os
+
+from benchmarks import fakes
+from benchmarks.events import sample_events
+
+PHASES = ("AuthMs", "ParseMs", "ProviderMs", "EncodeMs", "SerializeMs", "TotalMs")
+
+
+def _percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(p / 100 * (len(ordered) - 1)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="seconds each fake chat model takes to answer")
+    args = parser.parse_args()
+
+    fakes.install(scale=0)
+    for model_name in ("gpt-4o", "gemini-2.0-flash", "gemini-3-pro-preview"):
+        fakes.MODEL_LATENCY[model_name] = args.latency
+    os.environ.setdefault("USER_PROFILES_TABLE", "offline-user-profiles")
+
+    import handler
+    import metrics
+
+    events = sample_events()
+    for event in events.values():
+        event["headers"]["cache-control"] = "no-cache"
+
+    with metrics.capture() as documents, open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(args.requests):
+            for name, event in events.items():
+                getattr(handler, name)(event, None)
+
+    print(f"{'handler':<24}{'model':<26}" + "".join(f"{phase[:-2]:>18}" for phase in PHASES))
+    print(f"{'':<50}" + "".join(f"{'p50 / p99 ms':>18}" for _ in PHASES))
+    for name in events:
+        rows = [document for document in documents if document["Function"] == name]
+        cells = []
+        for phase in PHASES:
+            values = [row[phase] for row in rows if phase in row]
+            cells.append(f"{_percentile(values, 50):.2f} / {_percentile(values, 99):.2f}" if values else "-")
+        print(f"{name:<24}{rows[-1].get('Model', '-'):<26}" + "".join(f"{cell:>18}" for cell in cells))
+
+    cold = [document for document in documents if document["ColdStart"]]
+    print(f"\n{len(documents)} EMF documents, {len(cold)} cold start (InitMs {cold[0]['InitMs']:.1f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Per-request overhead of the handler pipeline (auth, origin, parsing, validation)
+
+Times rejected requests end to end through the real handlers, the stages an
+accepted request pays before the handler body runs, and json vs orjson body
+parsing. Handler logging goes to /dev/null so only the pipeline is measured.
+
+    python -m benchmarks.pipeline_overhead [--number 20000]
+"""
+import argparse
+import contextlib
+import json
+import os
+import timeit
+
+from benchmarks import fakes
+from benchmarks.events import http_event
+
+API_KEY = "bench-api-key"
+
+
+def _rejections():
+    prompt = {"prompt": "Write a slogan for a bakery"}
+    return [
+        ("chatbot", "foreign origin", http_event({"question": "hi"}, headers={"origin": "https://evil.example"})),
+        ("chatbot", "no headers", {"body": json.dumps({})}),
+        ("chatbot", "invalid json", dict(http_event({}), body="{not json")),
+        ("gemini_chat", "wrong api key", http_event(prompt, headers={"x-api-key": "wrong"})),
+        ("gemini_chat", "missing prompt", http_event({}, headers={"x-api-key": API_KEY})),
+        ("gemini_image_generator", "bad output option",
+         http_event(dict(prompt, output="gif"))),
+        ("compare_models", "unknown backend",
+         http_event(dict(prompt, backends=["gpt-2"]), headers={"x-api-key": API_KEY})),
+        ("add_user_profile", "invalid email", http_event({
+            "UserID": "user-1", "Mobile": "+972-50-123-4567", "Email": "not-an-email",
+            "RawBizChar": "Family bakery", "OptBizChar": "Artisan family bakery",
+        }, headers={"x-api-key": "offline-server-key"})),
+    ]
+
+
+def _per_call_us(function, number):
+    return min(timeit.repeat(function, number=number, repeat=3)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=20000)
+    args = parser.parse_args()
+
+    fakes.install(scale=0)
+    import conf
+    conf.api_secret_key = API_KEY
+    import handler
+    import pipeline
+
+    accepted = pipeline.handler(pipeline.api_key(API_KEY, cors='*'), pipeline.origin(echo=True),
+                                pipeline.parse_body, pipeline.prompt())(lambda request: pipeline.text_response("ok"))
+    accepted_event = http_event({"prompt": "Write a slogan for a bakery " * 20}, headers={"x-api-key": API_KEY})
+    body = accepted_event["body"]
+
+    print(f"{'handler':<24}{'case':<20}{'status':>7}{'us/request':>12}")
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        rows = []
+        for name, case, event in _rejections():
+            function = getattr(handler, name)
+            status = function(event, None)["statusCode"]
+            rows.append((name, case, status, _per_call_us(lambda: function(event, None), args.number)))
+        rows.append(("(stages only)", "accepted", 200, _per_call_us(lambda: accepted(accepted_event, None), args.number)))
+    for name, case, status, micros in rows:
+        print(f"{name:<24}{case:<20}{status:>7}{micros:>12.1f}")
+
+    print(f"\nparse {len(body)} byte body:")
+    print(f"  json    {_per_call_us(lambda: json.loads(body), args.number):8.2f} us")
+    if pipeline.orjson is not None:
+        print(f"  orjson  {_per_call_us(lambda: pipeline.orjson.loads(body), args.number):8.2f} us")
+    else:
+        print("  orjson  not installed")
+
+
+if __name__ == "__main__":
+    main()
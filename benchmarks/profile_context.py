@@ -0,0 +1,86 @@
+"""Profile lookups for chat requests that send a UserID: cache hit ratio and latency
+
+Chat requests from a pool of users (a few heavy users send most of them) go
+through gemini_chat with the response cache bypassed. Profiles come from the
+fake DynamoDB with a per-call latency; the EMF output shows how many requests
+reached DynamoDB and what the lookup cost. Halfway through, one user's profile
+is rewritten through add_user_profile to check the cached copy is dropped.
+
+    python -m benchmarks.profile_context [--requests 2000] [--users 200] [--latency 0.008]
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+
+from benchmarks import fakes
+from benchmarks.events import SERVER_API_KEY, http_event, profile_records
+
+TABLE = "offline-user-profiles"
+PROMPT = "Write a slogan for our weekend sale"
+
+
+def _percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(p / 100 * (len(ordered) - 1)))] if ordered else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.008, help="seconds per DynamoDB call")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    fakes.install(scale=0)
+    os.environ["USER_PROFILES_TABLE"] = TABLE
+    import handler
+    import metrics
+    import profiles
+
+    records = profile_records(args.users)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        handler.add_user_profiles_bulk({"headers": {"x-api-key": SERVER_API_KEY}, "profiles": records}, None)
+    fakes.CALL_LATENCY["dynamodb"] = args.latency
+
+    # Zipf-like traffic: user k sends about 1/k as many requests as user 1
+    rng = random.Random(args.seed)
+    weights = [1 / (rank + 1) for rank in range(args.users)]
+    users = rng.choices([record["UserID"] for record in records], weights, k=args.requests)
+    headers = {"cache-control": "no-cache", "x-server-key": SERVER_API_KEY}
+
+    rewritten = dict(records[0], OptBizChar="Vegan bakery in Tel Aviv")
+    with metrics.capture() as documents, open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for number, user_id in enumerate(users):
+            if number == len(users) // 2:
+                handler.add_user_profile(http_event(rewritten, {"x-api-key": SERVER_API_KEY}), None)
+                stale = profiles.cached.get(rewritten["UserID"]) is not None
+            handler.gemini_chat(http_event({"prompt": PROMPT, "UserID": user_id}, headers), None)
+        context = profiles.system_context(rewritten["UserID"])
+
+    chats = [document for document in documents if document["Function"] == "gemini_chat"]
+    lookups = [document["ProfileMs"] for document in chats if "ProfileMs" in document]
+    hits = sum(document.get("ProfileCacheHit", 0) for document in chats)
+    print(f"{args.requests} chat requests from {args.users} users, {args.latency * 1000:.0f} ms per GetItem\n")
+    print(f"profile cache hit ratio   {hits / len(chats):.1%}  ({len(lookups)} GetItem calls)")
+    print(f"lookup on a miss          p50 {_percentile(lookups, 50):.2f} ms, p99 {_percentile(lookups, 99):.2f} ms")
+    totals = [document["TotalMs"] for document in chats]
+    print(f"gemini_chat TotalMs       p50 {_percentile(totals, 50):.2f} ms, p99 {_percentile(totals, 99):.2f} ms")
+    print(f"rewrite in this container {'STALE' if stale else 'dropped from the cache'}, "
+          f"context now {'updated' if 'Vegan' in (context or '') else 'OUT OF DATE'}")
+
+    inline = {"prompt": f"Business description: {records[1]['OptBizChar']}\n{PROMPT}"}
+    by_id = {"prompt": PROMPT, "UserID": records[1]["UserID"]}
+    print(f"\nrequest body with the description inline {len(json.dumps(inline))} bytes, "
+          f"with a UserID {len(json.dumps(by_id))} bytes")
+
+    # A browser only has the site-wide credentials; it may not pick whose profile it gets
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        response = handler.gemini_chat(http_event(by_id), None)
+    print(f"UserID without X-Server-Key: {response['statusCode']} {json.loads(response['body'])['error']}")
+
+
+if __name__ == "__main__":
+    main()
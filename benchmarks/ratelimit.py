@@ -0,0 +1,124 @@
+"""Per-tenant admission control: a noisy tenant next to quiet ones
+
+Part 1 runs --containers limiters (one per simulated container) against the
+same bucket in the fake DynamoDB table while a noisy tenant hammers all of
+them, and reports what got admitted against the configured rate and how many
+DynamoDB calls each request cost. Part 2 sends the noisy tenant and a few
+quiet tenants through gemini_chat, with --latency seconds per model call.
+Tenants are source IPs; the noisy one sends a new Origin subdomain and API
+key with every request, which must not get it a fresh bucket. The quiet
+tenants should see no 429s, and the noisy tenant's 429s should come back
+without touching the model or the table.
+
+    python -m benchmarks.ratelimit [--seconds 3] [--containers 4] [--per-minute 600] [--burst 20]
+"""
+import argparse
+import contextlib
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks import fakes
+from benchmarks.events import http_event
+
+TABLE = "offline-cache"
+
+
+def _percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(p / 100 * (len(ordered) - 1)))] if ordered else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--containers", type=int, default=4)
+    parser.add_argument("--per-minute", type=int, default=600, help="text budget per tenant")
+    parser.add_argument("--burst", type=int, default=20)
+    parser.add_argument("--quiet", type=int, default=3, help="quiet tenants in part 2")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per model call")
+    parser.add_argument("--db-latency", type=float, default=0.004, help="seconds per DynamoDB call")
+    args = parser.parse_args()
+
+    fakes.install(scale=0)
+    os.environ.update(RATE_LIMIT_ENABLED="true", CACHE_TABLE=TABLE, MODEL_CATALOG_PATH="",
+                      RATE_LIMIT_TEXT_PER_MINUTE=str(args.per_minute), RATE_LIMIT_TEXT_BURST=str(args.burst))
+    import handler
+    import metrics
+    import ratelimit
+
+    fakes.CALL_LATENCY["dynamodb"] = args.db_latency
+    rate = args.per_minute / 60
+    allowed = args.burst + rate * args.seconds
+
+    # Part 1: one shared bucket, several containers
+    limiters = [ratelimit.Limiter(ratelimit.DynamoDBBucketStore(TABLE)) for _ in range(args.containers)]
+    admitted = [0] * args.containers
+    rejected = [0] * args.containers
+    fakes.dynamodb_calls.clear()
+    stop = time.perf_counter() + args.seconds
+
+    def hammer(index):
+        while time.perf_counter() < stop:
+            try:
+                limiters[index].acquire("text", "noisy")
+                admitted[index] += 1
+            except ratelimit.Throttled:
+                rejected[index] += 1
+            time.sleep(0.001)
+
+    threads = [threading.Thread(target=hammer, args=(index,)) for index in range(args.containers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    calls = sum(fakes.dynamodb_calls.values())
+    total = sum(admitted) + sum(rejected)
+    print(f"part 1: {args.containers} containers, {args.seconds:.0f} s, budget {args.per_minute}/min "
+          f"burst {args.burst}\n")
+    print(f"noisy tenant requests      {total}")
+    print(f"admitted                   {sum(admitted)} (bucket allows at most {allowed:.0f}), "
+          f"per container {admitted}")
+    print(f"DynamoDB calls             {calls} ({calls / total:.3f} per request, "
+          f"{calls / max(1, sum(admitted)):.2f} per admitted request)")
+
+    # Part 2: through the handler, noisy and quiet tenants together
+    fakes.MODEL_LATENCY["gemini-2.0-flash"] = args.latency
+    headers = {"cache-control": "no-cache"}
+    results = {}
+    stop = time.perf_counter() + args.seconds
+
+    def client(name, address, pause):
+        rows = results.setdefault(name, [])
+        while time.perf_counter() < stop:
+            rotate = {"origin": f"https://{uuid.uuid4().hex[:8]}.broadcust.co.il", "x-api-key": uuid.uuid4().hex}
+            event = http_event({"prompt": f"Slogan from {name}"}, dict(headers, **rotate))
+            event["requestContext"]["http"]["sourceIp"] = address
+            start = time.perf_counter()
+            response = handler.gemini_chat(event, None)
+            rows.append((response["statusCode"], (time.perf_counter() - start) * 1000))
+            time.sleep(pause)
+
+    tenants = [("noisy", "198.51.100.1", 0.0)] * 4 + [(f"quiet-{index}", f"198.51.100.{index + 2}", 0.5)
+                                                      for index in range(args.quiet)]
+    with metrics.capture() as documents, open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        with ThreadPoolExecutor(len(tenants)) as pool:
+            list(pool.map(lambda tenant: client(*tenant), tenants))
+    limited = [document for document in documents if document.get("Throttled")]
+
+    print(f"\npart 2: gemini_chat, {args.latency * 1000:.0f} ms per model call, noisy tenant on 4 threads\n")
+    print(f"{'tenant':<10}{'requests':>10}{'200':>7}{'429':>7}{'p50 ms 200':>12}{'p50 ms 429':>12}")
+    for name in ["noisy"] + [f"quiet-{index}" for index in range(args.quiet)]:
+        rows = results.get(name, [])
+        ok = [ms for status, ms in rows if status == 200]
+        throttled = [ms for status, ms in rows if status == 429]
+        print(f"{name:<10}{len(rows):>10}{len(ok):>7}{len(throttled):>7}"
+              f"{_percentile(ok, 50):>12.2f}{_percentile(throttled, 50):>12.2f}")
+    print(f"\n429s that reached the model: {sum(1 for document in limited if 'ProviderMs' in document)}, "
+          f"p50 RateLimitMs on a 429 {_percentile([d['RateLimitMs'] for d in limited], 50):.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""Provider failures: retries, deadlines, circuit breakers and fallback
+
+Runs the handlers against fakes that fail, hang or go down, each time with
+the resilience layer configured as before it existed (one attempt, no
+timeouts, no breaker, no fallback) and as shipped. Times are production
+seconds: every latency and setting is multiplied by --scale to run quickly.
+
+1. flaky: chatbot while --error-rate of gpt-4o calls fail with a 503 (and,
+   separately, with a 400, which must not be retried).
+2. hung: gemini_image_generator while --hang-rate of Imagen calls never
+   return; "held" is how long the Lambda stays busy, "in time" the share
+   answered before API Gateway's 30 seconds.
+3. outage: chatbot with --clients clients while gpt-4o is down for the
+   middle third of the run; counts gpt-4o calls and who answered. Requests
+   count in the window they started in.
+
+    python -m benchmarks.resilience [--requests 200] [--error-rate 0.2] [--hang-rate 0.1] [--scale 0.01]
+"""
+import argparse
+import contextlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks import fakes
+from benchmarks.events import http_event
+
+IMAGE_MODEL = "imagen-3.0-generate-001"
+# image functions' Lambda timeout in serverless.yml
+LAMBDA_TIMEOUT = 180
+
+
+def _percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(p / 100 * (len(ordered) - 1)))] if ordered else 0.0
+
+
+@contextlib.contextmanager
+def _quiet():
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def _configure(resilience, chat_backends, shipped, scale):
+    """Settings as shipped (scaled), or as before: one attempt, no deadline, no breaker, no fallback"""
+    resilience.PROVIDER_MAX_ATTEMPTS = 3 if shipped else 1
+    resilience.PROVIDER_TIMEOUT = 60 * scale if shipped else 1e9
+    resilience.ATTEMPT_TIMEOUTS[IMAGE_MODEL] = 20 * scale if shipped else 1e9
+    resilience.API_GATEWAY_TIMEOUT = 30 * scale if shipped else 1e9
+    resilience.DEADLINE_MARGIN = 1 * scale
+    resilience.MIN_ATTEMPT_SECONDS = 1 * scale
+    resilience.PROVIDER_BACKOFF = 0.5 * scale
+    resilience.PROVIDER_BACKOFF_CAP = 4 * scale
+    for breaker in resilience.breakers.values():
+        breaker.threshold = 5 if shipped else 10 ** 9
+        breaker.cooldown = 30 * scale
+        breaker.success()
+    chat_backends.FALLBACK_ENABLED = shipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--error-rate", type=float, default=0.2)
+    parser.add_argument("--hang-rate", type=float, default=0.1)
+    parser.add_argument("--latency", type=float, default=2.0, help="median seconds per chat call")
+    parser.add_argument("--image-latency", type=float, default=6.0, help="median seconds per Imagen call")
+    parser.add_argument("--outage", type=float, default=180.0, help="seconds of the run, gpt-4o down in the middle")
+    parser.add_argument("--scale", type=float, default=0.01, help="multiplier for every time above")
+    args = parser.parse_args()
+
+    fakes.install(scale=0)
+    fakes.seed(1)
+    os.environ.update(MODEL_CATALOG_PATH="", CACHE_STORE="local")
+    os.environ.setdefault("IMAGE_CACHE_DIR", "/tmp/benchmark-image-cache")
+    import chat_backends
+    import handler
+    import resilience
+
+    scale = args.scale
+    fakes.MODEL_LATENCY["gpt-4o"] = fakes.lognormal(args.latency * scale, 0.3)
+    fakes.MODEL_LATENCY["gemini-2.0-flash"] = fakes.lognormal(args.latency * scale, 0.3)
+    fakes.MODEL_LATENCY[IMAGE_MODEL] = fakes.lognormal(args.image_latency * scale, 0.3)
+    headers = {"cache-control": "no-cache"}
+
+    def chat(number):
+        start = time.perf_counter()
+        response = handler.chatbot(http_event({"question": f"Tagline for the bakery, take {number}"}, headers), None)
+        return (response["statusCode"], (response.get("headers") or {}).get("X-Served-By"),
+                (time.perf_counter() - start) / scale)
+
+    # 1. flaky
+    print(f"1. flaky: chatbot, {args.requests} requests, {args.error_rate:.0%} of gpt-4o calls fail\n")
+    print(f"{'errors':<8}{'layer':<10}{'ok':>8}{'p50 s':>8}{'p99 s':>8}{'gpt-4o calls/request':>22}")
+    for status in (503, 400):
+        fakes.ERROR_RATE["gpt-4o"] = args.error_rate
+        fakes.ERROR_STATUS["gpt-4o"] = status
+        for shipped in (False, True):
+            _configure(resilience, chat_backends, shipped, scale)
+            fakes.seed(1)
+            # Fallback is part 3; here only retries count
+            chat_backends.FALLBACK_ENABLED = False
+            fakes.calls.clear()
+            with _quiet():
+                rows = [chat(number) for number in range(args.requests)]
+            ok = sum(row[0] == 200 for row in rows)
+            seconds = [row[2] for row in rows]
+            print(f"{status:<8}{'shipped' if shipped else 'before':<10}{ok / len(rows):>8.1%}"
+                  f"{_percentile(seconds, 50):>8.2f}{_percentile(seconds, 99):>8.2f}"
+                  f"{fakes.calls.get('gpt-4o', 0) / len(rows):>22.2f}")
+    fakes.ERROR_RATE.pop("gpt-4o")
+
+    # 2. hung
+    requests = max(1, args.requests // 4)
+    print(f"\n2. hung: gemini_image_generator, {requests} requests from {args.clients} clients, "
+          f"{args.hang_rate:.0%} of Imagen calls never return (the Lambda times out at {LAMBDA_TIMEOUT} s)\n")
+    print(f"{'layer':<10}{'held p50':>10}{'held p99':>10}{'in time':>9}{'Lambda s':>10}  statuses")
+    fakes.HANG_RATE[IMAGE_MODEL] = args.hang_rate
+    fakes.HANG_SECONDS["seconds"] = LAMBDA_TIMEOUT * scale
+
+    def image(number):
+        start = time.perf_counter()
+        response = handler.gemini_image_generator(http_event({"prompt": f"Bakery poster {number}"}, headers), None)
+        held = (time.perf_counter() - start) / scale
+        # The fake returns in the end; Lambda would have killed the invocation
+        if held >= LAMBDA_TIMEOUT:
+            return "killed", LAMBDA_TIMEOUT
+        return response["statusCode"], held
+
+    for shipped in (False, True):
+        _configure(resilience, chat_backends, shipped, scale)
+        with _quiet(), ThreadPoolExecutor(args.clients) as pool:
+            rows = list(pool.map(image, range(requests)))
+        held = [row[1] for row in rows]
+        in_time = sum(row[0] == 200 and row[1] <= 30 for row in rows)
+        statuses = {}
+        for code, _ in rows:
+            statuses[str(code)] = statuses.get(str(code), 0) + 1
+        print(f"{'shipped' if shipped else 'before':<10}{_percentile(held, 50):>8.1f} s{_percentile(held, 99):>8.1f} s"
+              f"{in_time / len(rows):>9.0%}{sum(held):>10.0f}{'  ' + ', '.join(f'{code}: {count}' for code, count in sorted(statuses.items()))}")
+    fakes.HANG_RATE.pop(IMAGE_MODEL)
+
+    # 3. outage
+    print(f"\n3. outage: chatbot, {args.clients} clients for {args.outage:.0f} s, gpt-4o returns 503s "
+          f"from {args.outage / 3:.0f} s to {2 * args.outage / 3:.0f} s\n")
+    print(f"{'layer':<10}{'window':<8}{'requests':>9}{'ok':>7}{'gemini':>8}{'p50 s':>8}{'p99 s':>8}"
+          f"{'gpt-4o calls':>14}")
+    for shipped in (False, True):
+        _configure(resilience, chat_backends, shipped, scale)
+        fakes.calls.clear()
+        start = time.perf_counter()
+        length = args.outage * scale
+        windows = {"before": [], "down": [], "after": []}
+        calls = {}
+
+        def client(index):
+            number = 0
+            while True:
+                elapsed = time.perf_counter() - start
+                if elapsed >= length:
+                    return
+                window = "before" if elapsed < length / 3 else "down" if elapsed < 2 * length / 3 else "after"
+                windows[window].append(chat(f"{index}-{number}"))
+                number += 1
+
+        def outage():
+            # Takes gpt-4o down and up again, counting its calls in each window
+            for window, until in (("before", 1 / 3), ("down", 2 / 3), ("after", 1.0)):
+                fakes.ERROR_RATE["gpt-4o"] = 1.0 if window == "down" else 0.0
+                while time.perf_counter() - start < length * until:
+                    time.sleep(0.001)
+                calls[window] = fakes.calls.get("gpt-4o", 0) - sum(calls.values())
+
+        fakes.ERROR_STATUS["gpt-4o"] = 503
+        with _quiet(), ThreadPoolExecutor(args.clients + 1) as pool:
+            pool.submit(outage)
+            list(pool.map(client, range(args.clients)))
+        for window, rows in windows.items():
+            seconds = [row[2] for row in rows]
+            print(f"{'shipped' if shipped else 'before':<10}{window:<8}{len(rows):>9}"
+                  f"{sum(row[0] == 200 for row in rows):>7}{sum(row[1] == 'gemini-2.0-flash' for row in rows):>8}"
+                  f"{_percentile(seconds, 50):>8.2f}{_percentile(seconds, 99):>8.2f}{calls.get(window, 0):>14}")
+    fakes.ERROR_RATE.pop("gpt-4o")
+    print(f"\nbreakers: {resilience.stats()}")
+
+
+if __name__ == "__main__":
+    main()
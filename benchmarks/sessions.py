@@ -0,0 +1,108 @@
+"""Long conversations: client-side history through gemini_chat against chat_session
+
+Without sessions the client has to resend the whole transcript in every
+prompt, so request size, input tokens and (with --prefill) latency grow with
+each turn. chat_session keeps the history in the fake DynamoDB table and
+compacts it past SESSION_TOKEN_BUDGET, so the client sends only the new
+message. Reports both at a few turns, plus the DynamoDB calls chat_session
+made, and the same conversation served by a second container that has to
+read the session from the table.
+
+    python -m benchmarks.sessions [--turns 40] [--chat-chars 800] [--prefill 0.05] [--budget 4000]
+"""
+import argparse
+import contextlib
+import json
+import os
+
+from benchmarks import fakes
+from benchmarks.events import http_event
+
+TABLE = "offline-sessions"
+
+
+def _message(number):
+    return f"Turn {number}: give me another idea for the bakery's weekend campaign"
+
+
+def _run(call, turns):
+    """[(request bytes, input tokens, total ms)] per turn"""
+    import metrics
+
+    rows = []
+    with metrics.capture() as documents, open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for number in range(1, turns + 1):
+            size = call(number)
+            document = documents[-1]
+            rows.append((size, document.get("InputTokens", 0), document["TotalMs"]))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=40)
+    parser.add_argument("--chat-chars", type=int, default=800, help="characters per answer")
+    parser.add_argument("--prefill", type=float, default=0.05, help="seconds per 1000 input tokens")
+    parser.add_argument("--budget", type=int, default=4000, help="SESSION_TOKEN_BUDGET")
+    args = parser.parse_args()
+
+    fakes.install(scale=0)
+    os.environ["SESSIONS_TABLE"] = TABLE
+    os.environ["SESSION_TOKEN_BUDGET"] = str(args.budget)
+    os.environ["MODEL_CATALOG_PATH"] = ""
+    import handler
+    import sessions
+
+    fakes.PAYLOAD["chat_chars"] = args.chat_chars
+    fakes.PREFILL["seconds_per_1k_tokens"] = args.prefill
+    headers = {"cache-control": "no-cache"}
+
+    transcript = []
+
+    def stateless(number):
+        prompt = "\n".join(transcript + [f"User: {_message(number)}"])
+        body = {"prompt": prompt}
+        response = handler.gemini_chat(http_event(body, headers), None)
+        # The fakes echo the prompt; keep the answer they give to the message alone
+        answer = fakes._answer(response["headers"]["X-Served-By"], _message(number))
+        transcript.extend([f"User: {_message(number)}", f"Assistant: {answer}"])
+        return len(json.dumps(body))
+
+    session = {}
+
+    def stateful(number):
+        body = {"message": _message(number)}
+        body.update(session)
+        response = json.loads(handler.chat_session(http_event(body, headers), None)["body"])
+        session["session_id"] = response["session_id"]
+        return len(json.dumps(body))
+
+    full = _run(stateless, args.turns)
+    fakes.dynamodb_calls.clear()
+    kept = _run(stateful, args.turns)
+    calls = dict(fakes.dynamodb_calls)
+
+    print(f"{args.turns} turns, ~{args.chat_chars} character answers, {args.prefill * 1000:.0f} ms per 1k input "
+          f"tokens, session budget {args.budget} tokens\n")
+    print(f"{'turn':>5}{'history bytes':>15}{'session bytes':>15}{'history tok':>13}{'session tok':>13}"
+          f"{'history ms':>12}{'session ms':>12}")
+    for number in sorted({1, 5, 10, 20, args.turns} & set(range(1, args.turns + 1))):
+        (full_size, full_tokens, full_ms), (size, input_tokens, ms) = full[number - 1], kept[number - 1]
+        print(f"{number:>5}{full_size:>15}{size:>15}{full_tokens:>13}{input_tokens:>13}"
+              f"{full_ms:>12.0f}{ms:>12.0f}")
+    print(f"\ntotal input tokens: history {sum(row[1] for row in full)}, session {sum(row[1] for row in kept)} "
+          f"(summary calls included)")
+    print(f"chat_session DynamoDB calls over {args.turns} turns: {calls}")
+
+    # A different container picks up the conversation: one GetItem and one Query, then back to PutItem only
+    sessions.recent.pop(session["session_id"])
+    fakes.dynamodb_calls.clear()
+    stored = sessions.store.load(session["session_id"])
+    fakes.dynamodb_calls.clear()
+    _run(stateful, 3)
+    print(f"3 more turns in a cold container: {dict(fakes.dynamodb_calls)}; "
+          f"table holds the summary through turn {stored.through} and {len(stored.turns)} turns after it")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Single-flight coalescing: a campaign sending the same prompts at once
+
+Part 1 sends --requests requests for --prompts distinct prompts through
+gemini_chat from --clients threads of one process, all within --spread
+seconds, with coalescing off and on. Part 2 does the same through
+gemini_image_generator from --containers simulated containers, one request
+at a time each as Lambda runs them, with coalescing off, inside each
+container only, and with the lease in the fake DynamoDB table shared by all
+of them. Each row counts the provider calls made and saved (the Coalesced
+metric) and, in part 2, the lease's DynamoDB calls per request.
+
+    python -m benchmarks.singleflight [--requests 200] [--prompts 4] [--containers 16] [--latency 1.0]
+"""
+import argparse
+import contextlib
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks import fakes
+from benchmarks.events import http_event
+
+TABLE = "offline-cache"
+CHAT_MODEL = "gemini-2.0-flash"
+IMAGE_MODEL = "imagen-3.0-generate-001"
+
+
+def _percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(p / 100 * (len(ordered) - 1)))] if ordered else 0.0
+
+
+class Containers:
+    """Stands in for singleflight.flights: one Flights per simulated container, picked by thread"""
+
+    def __init__(self, flights):
+        self.flights = flights
+        self.local = threading.local()
+
+    def run(self, *args, **kwargs):
+        return self.flights[self.local.container].run(*args, **kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--prompts", type=int, default=4, help="distinct prompts in the campaign")
+    parser.add_argument("--clients", type=int, default=32, help="threads in part 1")
+    parser.add_argument("--containers", type=int, default=16, help="containers in part 2")
+    parser.add_argument("--spread", type=float, default=2.0, help="seconds over which requests arrive")
+    parser.add_argument("--latency", type=float, default=1.0, help="median seconds per Gemini call")
+    parser.add_argument("--image-latency", type=float, default=2.0, help="median seconds per Imagen call")
+    parser.add_argument("--db-latency", type=float, default=0.004, help="seconds per DynamoDB call")
+    parser.add_argument("--poll", type=float, default=0.05, help="SINGLE_FLIGHT_POLL")
+    args = parser.parse_args()
+
+    fakes.install(scale=0)
+    fakes.seed(1)
+    os.environ.update(MODEL_CATALOG_PATH="", CACHE_TABLE=TABLE, SINGLE_FLIGHT_POLL=str(args.poll))
+    os.environ.setdefault("IMAGE_CACHE_DIR", "/tmp/benchmark-image-cache")
+    import handler
+    import metrics
+    import singleflight
+    import stores
+
+    fakes.MODEL_LATENCY[CHAT_MODEL] = fakes.lognormal(args.latency, 0.3)
+    fakes.MODEL_LATENCY[IMAGE_MODEL] = fakes.lognormal(args.image_latency, 0.3)
+    fakes.CALL_LATENCY["dynamodb"] = args.db_latency
+    arrivals = random.Random(1)
+    # The image cache directory outlives the process
+    run = time.strftime("%Y%m%d%H%M%S")
+
+    def burst(label, send, workers, model, initializer=None):
+        """send(number, prompt) for every request, arriving over --spread seconds; one result row"""
+        offsets = sorted(arrivals.uniform(0, args.spread) for _ in range(args.requests))
+        # Fresh prompts per row and run, so nothing is answered from an earlier one's cache
+        prompts = [f"Campaign {label} slogan {index} for the bakery, run {run}" for index in range(args.prompts)]
+        fakes.calls.clear()
+        fakes.dynamodb_calls.clear()
+        start = time.perf_counter()
+
+        def request(number):
+            time.sleep(max(0.0, start + offsets[number] - time.perf_counter()))
+            began = time.perf_counter()
+            response = send(number, prompts[number % args.prompts])
+            return response, time.perf_counter() - began
+
+        with metrics.capture() as documents, open(os.devnull, "w") as devnull, \
+                contextlib.redirect_stdout(devnull), ThreadPoolExecutor(workers, initializer=initializer) as pool:
+            rows = list(pool.map(request, range(args.requests)))
+        seconds = [row[1] for row in rows]
+        ok = sum(row[0]["statusCode"] == 200 for row in rows)
+        saved = sum(document.get("Coalesced", 0) for document in documents)
+        lease_calls = sum(fakes.dynamodb_calls.values())
+        print(f"{label:<11}{len(rows):>9}{ok:>6}{fakes.calls.get(model, 0):>7}{saved:>7}"
+              f"{_percentile(seconds, 50):>8.2f}{_percentile(seconds, 99):>8.2f}{lease_calls / len(rows):>10.2f}")
+
+    header = f"{'coalescing':<11}{'requests':>9}{'ok':>6}{'calls':>7}{'saved':>7}{'p50 s':>8}{'p99 s':>8}{'DDB/req':>10}"
+
+    # Part 1: threads of one process
+    print(f"part 1: gemini_chat, {args.requests} requests for {args.prompts} prompts from {args.clients} threads "
+          f"over {args.spread:.0f} s, {args.latency:.1f} s per Gemini call\n")
+    print(header)
+
+    def chat(number, prompt):
+        return handler.gemini_chat(http_event({"prompt": prompt}), None)
+
+    for label, enabled in (("off", False), ("on", True)):
+        singleflight.SINGLE_FLIGHT_ENABLED = enabled
+        burst(label, chat, args.clients, CHAT_MODEL)
+
+    # Part 2: one request at a time per container
+    print(f"\npart 2: gemini_image_generator, {args.requests} requests for {args.prompts} prompts from "
+          f"{args.containers} containers, {args.image_latency:.1f} s per Imagen call\n")
+    print(header)
+    shipped = singleflight.flights
+    for label, enabled, leases in (("off", False, None), ("container", True, None),
+                                   ("shared", True, stores.DynamoDBStore(TABLE, "flight"))):
+        singleflight.SINGLE_FLIGHT_ENABLED = enabled
+        containers = Containers([singleflight.Flights(leases) for _ in range(args.containers)])
+        singleflight.flights = containers
+        numbers = iter(range(args.containers))
+
+        def boot():
+            # Each pool thread is one container, so its requests run one after another
+            containers.local.container = next(numbers)
+
+        def image(number, prompt):
+            return handler.gemini_image_generator(http_event({"prompt": prompt}), None)
+
+        burst(label, image, args.containers, IMAGE_MODEL, boot)
+    singleflight.flights = shipped
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Time-to-first-byte vs total latency for streamed and buffered Gemini Pro chat
+
+Starts stream_server.py on a local port with a fake Gemini that emits --chunks
+chunks, --first-delay seconds before the first and --chunk-delay between the
+rest, then compares it with the buffered gemini_pro_chat handler.
+
+    python -m benchmarks.stream_latency [--chunks 20] [--first-delay 0.5] [--chunk-delay 0.1]
+"""
+import argparse
+import contextlib
+import http.client
+import json
+import os
+import threading
+import time
+
+from benchmarks import fakes
+
+
+def _stream_request(port, sse):
+    headers = {"Content-Type": "application/json"}
+    if sse:
+        headers["Accept"] = "text/event-stream"
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    start = time.perf_counter()
+    connection.request("POST", "/", body=json.dumps({"prompt": "Write a campaign plan"}), headers=headers)
+    response = connection.getresponse()
+    response.read(1)
+    ttfb = time.perf_counter() - start
+    body = response.read()
+    total = time.perf_counter() - start
+    connection.close()
+    return ttfb, total, len(body) + 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=20)
+    parser.add_argument("--first-delay", type=float, default=0.5)
+    parser.add_argument("--chunk-delay", type=float, default=0.1)
+    args = parser.parse_args()
+
+    fakes.install(scale=0)
+    fakes.GENERATION.update(chunks=args.chunks, first_chunk_delay=args.first_delay,
+                            chunk_delay=args.chunk_delay)
+
+    import handler
+    import stream_server
+    from http.server import ThreadingHTTPServer
+    from benchmarks.events import sample_events
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), stream_server.StreamingChatHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        # Warm the providers so only generation time is measured
+        handler.gemini_pro_chat(sample_events()["gemini_pro_chat"], None)
+
+        rows = []
+        start = time.perf_counter()
+        response = handler.gemini_pro_chat(sample_events()["gemini_pro_chat"], None)
+        total = time.perf_counter() - start
+        rows.append(("buffered handler", total, total, len(response["body"])))
+
+        ttfb, total, size = _stream_request(port, sse=False)
+        rows.append(("stream chunked text", ttfb, total, size))
+        ttfb, total, size = _stream_request(port, sse=True)
+        rows.append(("stream sse", ttfb, total, size))
+        server.shutdown()
+
+    print(f"{'mode':<22}{'ttfb ms':>10}{'total ms':>10}{'bytes':>8}")
+    for mode, ttfb, total, size in rows:
+        print(f"{mode:<22}{ttfb * 1000:>10.1f}{total * 1000:>10.1f}{size:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Prompt compaction: tokens saved and time spent by the budget stage
+
+Builds prompts of a few shapes (clean text, pasted text full of whitespace,
+the same paragraphs pasted several times, a document far over the budget,
+Hebrew), runs tokens.compact() on each against the gemini_chat budget and
+reports the estimated tokens before and after and how long it took. Then
+sends each through gemini_chat as is, where only the model's context window
+limits the prompt, and with "compact": true, and reads the X-Input-Tokens
+and X-Tokens-Saved headers back; last, X-Max-Output-Tokens per "length".
+
+    python -m benchmarks.token_budget [--kb 64] [--runs 20]
+"""
+import argparse
+import contextlib
+import os
+import time
+
+from benchmarks import fakes
+from benchmarks.events import http_event
+
+PARAGRAPH = ("Our bakery on Herzl street sells sourdough, croissants and seasonal cakes, baked every "
+             "morning from 5. We deliver to offices in the area and cater events of up to 200 guests.")
+HEBREW = "המאפייה שלנו ברחוב הרצל מוכרת לחם מחמצת, קרואסונים ועוגות עונתיות שנאפים כל בוקר."
+QUESTION = "Write three taglines for our new campaign."
+
+
+def _shapes(size):
+    """name -> prompt of about size characters"""
+    count = max(1, size // len(PARAGRAPH))
+    unique = [f"{index}. {PARAGRAPH}" for index in range(count)]
+    return {
+        "clean": "\n\n".join(unique) + "\n\n" + QUESTION,
+        "whitespace": "\n\n\n".join("   ".join(part.split(" ")) + "  \t \n" for part in unique) + QUESTION,
+        "repeated": "\n\n".join(unique[:max(1, count // 8)] * 8) + "\n\n" + QUESTION,
+        "oversized": "\n\n".join(unique * 8) + "\n\n" + QUESTION,
+        "hebrew": "\n\n".join(f"{index}. {HEBREW}" for index in range(count)) + "\n\n" + QUESTION,
+    }
+
+
+def _send(handler, body):
+    """gemini_chat's response headers for body"""
+    return handler.gemini_chat(http_event(body, {"cache-control": "no-cache"}), None)["headers"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--kb", type=int, default=64, help="size of each prompt shape")
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    fakes.install(scale=0)
+    os.environ.update(MODEL_CATALOG_PATH="", CACHE_STORE="local")
+    import handler
+    import token_budget
+    import tokens
+
+    limit = token_budget.PROMPT_TOKEN_BUDGETS["gemini_chat"]
+    print(f"gemini_chat budget with compact {limit} tokens, prompts of about {args.kb} KB\n")
+    print(f"{'shape':<12}{'chars':>9}{'tokens':>9}{'after':>8}{'saved':>7}{'compact ms':>12}"
+          f"{'X-Tokens-Saved':>16}{'with compact':>14}{'X-Input-Tokens':>16}")
+    for name, prompt in _shapes(args.kb * 1024).items():
+        start = time.perf_counter()
+        for _ in range(args.runs):
+            text, before, after = tokens.compact(prompt, limit)
+        milliseconds = (time.perf_counter() - start) / args.runs * 1000
+        assert text.endswith(QUESTION)
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            plain = _send(handler, {"prompt": prompt})
+            compacted = _send(handler, {"prompt": prompt, "compact": True})
+        print(f"{name:<12}{len(prompt):>9}{before:>9}{after:>8}{1 - after / before:>7.0%}{milliseconds:>12.2f}"
+              f"{plain['X-Tokens-Saved']:>16}{compacted['X-Tokens-Saved']:>14}{compacted['X-Input-Tokens']:>16}")
+
+    print("\nX-Max-Output-Tokens by length:")
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        rows = [(length, _send(handler, dict({"prompt": QUESTION}, **({"length": length} if length else {}))))
+                for length in [None, *token_budget.OUTPUT_TOKENS]]
+    for length, headers in rows:
+        print(f"  {length or '(none)':<10}{headers.get('X-Max-Output-Tokens', 'no cap')}")
+
+
+if __name__ == "__main__":
+    main()
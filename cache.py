@@ -0,0 +1,96 @@
+import threading
+import time
+from collections import OrderedDict
+
+import log
+
+# In-container LRU cache with a TTL and entry/byte bounds. Lives at module level
+# in whatever uses it so warm invocations of the same container share it.
+
+
+class TTLCache:
+    """LRU cache whose entries expire after ttl seconds"""
+
+    def __init__(self, max_entries=256, ttl=3600, max_bytes=None, on_evict=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        # Called with (key, value) when an entry expires or is evicted
+        self.on_evict = on_evict
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, size, expires_at = entry
+            if expires_at <= time.time():
+                self._remove(key)
+                self.misses += 1
+                expired = value
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+        self._evicted(key, expired)
+        return None
+
+    def set(self, key, value, size=None, ttl=None):
+        if size is None:
+            size = len(value) if hasattr(value, "__len__") else 1
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        evicted = []
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, expires_at)
+            self.bytes += size
+            while len(self._entries) > self.max_entries or (
+                    self.max_bytes is not None and self.bytes > self.max_bytes):
+                oldest = next(iter(self._entries))
+                evicted.append((oldest, self._remove(oldest)))
+                self.evictions += 1
+        for evicted_key, evicted_value in evicted:
+            self._evicted(evicted_key, evicted_value)
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._remove(key)
+                return entry[0]
+        return None
+
+    def _remove(self, key):
+        value, size, expires_at = self._entries.pop(key)
+        self.bytes -= size
+        return value
+
+    def _evicted(self, key, value):
+        if self.on_evict is None:
+            return
+        try:
+            self.on_evict(key, value)
+        except Exception as e:
+            log.warning("Cache eviction callback failed", key=key, error=str(e))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,155 @@
+import asyncio
+import os
+import time
+
+import context_cache
+import log
+import metrics
+import model_catalog
+import providers
+import resilience
+
+# Async callers for the existing chat backends, keyed by model name, and a
+# runner that fans one prompt out to several of them at once. Calls use the
+# SDKs' native async APIs (ChatOpenAI.ainvoke, generate_content_async) so a
+# backend that times out or misses the deadline is really cancelled. Each call
+# goes through its provider's circuit breaker; the sync chat handlers use
+# fallback() to answer from another provider when theirs is down.
+
+GEMINI_GENERATION_CONFIG = {
+    "max_output_tokens": 8192,  # Maximum tokens for output
+    "temperature": 0.3,  # Lower temperature for more consistent, factual responses
+}
+
+# Providers each backend needs, built before the event loop starts
+BACKEND_PROVIDERS = {
+    "gpt-4o": "llm",
+    "gemini-2.0-flash": "genai",
+    "gemini-3-pro-preview": "genai",
+}
+
+# Backend that answers when a backend's provider is down (breaker open) or out of time
+FALLBACK_ENABLED = os.environ.get("PROVIDER_FALLBACK", "true").lower() == "true"
+FALLBACK_MODELS = {
+    "gpt-4o": "gemini-2.0-flash",
+    "gemini-2.0-flash": "gpt-4o",
+    "gemini-3-pro-preview": "gpt-4o",
+}
+
+BACKEND_TIMEOUT = float(os.environ.get("COMPARE_BACKEND_TIMEOUT", "25"))
+# httpApi routes are cut off by API Gateway after 30 seconds
+COMPARE_DEADLINE = float(os.environ.get("COMPARE_DEADLINE", "25"))
+
+# One loop per container: async HTTP/gRPC clients bind to the loop that first
+# used them, so asyncio.run()'s fresh loop per invocation would break them
+_loop = asyncio.new_event_loop()
+
+
+def openai_messages(prompt, system=None):
+    """LangChain input for prompt, with system as the system message"""
+    return [("system", system), ("human", prompt)] if system else prompt
+
+
+def invoke(messages, system=None, max_tokens=None):
+    """ChatOpenAI.invoke through resilience.call(); system keeps a long prefix in OpenAI's cache"""
+    kwargs = context_cache.openai_kwargs(system)
+    if max_tokens:
+        kwargs["max_tokens"] = max_tokens
+    return resilience.call(providers.LLM_MODEL, providers.get("llm").invoke, messages, **kwargs)
+
+
+def _generation_config(max_tokens=None):
+    if max_tokens:
+        return dict(GEMINI_GENERATION_CONFIG, max_output_tokens=max_tokens)
+    return GEMINI_GENERATION_CONFIG
+
+
+async def _openai(prompt, system=None, max_tokens=None):
+    kwargs = context_cache.openai_kwargs(system)
+    if max_tokens:
+        kwargs["max_tokens"] = max_tokens
+    msg = await resilience.acall(providers.LLM_MODEL, providers.get("llm").ainvoke, openai_messages(prompt, system),
+                                 **kwargs)
+    return msg.content
+
+
+async def _gemini(model_name, prompt, system=None, max_tokens=None):
+    response_gemini = await context_cache.generate_content_async(
+        model_catalog.resolve(model_name),
+        prompt,
+        system,
+        generation_config=_generation_config(max_tokens)
+    )
+    return response_gemini.text
+
+
+def call(name, prompt, system=None, max_tokens=None):
+    """Coroutine asking one backend to answer prompt in at most max_tokens (the backend's default if None)"""
+    if name == "gpt-4o":
+        return _openai(prompt, system, max_tokens)
+    return _gemini(name, prompt, system, max_tokens)
+
+
+def prepare(names):
+    """Build the providers for names now, outside the event loop"""
+    for name in names:
+        providers.get(BACKEND_PROVIDERS[name])
+
+
+def run(coroutine):
+    return _loop.run_until_complete(coroutine)
+
+
+def answer(name, prompt, system=None, max_tokens=None):
+    """Blocking counterpart of call(), for use outside the event loop"""
+    if name == "gpt-4o":
+        return invoke(openai_messages(prompt, system), system, max_tokens).content
+    return context_cache.generate_content(model_catalog.resolve(name), prompt, system,
+                                          generation_config=_generation_config(max_tokens)).text
+
+
+def fallback(name, prompt, error, system=None, max_tokens=None):
+    """(text, backend) from name's fallback backend after error; error is re-raised when there is none
+
+    Only errors that say the provider is down or slow fall back; a rejected
+    prompt would be rejected by the other provider too.
+    """
+    backup = FALLBACK_MODELS.get(name) if FALLBACK_ENABLED else None
+    if backup is None or not resilience.degraded(error):
+        raise error
+    log.warning("Falling back to another backend", backend=name, fallback=backup, error=str(error))
+    metrics.count("Fallback")
+    return answer(backup, prompt, system, max_tokens), backup
+
+
+async def _timed(name, prompt, timeout, system=None, max_tokens=None):
+    start = time.perf_counter()
+    result = {"backend": name}
+    try:
+        result["text"] = await asyncio.wait_for(call(name, prompt, system, max_tokens), timeout)
+        result["status"] = "success"
+    except asyncio.TimeoutError:
+        result["status"] = "timeout"
+        result["error"] = f"No answer within {timeout} seconds"
+    except Exception as e:
+        log.warning("Error from backend", backend=name, error=str(e))
+        result["status"] = "error"
+        result["error"] = str(e)
+    result["latency_ms"] = round((time.perf_counter() - start) * 1000)
+    return result
+
+
+async def compare(prompt, names, timeout=BACKEND_TIMEOUT, deadline=COMPARE_DEADLINE, system=None, max_tokens=None):
+    """Ask every backend at once and keep the answers that arrive before the deadline"""
+    tasks = {asyncio.ensure_future(_timed(name, prompt, timeout, system, max_tokens)): name for name in names}
+    done, pending = await asyncio.wait(tasks, timeout=deadline)
+
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+
+    results = [task.result() for task in done]
+    results += [{"backend": tasks[task], "status": "cancelled",
+                 "error": f"Missed the {deadline} second deadline"} for task in pending]
+    order = {name: index for index, name in enumerate(names)}
+    return sorted(results, key=lambda result: order[result["backend"]])
@@ -0,0 +1,204 @@
+import asyncio
+import datetime
+import hashlib
+import os
+import threading
+import time
+
+import log
+import providers
+import resilience
+import tokens
+from cache import TTLCache
+
+# Provider-side caching of long system prefixes (the business context that
+# profiles.py adds to chat requests). Gemini caches them explicitly: one
+# CachedContent is created per prefix and model, and later requests only send
+# the new prompt. OpenAI caches identical prompt prefixes of 1024+ tokens on
+# its own; a stable prompt_cache_key sends repeats of a prefix to the same
+# cache. The registries map a hash of model and prefix to the provider handle,
+# refresh the provider TTL of prefixes that are still in use and delete the
+# Gemini caches they evict, so unused caches stop being billed.
+
+CONTEXT_CACHE_ENABLED = os.environ.get("CONTEXT_CACHE_ENABLED", "true").lower() == "true"
+# Gemini refuses to cache less than this (it depends on the model)
+GEMINI_CACHE_MIN_TOKENS = int(os.environ.get("GEMINI_CACHE_MIN_TOKENS", "4096"))
+GEMINI_CACHE_TTL = int(os.environ.get("GEMINI_CACHE_TTL", "3600"))
+# OpenAI only caches prompts of at least 1024 tokens
+OPENAI_CACHE_MIN_TOKENS = 1024
+# OpenAI keeps an idle prefix for about 5-10 minutes
+OPENAI_CACHE_TTL = 300
+
+# Extend the provider TTL once less than this fraction of it is left
+REFRESH_FRACTION = 0.5
+# Stop using a handle this many seconds before the provider expires it
+EXPIRY_MARGIN = 60
+# A prefix the provider refused to cache is not tried again for this long
+FAILURE_TTL = 600
+
+
+def prefix_key(model_name, prefix):
+    return hashlib.sha256(f"{model_name}\0{prefix}".encode("utf-8")).hexdigest()
+
+
+class Entry:
+    """Provider handle of one cached prefix (None if the provider refused it)"""
+
+    def __init__(self, handle, ttl):
+        self.handle = handle
+        self.expires_at = time.time() + ttl
+
+
+class ContextRegistry:
+    """Provider cache handles by prefix hash, kept alive while they are used"""
+
+    def __init__(self, create, refresh=None, delete=None, ttl=3600, max_entries=64):
+        # create(model_name, prefix, ttl) -> handle, refresh(handle, ttl), delete(handle)
+        self._create = create
+        self._refresh = refresh
+        self._delete = delete
+        self.ttl = ttl
+        self.entries = TTLCache(max_entries=max_entries, ttl=max(1, ttl - EXPIRY_MARGIN), on_evict=self._evicted)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.created = 0
+        self.refreshed = 0
+        self.failures = 0
+
+    def get(self, model_name, prefix):
+        """Handle for prefix on model_name, creating it on first use; None if the provider refused"""
+        key = prefix_key(model_name, prefix)
+        entry = self.entries.get(key)
+        if entry is None:
+            with self._lock:
+                entry = self.entries.get(key)
+                if entry is None:
+                    return self._add(key, model_name, prefix)
+        if entry.handle is not None:
+            self.hits += 1
+            self._keep_alive(key, entry)
+        return entry.handle
+
+    def forget(self, model_name, prefix):
+        """Drop the handle of a prefix the provider no longer has"""
+        self.entries.pop(prefix_key(model_name, prefix))
+
+    def _add(self, key, model_name, prefix):
+        try:
+            handle = self._create(model_name, prefix, self.ttl)
+        except Exception as e:
+            log.warning("Context cache create failed", model=model_name, error=str(e))
+            self.failures += 1
+            self.entries.set(key, Entry(None, FAILURE_TTL), size=1, ttl=FAILURE_TTL)
+            return None
+        self.created += 1
+        self.entries.set(key, Entry(handle, self.ttl), size=1)
+        log.info("Context cached", model=model_name, prefix_tokens=tokens.estimate_tokens(prefix))
+        return handle
+
+    def _keep_alive(self, key, entry):
+        if entry.expires_at - time.time() > self.ttl * REFRESH_FRACTION:
+            return
+        if self._refresh is not None:
+            try:
+                self._refresh(entry.handle, self.ttl)
+            except Exception as e:
+                # Keep using it until it expires; the next miss creates a new one
+                log.warning("Context cache refresh failed", error=str(e))
+                return
+        self.refreshed += 1
+        entry.expires_at = time.time() + self.ttl
+        self.entries.set(key, entry, size=1)
+
+    def _evicted(self, key, entry):
+        if entry.handle is not None and self._delete is not None:
+            self._delete(entry.handle)
+
+    def stats(self):
+        return {"entries": len(self.entries), "hits": self.hits, "created": self.created,
+                "refreshed": self.refreshed, "failures": self.failures}
+
+
+def _gemini_create(model_name, prefix, ttl):
+    providers.get("genai")
+    from google.generativeai import caching
+
+    return caching.CachedContent.create(
+        model=f"models/{model_name}",
+        display_name=prefix_key(model_name, prefix)[:32],
+        system_instruction=prefix,
+        ttl=datetime.timedelta(seconds=ttl),
+    )
+
+
+def _gemini_refresh(handle, ttl):
+    handle.update(ttl=datetime.timedelta(seconds=ttl))
+
+
+def _gemini_delete(handle):
+    handle.delete()
+
+
+gemini_contexts = ContextRegistry(
+    _gemini_create, _gemini_refresh, _gemini_delete, ttl=GEMINI_CACHE_TTL,
+    max_entries=int(os.environ.get("GEMINI_CACHE_MAX_ENTRIES", "64")),
+)
+
+# The handle is the prompt_cache_key itself; OpenAI extends and drops caches on its own
+openai_contexts = ContextRegistry(lambda model_name, prefix, ttl: prefix_key(model_name, prefix)[:32],
+                                  ttl=OPENAI_CACHE_TTL, max_entries=1024)
+
+
+def gemini_model(model_name, system=None):
+    """GenerativeModel with system as its instruction, read from a cached context when it is long enough"""
+    genai = providers.get("genai")
+    if system and CONTEXT_CACHE_ENABLED and tokens.estimate_tokens(system) >= GEMINI_CACHE_MIN_TOKENS:
+        cached_content = gemini_contexts.get(model_name, system)
+        if cached_content is not None:
+            return genai.GenerativeModel.from_cached_content(cached_content=cached_content)
+    return genai.GenerativeModel(model_name, system_instruction=system)
+
+
+def _cache_gone(error):
+    # google.api_core NotFound / PermissionDenied for a deleted or expired CachedContent
+    return type(error).__name__ in ("NotFound", "PermissionDenied") or "cachedcontent" in str(error).lower()
+
+
+def _uncached(model, model_name, system, error):
+    """Model that sends system in full, when model's cached context is gone; else re-raise error"""
+    if getattr(model, "cached_content", None) is None or not _cache_gone(error):
+        raise error
+    log.warning("Cached context is gone, sending the full context", model=model_name, error=str(error))
+    gemini_contexts.forget(model_name, system)
+    return providers.get("genai").GenerativeModel(model_name, system_instruction=system)
+
+
+def generate_content(model_name, prompt, system=None, **kwargs):
+    """gemini_model(model_name, system).generate_content(prompt, **kwargs), through resilience.call()"""
+    model = gemini_model(model_name, system)
+    try:
+        return resilience.call(model_name, model.generate_content, prompt, **kwargs)
+    except Exception as e:
+        model = _uncached(model, model_name, system, e)
+        return resilience.call(model_name, model.generate_content, prompt, **kwargs)
+
+
+async def generate_content_async(model_name, prompt, system=None, **kwargs):
+    """Async generate_content; creating a cached context runs off the event loop"""
+    if system:
+        model = await asyncio.get_running_loop().run_in_executor(None, resilience.bind(gemini_model), model_name,
+                                                                   system)
+    else:
+        model = gemini_model(model_name)
+    try:
+        return await resilience.acall(model_name, model.generate_content_async, prompt, **kwargs)
+    except Exception as e:
+        model = _uncached(model, model_name, system, e)
+        return await resilience.acall(model_name, model.generate_content_async, prompt, **kwargs)
+
+
+def openai_kwargs(system=None):
+    """Extra ChatOpenAI.invoke arguments that keep a long system prefix in OpenAI's cache"""
+    if not system or not CONTEXT_CACHE_ENABLED or tokens.estimate_tokens(system) < OPENAI_CACHE_MIN_TOKENS:
+        return {}
+    return {"prompt_cache_key": openai_contexts.get(providers.LLM_MODEL, system)}
@@ -1,687 +1,773 @@
-import json
-import os
-import re
-import boto3
-from langchain_openai import ChatOpenAI
-from openai import OpenAI
-import google.generativeai as genai
-from vertexai.preview.vision_models import ImageGenerationModel
-import vertexai
-
-from conf import open_api_api_key, gemini_api_key, gcp_project_id, gcp_region, api_secret_key, server_api_key
-
-os.environ["OPENAI_API_KEY"] = open_api_api_key
-
-OpenAIClient = OpenAI(
-    api_key=open_api_api_key
-)
-
-# Configure Gemini
-genai.configure(api_key=gemini_api_key)
-
-# Initialize Vertex AI
-try:
-    # Use environment variables first, then fall back to conf.py
-    GCP_PROJECT_ID = os.environ.get("GCP_PROJECT_ID", gcp_project_id)
-    GCP_REGION = os.environ.get("GCP_REGION", gcp_region)
-    
-    # For AWS Lambda, explicitly set credentials path
-    # This tells Google Cloud SDK where to find the service account key
-    credentials_path = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS", 
-                                     "/var/task/vertex-ai-key.json")
-    
-    if os.path.exists(credentials_path):
-        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = credentials_path
-        print(f"Using GCP credentials from: {credentials_path}")
-    else:
-        print(f"Warning: GCP credentials file not found at {credentials_path}")
-    
-    # Initialize Vertex AI - will use the credentials file
-    vertexai.init(project=GCP_PROJECT_ID, location=GCP_REGION)
-    print(f"Vertex AI initialized with project: {GCP_PROJECT_ID}, region: {GCP_REGION}")
-except Exception as e:
-    print(f"Warning: Vertex AI initialization failed: {e}")
-
-llm = ChatOpenAI(temperature=0.7, model_name="gpt-4o", streaming=False)
-
-def chatbot(event, context):
+import base64
+import time
+import uuid
+
+import chat_backends
+import context_cache
+import hedging
+import image_batch
+import image_cache
+import image_output
+import jobs
+import log
+import metrics
+import model_catalog
+import pipeline
+import profiles
+import providers
+import ratelimit
+import resilience
+import response_cache
+import sessions
+import singleflight
+import token_budget
+import warmup
+from conf import api_secret_key, server_api_key
+
+# Functions list the models they call in WARM_MODELS (and other providers in
+# WARM_PROVIDERS) so clients, handles and connections are ready during the
+# init phase instead of on the first request
+warmup.prewarm()
+
+
+def _image_options(request_data):
+    # output: data_url (default) | binary | presigned_url, format: png | jpeg | webp
+    return image_output.options(request_data, allow_binary=not image_batch.is_batch(request_data),
+                                store_enabled=image_cache.images.enabled)
+
+
+def _images(request):
+    return image_batch.size(request.data)
+
+
+def _compare_backends(request):
+    return len(request.compare["backends"])
+
+
+def _compare_options(request_data):
+    backends = request_data.get("backends", list(chat_backends.BACKEND_PROVIDERS))
+    timeout = request_data.get("timeout", chat_backends.BACKEND_TIMEOUT)
+    deadline = request_data.get("deadline", chat_backends.COMPARE_DEADLINE)
+    if not isinstance(backends, list) or not backends or \
+            not all(name in chat_backends.BACKEND_PROVIDERS for name in backends):
+        raise ValueError(f"backends must be a list drawn from {', '.join(chat_backends.BACKEND_PROVIDERS)}")
+    if not all(isinstance(value, (int, float)) and value > 0 for value in (timeout, deadline)):
+        raise ValueError("timeout and deadline must be positive numbers of seconds")
+    # Never wait past what the route allows
+    deadline = min(deadline, chat_backends.COMPARE_DEADLINE)
+    return {"backends": list(dict.fromkeys(backends)), "timeout": min(timeout, deadline), "deadline": deadline}
+
+
+@pipeline.handler(pipeline.origin(), pipeline.parse_body, pipeline.prompt("question"),
+                  profiles.identity(server_api_key), ratelimit.limit("text"),
+                  token_budget.budget("chatbot", providers.LLM_MODEL, "question"))
+def chatbot(request):
     """Original text-based chatbot - clean and simple"""
-    print('event is : ', json.dumps(event))
-
-    event_headers = event.get("headers", None)
-    event_origin = event_headers.get("origin", None)
-    if event_origin is not None and not event_origin.endswith("broadcust.co.il"):
-        # If the Origin header is not from the allowed domain, deny the request
-        response = {
-            "statusCode": 403,
-            'error': "Invalid Origin"
-        }
-        print('origin is not allowed: ', event_origin)
-
-        return response
-
-    event_body = event.get("body", None)
-
-    if event_body is not None:
-        event_body_json_load = json.loads(event_body)
-        question = event_body_json_load.get("question", None)
-    else:
-        question = event.get("question", None)
-
-    msg = llm.invoke(question)
-    print('msg.content: ', msg.content)
-
-    response = {
-        "statusCode": 200,
-        'status': "success",
-        "body": msg.content,
-        "headers": {
-            'Access-Control-Allow-Origin': 'https://broadcust.co.il',
-        }
-    }
-    return response
-
-def image_generator(event, context):
+    question = request.data["question"]
+    # The business description from the user's profile, when a UserID is sent
+    system = request.system
+
+    max_tokens = request.budget.max_output_tokens
+
+    # Identical (normalized) questions are answered from the response cache
+    cache_key = response_cache.cache_key(question, providers.LLM_MODEL,
+                                         {"temperature": providers.LLM_TEMPERATURE, "max_tokens": max_tokens}, system)
+    content = None
+    if not response_cache.bypass_requested(request.headers):
+        content = response_cache.responses.get(cache_key)
+    cache_status = "HIT" if content is not None else "MISS"
+    served_by = providers.LLM_MODEL
+    hedged = False
+    metrics.model(providers.LLM_MODEL)
+    metrics.count("CacheHit", int(content is not None))
+
+    if content is None:
+        try:
+            if hedging.requested(request.data):
+                # Race gpt-4o against Gemini Flash once gpt-4o is slower than usual
+                with metrics.phase("Provider"):
+                    content, served_by, hedged = hedging.answer(question, providers.LLM_MODEL, "gemini-2.0-flash",
+                                                                system, max_tokens)
+            else:
+                with metrics.phase("Provider"):
+                    try:
+                        msg = chat_backends.invoke(chat_backends.openai_messages(question, system), system, max_tokens)
+                        metrics.usage(msg)
+                        content = msg.content
+                    except Exception as e:
+                        # gpt-4o is down or out of time: Gemini Flash answers instead
+                        content, served_by = chat_backends.fallback(providers.LLM_MODEL, question, e, system,
+                                                                    max_tokens)
+        except Exception as e:
+            log.exception("Error with chat", e)
+            return pipeline.provider_error(e, f"Failed to process chat: {str(e)}", request.cors)
+        # The key names gpt-4o: an answer from the fallback or hedge backend is not stored under it
+        if served_by == providers.LLM_MODEL:
+            response_cache.responses.put(cache_key, content)
+    log.info("Chat answered", model=served_by, cache=cache_status, hedged=hedged, response_chars=len(content))
+    log.payload("Chat exchange", question=question, answer=content)
+
+    return pipeline.text_response(content, dict(request.cors, **request.budget.headers(), **{
+        'X-Cache': cache_status,
+        'X-Served-By': served_by,
+        'X-Hedged': str(hedged).lower()
+    }))
+
+@pipeline.handler(pipeline.origin(), pipeline.parse_body,
+                  pipeline.prompt(unless=image_batch.is_batch), ratelimit.limit("image", _images),
+                  jobs.accept("image_generator"))
+def image_generator(request):
     """Dedicated image generation API endpoint"""
-    print('image generation event: ', json.dumps(event))
-
-    # Same origin validation as text chatbot
-    event_headers = event.get("headers", None)
-    event_origin = event_headers.get("origin", None)
-    if event_origin is not None and not event_origin.endswith("broadcust.co.il"):
-        response = {
-            "statusCode": 403,
-            'error': "Invalid Origin"
-        }
-        print('origin is not allowed: ', event_origin)
-        return response
-
-    # Extract prompt from request
-    event_body = event.get("body", None)
-    if event_body is not None:
-        event_body_json_load = json.loads(event_body)
-        prompt = event_body_json_load.get("prompt", None)
-    else:
-        prompt = event.get("prompt", None)
-
-    if not prompt:
-        return {
-            "statusCode": 400,
-            "status": "error",
-            "body": json.dumps({"error": "No prompt provided"}),
-            "headers": {
-                'Access-Control-Allow-Origin': 'https://broadcust.co.il',
-                'Content-Type': 'application/json'
-            }
-        }
+    request_data = request.data
+    prompt = request_data.get("prompt", None)
+
+    # Batch of prompts and/or variants, fanned out across concurrent DALL-E calls
+    if image_batch.is_batch(request_data):
+        def generate_batch(batch_prompt, count):
+            openai_client = providers.get("openai_client")
+            with metrics.phase("Provider"):
+                response_dalle = resilience.call(
+                    "dall-e-3",
+                    openai_client.images.generate,
+                    model="dall-e-3",
+                    prompt=batch_prompt,
+                    size="1024x1024",
+                    quality="standard",
+                    n=count,
+                )
+            return [{"image_url": image.url} for image in response_dalle.data]
+
+        metrics.model("dall-e-3")
+        return image_batch.handle(request_data, "dall-e-3", generate_batch, {"model": "dall-e-3"}, request.cors)
 
     try:
-        # Generate image using DALL-E 3
-        print(f'Generating image for prompt: {prompt}')
-        response_dalle = OpenAIClient.images.generate(
-            model="dall-e-3",
-            prompt=prompt,
-            size="1024x1024",
-            quality="standard",
-            n=1,
-        )
-        
-        image_url = response_dalle.data[0].url
-        print(f'Generated image URL: {image_url}')
-
-        response = {
-            "statusCode": 200,
-            "status": "success",
-            "body": json.dumps({
-                "image_url": image_url,
-                "prompt": prompt,
-                "model": "dall-e-3"
-            }),
-            "headers": {
-                'Access-Control-Allow-Origin': 'https://broadcust.co.il',
-                'Content-Type': 'application/json'
-            }
-        }
-        
+        # Identical requests are served from the image cache without calling DALL-E
+        image_params = {"size": "1024x1024", "quality": "standard"}
+        cache_key = image_cache.cache_key("dall-e-3", prompt, params=image_params)
+        cache_status = "MISS"
+        metrics.model("dall-e-3")
+        if not response_cache.bypass_requested(request.headers) and image_cache.images.lookup(cache_key):
+            cache_status = "HIT"
+            image_url = image_cache.images.url(cache_key)
+            metrics.count("CacheHit")
+        elif image_cache.images.enabled:
+            # Generate image using DALL-E 3, keeping the bytes since OpenAI's URL expires
+            log.info("Generating image", model="dall-e-3", prompt_chars=len(prompt))
+            openai_client = providers.get("openai_client")
+            with metrics.phase("Provider"):
+                response_dalle = resilience.call(
+                    "dall-e-3",
+                    openai_client.images.generate,
+                    model="dall-e-3",
+                    prompt=prompt,
+                    size="1024x1024",
+                    quality="standard",
+                    n=1,
+                    response_format="b64_json",
+                )
+
+            with metrics.phase("Encode"):
+                image_bytes = base64.b64decode(response_dalle.data[0].b64_json)
+            metrics.count("ImageBytes", len(image_bytes))
+            image_cache.images.put(cache_key, image_bytes, "image/png", model="dall-e-3")
+            image_url = image_cache.images.url(cache_key)
+        else:
+            # Generate image using DALL-E 3
+            log.info("Generating image", model="dall-e-3", prompt_chars=len(prompt))
+            openai_client = providers.get("openai_client")
+            with metrics.phase("Provider"):
+                response_dalle = resilience.call(
+                    "dall-e-3",
+                    openai_client.images.generate,
+                    model="dall-e-3",
+                    prompt=prompt,
+                    size="1024x1024",
+                    quality="standard",
+                    n=1,
+                )
+
+            image_url = response_dalle.data[0].url
+        log.info("Generated image", model="dall-e-3", cache=cache_status)
+
+        response = pipeline.json_response({
+            "image_url": image_url,
+            "prompt": prompt,
+            "model": "dall-e-3"
+        }, dict(request.cors, **{'X-Cache': cache_status}))
+
     except Exception as e:
-        print(f"Error generating image: {str(e)}")
-        response = {
-            "statusCode": 500,
-            "status": "error",
-            "body": json.dumps({"error": f"Failed to generate image: {str(e)}"}),
-            "headers": {
-                'Access-Control-Allow-Origin': 'https://broadcust.co.il',
-                'Content-Type': 'application/json'
-            }
-        }
+        log.exception("Error generating image", e, model="dall-e-3")
+        response = pipeline.provider_error(e, f"Failed to generate image: {str(e)}", request.cors)
 
     return response
 
-def gemini_image_generator(event, context):
+@pipeline.handler(pipeline.origin(), pipeline.parse_body,
+                  pipeline.validate(_image_options, "output"), pipeline.prompt(unless=image_batch.is_batch),
+                  ratelimit.limit("image", _images), jobs.accept("gemini_image_generator"))
+def gemini_image_generator(request):
     """Image generation using Google Gemini Imagen 3.0"""
-    print('gemini image generation event: ', json.dumps(event))
-
-    # Same origin validation
-    event_headers = event.get("headers", None)
-    event_origin = event_headers.get("origin", None)
-    if event_origin is not None and not event_origin.endswith("broadcust.co.il"):
-        response = {
-            "statusCode": 403,
-            'error': "Invalid Origin"
-        }
-        print('origin is not allowed: ', event_origin)
-        return response
-
-    # Extract prompt from request
-    event_body = event.get("body", None)
-    if event_body is not None:
-        event_body_json_load = json.loads(event_body)
-        prompt = event_body_json_load.get("prompt", None)
-    else:
-        prompt = event.get("prompt", None)
-
-    if not prompt:
-        return {
-            "statusCode": 400,
-            "status": "error",
-            "body": json.dumps({"error": "No prompt provided"}),
-            "headers": {
-                'Access-Control-Allow-Origin': 'https://broadcust.co.il',
-                'Content-Type': 'application/json'
-            }
-        }
+    request_data = request.data
+    prompt = request_data.get("prompt", None)
+    output = request.output
+
+    # Batch of prompts and/or variants, fanned out across concurrent Imagen calls
+    if image_batch.is_batch(request_data):
+        def generate_batch(batch_prompt, count):
+            imagen_model = providers.image_models.get("imagen-3.0-generate-001")
+            # Workers add to the request's record: these sum over concurrent calls
+            with metrics.phase("Provider"):
+                images = resilience.call(
+                    "imagen-3.0-generate-001",
+                    imagen_model.generate_images,
+                    prompt=batch_prompt,
+                    number_of_images=count,
+                    aspect_ratio="1:1",
+                    safety_filter_level="block_some",
+                    person_generation="allow_adult",
+                )
+            results = []
+            for generated_image in images:
+                with metrics.phase("Encode"):
+                    image_bytes, content_type = image_output.encode(generated_image, output["format"],
+                                                                    output["quality"])
+                image_url = None
+                if output["output"] == "presigned_url":
+                    image_key = uuid.uuid4().hex
+                    image_cache.images.put(image_key, image_bytes, content_type, model="imagen-3.0-generate-001")
+                    image_url = image_cache.images.url(image_key)
+                results.append(image_output.batch_item(output["output"], image_bytes, content_type, image_url))
+            return results
+
+        metrics.model("imagen-3.0-generate-001")
+        return image_batch.handle(request_data, "imagen-3.0-generate-001", generate_batch,
+                                  {"model": "imagen-3.0-vertex-ai"}, request.cors)
 
     try:
-        # Generate image using Vertex AI Imagen
-        print(f'Generating image with Vertex AI Imagen for prompt: {prompt}')
-
-        # Use Imagen 3 model through Vertex AI
-        imagen_model = ImageGenerationModel.from_pretrained("imagen-3.0-generate-001")
-        
-        # Generate image
-        images = imagen_model.generate_images(
-            prompt=prompt,
-            number_of_images=1,
-            aspect_ratio="1:1",
-            safety_filter_level="block_some",
-            person_generation="allow_adult",
-        )
-
-        # Get the generated image and convert to base64
-        import base64
-        import io
-        
-        # images[0] is an Image object with _pil_image attribute
-        generated_image = images[0]
-        
-        img_byte_arr = io.BytesIO()
-        generated_image._pil_image.save(img_byte_arr, format='PNG')
-        img_byte_arr = img_byte_arr.getvalue()
-        image_base64 = base64.b64encode(img_byte_arr).decode('utf-8')
-
-        print(f'Generated image with Vertex AI Imagen successfully')
-
-        response = {
-            "statusCode": 200,
-            "status": "success",
-            "body": json.dumps({
-                "image_data": f"data:image/png;base64,{image_base64}",
-                "prompt": prompt,
-                "model": "imagen-3.0-vertex-ai"
-            }),
-            "headers": {
-                'Access-Control-Allow-Origin': 'https://broadcust.co.il',
-                'Content-Type': 'application/json'
-            }
-        }
+        # Identical requests are served from the image cache without calling Imagen
+        image_params = {"aspect_ratio": "1:1", "safety_filter_level": "block_some",
+                        "person_generation": "allow_adult",
+                        "format": output["format"], "quality": output["quality"]}
+        cache_key = image_cache.cache_key("imagen-3.0-generate-001", prompt, params=image_params)
+        metrics.model("imagen-3.0-generate-001")
+        cached = None
+        if not response_cache.bypass_requested(request.headers):
+            cached = image_cache.images.lookup(cache_key)
+        image_bytes = None
+        content_type = image_output.FORMATS[output["format"]][1]
+        if cached and output["output"] != "presigned_url":
+            image_bytes = image_cache.images.read(cache_key)
+            if image_bytes is None:
+                cached = None
+        cache_status = "HIT" if cached else "MISS"
+        metrics.count("CacheHit", int(bool(cached)))
+
+        coalesced = False
+
+        if not cached:
+            def generate():
+                # Generate image using Vertex AI Imagen
+                log.info("Generating image", model="imagen-3.0-generate-001", prompt_chars=len(prompt))
+
+                # Use Imagen 3 model through Vertex AI
+                imagen_model = providers.image_models.get("imagen-3.0-generate-001")
+
+                # Generate image
+                with metrics.phase("Provider"):
+                    images = resilience.call(
+                        "imagen-3.0-generate-001",
+                        imagen_model.generate_images,
+                        prompt=prompt,
+                        number_of_images=1,
+                        aspect_ratio="1:1",
+                        safety_filter_level="block_some",
+                        person_generation="allow_adult",
+                    )
+
+                # Encode once, in the requested format, straight into the response/cache buffer
+                with metrics.phase("Encode"):
+                    image_bytes, content_type = image_output.encode(images[0], output["format"], output["quality"])
+                image_cache.images.put(cache_key, image_bytes, content_type, model="imagen-3.0-generate-001")
+
+                log.info("Generated image", model="imagen-3.0-generate-001", image_bytes=len(image_bytes),
+                         model_cache=providers.image_models.stats())
+                return image_bytes, content_type
+
+            def load(shared):
+                # Another container generated the image and wrote it to the image cache
+                if output["output"] == "presigned_url":
+                    return (None, shared["content_type"]) if image_cache.images.lookup(cache_key) else None
+                image_bytes = image_cache.images.read(cache_key)
+                return (image_bytes, shared["content_type"]) if image_bytes is not None else None
+
+            # The same prompt in flight here or, through the image cache, in another container
+            # shares one Imagen call
+            flight_key = None if response_cache.bypass_requested(request.headers) else cache_key
+            share = (lambda result: {"content_type": result[1]}) if image_cache.images.enabled else None
+            (image_bytes, content_type), coalesced = singleflight.flights.run(flight_key, generate, share, load)
+
+        if image_bytes is not None:
+            metrics.count("ImageBytes", len(image_bytes))
+        image_url = image_cache.images.url(cache_key) if output["output"] == "presigned_url" else None
+        with metrics.phase("Serialize"):
+            response = image_output.build_response(
+                output["output"],
+                image_bytes,
+                content_type,
+                {
+                    "prompt": prompt,
+                    "model": "imagen-3.0-vertex-ai"
+                },
+                dict(request.cors, **{'X-Cache': cache_status, 'X-Coalesced': str(coalesced).lower()}),
+                url=image_url,
+            )
 
     except Exception as e:
-        print(f"Error generating image with Gemini: {str(e)}")
-        response = {
-            "statusCode": 500,
-            "status": "error",
-            "body": json.dumps({"error": f"Failed to generate image: {str(e)}"}),
-            "headers": {
-                'Access-Control-Allow-Origin': 'https://broadcust.co.il',
-                'Content-Type': 'application/json'
-            }
-        }
+        log.exception("Error generating image", e, model="imagen-3.0-generate-001")
+        # A fast-failed call never reached the model, so its handle is fine
+        if not isinstance(e, resilience.CircuitOpen):
+            providers.image_models.invalidate("imagen-3.0-generate-001")
+        response = pipeline.provider_error(e, f"Failed to generate image: {str(e)}", request.cors)
 
     return response
 
-def nano_banana_generator(event, context):
+@pipeline.handler(pipeline.origin(), pipeline.parse_body,
+                  pipeline.validate(_image_options, "output"), pipeline.prompt(unless=image_batch.is_batch),
+                  ratelimit.limit("image", _images), jobs.accept("nano_banana_generator"))
+def nano_banana_generator(request):
     """Image generation using Google Gemini 2.5 Flash (Nano Banana model)"""
-    print('nano banana image generation event: ', json.dumps(event))
-
-    # Same origin validation
-    event_headers = event.get("headers", None)
-    event_origin = event_headers.get("origin", None)
-    if event_origin is not None and not event_origin.endswith("broadcust.co.il"):
-        response = {
-            "statusCode": 403,
-            'error': "Invalid Origin"
-        }
-        print('origin is not allowed: ', event_origin)
-        return response
-
-    # Extract prompt from request
-    event_body = event.get("body", None)
-    if event_body is not None:
-        event_body_json_load = json.loads(event_body)
-        prompt = event_body_json_load.get("prompt", None)
-    else:
-        prompt = event.get("prompt", None)
-
-    if not prompt:
-        return {
-            "statusCode": 400,
-            "status": "error",
-            "body": json.dumps({"error": "No prompt provided"}),
-            "headers": {
-                'Access-Control-Allow-Origin': 'https://broadcust.co.il',
-                'Content-Type': 'application/json'
-            }
-        }
+    request_data = request.data
+    prompt = request_data.get("prompt", None)
+    output = request.output
+
+    # Batch of prompts and/or variants, fanned out across concurrent Imagen calls
+    if image_batch.is_batch(request_data):
+        def generate_batch(batch_prompt, count):
+            imagen_model = providers.image_models.get("imagegeneration@006")
+            with metrics.phase("Provider"):
+                images = resilience.call(
+                    "imagegeneration@006",
+                    imagen_model.generate_images,
+                    prompt=f"{batch_prompt}, high quality, detailed, professional 3D render style",
+                    # Same Nano Banana style modifier as single requests
+                    number_of_images=count,
+                    aspect_ratio="1:1",
+                    safety_filter_level="block_some",
+                    person_generation="allow_adult",
+                )
+            results = []
+            for generated_image in images:
+                with metrics.phase("Encode"):
+                    image_bytes, content_type = image_output.encode(generated_image, output["format"],
+                                                                    output["quality"])
+                image_url = None
+                if output["output"] == "presigned_url":
+                    image_key = uuid.uuid4().hex
+                    image_cache.images.put(image_key, image_bytes, content_type, model="imagegeneration@006")
+                    image_url = image_cache.images.url(image_key)
+                results.append(image_output.batch_item(output["output"], image_bytes, content_type, image_url))
+            return results
+
+        metrics.model("imagegeneration@006")
+        return image_batch.handle(request_data, "imagegeneration@006", generate_batch,
+                                  {"model": "imagen-vertex-ai-nano-banana"}, request.cors)
 
     try:
-        # Generate image using Vertex AI Imagen (Nano Banana style)
-        print(f'Generating Nano Banana style image with Vertex AI for prompt: {prompt}')
-
-        # Use Imagen model through Vertex AI
-        # Note: "Nano Banana" is a marketing name, actual model is Imagen
-        imagen_model = ImageGenerationModel.from_pretrained("imagegeneration@006")
-        
         # Add style modifier for more realistic/3D figurine style (Nano Banana aesthetic)
         enhanced_prompt = f"{prompt}, high quality, detailed, professional 3D render style"
-        
-        # Generate image
-        images = imagen_model.generate_images(
-            prompt=enhanced_prompt,
-            number_of_images=1,
-            aspect_ratio="1:1",
-            safety_filter_level="block_some",
-            person_generation="allow_adult",
-        )
-
-        # Get the generated image and convert to base64
-        import base64
-        import io
-        
-        generated_image = images[0]
-        
-        img_byte_arr = io.BytesIO()
-        generated_image._pil_image.save(img_byte_arr, format='PNG')
-        img_byte_arr = img_byte_arr.getvalue()
-        image_base64 = base64.b64encode(img_byte_arr).decode('utf-8')
-
-        print(f'Generated Nano Banana style image with Vertex AI successfully')
-
-        response = {
-            "statusCode": 200,
-            "status": "success",
-            "body": json.dumps({
-                "image_data": f"data:image/png;base64,{image_base64}",
-                "prompt": prompt,
-                "enhanced_prompt": enhanced_prompt,
-                "model": "imagen-vertex-ai-nano-banana"
-            }),
-            "headers": {
-                'Access-Control-Allow-Origin': 'https://broadcust.co.il',
-                'Content-Type': 'application/json'
-            }
-        }
+
+        # Identical requests are served from the image cache without calling Imagen
+        image_params = {"aspect_ratio": "1:1", "safety_filter_level": "block_some",
+                        "person_generation": "allow_adult",
+                        "format": output["format"], "quality": output["quality"]}
+        cache_key = image_cache.cache_key("imagegeneration@006", prompt, enhanced_prompt, image_params)
+        metrics.model("imagegeneration@006")
+        cached = None
+        if not response_cache.bypass_requested(request.headers):
+            cached = image_cache.images.lookup(cache_key)
+        image_bytes = None
+        content_type = image_output.FORMATS[output["format"]][1]
+        if cached and output["output"] != "presigned_url":
+            image_bytes = image_cache.images.read(cache_key)
+            if image_bytes is None:
+                cached = None
+        cache_status = "HIT" if cached else "MISS"
+        metrics.count("CacheHit", int(bool(cached)))
+
+        if not cached:
+            # Generate image using Vertex AI Imagen (Nano Banana style)
+            log.info("Generating image", model="imagegeneration@006", prompt_chars=len(prompt))
+
+            # Use Imagen model through Vertex AI
+            # Note: "Nano Banana" is a marketing name, actual model is Imagen
+            imagen_model = providers.image_models.get("imagegeneration@006")
+
+            # Generate image
+            with metrics.phase("Provider"):
+                images = resilience.call(
+                    "imagegeneration@006",
+                    imagen_model.generate_images,
+                    prompt=enhanced_prompt,
+                    number_of_images=1,
+                    aspect_ratio="1:1",
+                    safety_filter_level="block_some",
+                    person_generation="allow_adult",
+                )
+
+            # Encode once, in the requested format, straight into the response/cache buffer
+            with metrics.phase("Encode"):
+                image_bytes, content_type = image_output.encode(images[0], output["format"], output["quality"])
+            image_cache.images.put(cache_key, image_bytes, content_type, model="imagegeneration@006")
+
+            log.info("Generated image", model="imagegeneration@006", image_bytes=len(image_bytes),
+                     model_cache=providers.image_models.stats())
+
+        if image_bytes is not None:
+            metrics.count("ImageBytes", len(image_bytes))
+        image_url = image_cache.images.url(cache_key) if output["output"] == "presigned_url" else None
+        with metrics.phase("Serialize"):
+            response = image_output.build_response(
+                output["output"],
+                image_bytes,
+                content_type,
+                {
+                    "prompt": prompt,
+                    "enhanced_prompt": enhanced_prompt,
+                    "model": "imagen-vertex-ai-nano-banana"
+                },
+                dict(request.cors, **{'X-Cache': cache_status}),
+                url=image_url,
+            )
 
     except Exception as e:
-        print(f"Error generating image with Nano Banana: {str(e)}")
-        response = {
-            "statusCode": 500,
-            "status": "error",
-            "body": json.dumps({"error": f"Failed to generate image: {str(e)}"}),
-            "headers": {
-                'Access-Control-Allow-Origin': 'https://broadcust.co.il',
-                'Content-Type': 'application/json'
-            }
-        }
+        log.exception("Error generating image", e, model="imagegeneration@006")
+        # A fast-failed call never reached the model, so its handle is fine
+        if not isinstance(e, resilience.CircuitOpen):
+            providers.image_models.invalidate("imagegeneration@006")
+        response = pipeline.provider_error(e, f"Failed to generate image: {str(e)}", request.cors)
 
     return response
 
-def gemini_chat(event, context):
+# API key is optional - only checked if configured in conf.py
+@pipeline.handler(pipeline.api_key(api_secret_key, cors='*'),
+                  pipeline.origin(echo=True), pipeline.parse_body, pipeline.prompt(),
+                  profiles.identity(server_api_key), ratelimit.limit("text"),
+                  token_budget.budget("gemini_chat", "gemini-2.0-flash"))
+def gemini_chat(request):
     """Gemini-based text chatbot"""
-    print('gemini chat event: ', json.dumps(event))
-
-    event_headers = event.get("headers", None)
-    event_origin = event_headers.get("origin", None)
-    
-    # Validate API Key (optional - only if configured in conf.py)
-    if api_secret_key:  # Only validate if API key is configured
-        provided_api_key = event_headers.get("x-api-key") if event_headers else None
-        if not provided_api_key or provided_api_key != api_secret_key:
-            print('Invalid or missing API key')
-            return {
-                "statusCode": 403,
-                "body": json.dumps({"error": "Invalid or missing API key"}),
-                "headers": {
-                    'Access-Control-Allow-Origin': '*',
-                    'Content-Type': 'application/json'
-                }
-            }
-    
-    # Validate origin and set appropriate CORS header
-    allowed_origin = 'https://broadcust.co.il'  # default
-    if event_origin is not None:
-        if event_origin.endswith("broadcust.co.il"):
-            allowed_origin = event_origin  # Use the actual origin (stg, prod, etc.)
-        else:
-            # If the Origin header is not from the allowed domain, deny the request
-            response = {
-                "statusCode": 403,
-                'error': "Invalid Origin"
-            }
-            print('origin is not allowed: ', event_origin)
-            return response
-
-    event_body = event.get("body", None)
-
-    if event_body is not None:
-        event_body_json_load = json.loads(event_body)
-        prompt = event_body_json_load.get("prompt", None)
-    else:
-        prompt = event.get("prompt", None)
-
-    if not prompt:
-        return {
-            "statusCode": 400,
-            "status": "error",
-            "body": json.dumps({"error": "No prompt provided"}),
-            "headers": {
-                'Access-Control-Allow-Origin': allowed_origin,
-                'Content-Type': 'application/json'
-            }
-        }
+    prompt = request.data["prompt"]
 
     try:
         # Use Gemini for chat
-        print(f'Processing prompt with Gemini: {prompt}')
-        
-        # List available models for debugging
-        try:
-            available_models = [m.name for m in genai.list_models()]
-            print(f'Available models: {available_models[:10]}')  # Print first 10
-        except Exception as e:
-            print(f'Could not list models: {e}')
-        
-        # Configure generation settings for longer responses
+        log.payload("Prompt", prompt=prompt)
+        system = request.system
+
+        # Output budget picked by the budget stage for the request type
         generation_config = {
-            "max_output_tokens": 8192,  # Maximum tokens for output
+            "max_output_tokens": request.budget.max_output_tokens,
             "temperature": 0.3,  # Lower temperature for more consistent, factual responses
         }
-        
-        model = genai.GenerativeModel('gemini-2.0-flash')
-        response_gemini = model.generate_content(
-            prompt,
-            generation_config=generation_config
-        )
-        
-        # Check if response was blocked or incomplete
-        print(f'Gemini finish_reason: {response_gemini.candidates[0].finish_reason}')
-        print(f'Gemini safety_ratings: {response_gemini.candidates[0].safety_ratings}')
-        
-        # Get the full response text
-        response_text = response_gemini.text
-        print(f'Gemini response length: {len(response_text)} characters')
-        print(f'Gemini response preview: {response_text[:200]}...')
-
-        response = {
-            "statusCode": 200,
-            'status': "success",
-            "body": response_text,
-            "headers": {
-                'Access-Control-Allow-Origin': allowed_origin,
-                'Content-Type': 'text/plain; charset=utf-8'
-            }
-        }
+
+        # Model names are checked against the cached catalog, never listed per request
+        model_name = model_catalog.resolve('gemini-2.0-flash')
+
+        # Identical (normalized) prompts are answered from the response cache
+        cache_key = response_cache.cache_key(prompt, model_name, generation_config, system)
+        response_text = None
+        if not response_cache.bypass_requested(request.headers):
+            response_text = response_cache.responses.get(cache_key)
+        cache_status = "HIT" if response_text is not None else "MISS"
+        served_by = model_name
+        hedged = False
+        coalesced = False
+        metrics.model(model_name)
+        metrics.count("CacheHit", int(response_text is not None))
+
+        if response_text is None and hedging.requested(request.data):
+            # Race Gemini Flash against gpt-4o once Gemini is slower than usual
+            with metrics.phase("Provider"):
+                response_text, served_by, hedged = hedging.answer(prompt, 'gemini-2.0-flash', providers.LLM_MODEL,
+                                                                  system, request.budget.max_output_tokens)
+            # A backup win is not stored under Gemini's key
+            if served_by == 'gemini-2.0-flash':
+                response_cache.responses.put(cache_key, response_text)
+        elif response_text is None:
+            def generate():
+                # Long system contexts are sent once and reused from Gemini's context cache
+                with metrics.phase("Provider"):
+                    try:
+                        response_gemini = context_cache.generate_content(
+                            model_name,
+                            prompt,
+                            system,
+                            generation_config=generation_config
+                        )
+                    except Exception as e:
+                        # Gemini is down or out of time: gpt-4o answers instead
+                        text, backup = chat_backends.fallback('gemini-2.0-flash', prompt, e, system,
+                                                              request.budget.max_output_tokens)
+                        return {"text": text, "served_by": backup}
+
+                metrics.usage(response_gemini)
+
+                # Check if response was blocked or incomplete
+                log.info("Gemini finished", model=model_name,
+                         finish_reason=response_gemini.candidates[0].finish_reason)
+                log.debug("Gemini safety ratings", safety_ratings=response_gemini.candidates[0].safety_ratings)
+
+                # Get the full response text
+                return {"text": response_gemini.text, "served_by": model_name}
+
+            # The same prompt in flight here or in another container shares one Gemini call
+            flight_key = None if response_cache.bypass_requested(request.headers) else cache_key
+            answer, coalesced = singleflight.flights.run(flight_key, generate, share=dict)
+            response_text, served_by = answer["text"], answer["served_by"]
+            if not coalesced and served_by == model_name:
+                response_cache.responses.put(cache_key, response_text)
+        log.info("Chat answered", model=served_by, cache=cache_status, hedged=hedged, coalesced=coalesced,
+                 response_chars=len(response_text))
+        log.payload("Chat response", response=response_text)
+
+        response = pipeline.text_response(response_text, dict(request.cors, **request.budget.headers(), **{
+            'X-Cache': cache_status,
+            'X-Served-By': served_by,
+            'X-Hedged': str(hedged).lower(),
+            'X-Coalesced': str(coalesced).lower()
+        }))
     except Exception as e:
-        print(f"Error with Gemini chat: {str(e)}")
-        print(f"Error type: {type(e).__name__}")
-        import traceback
-        print(f"Full traceback: {traceback.format_exc()}")
-        response = {
-            "statusCode": 500,
-            "status": "error",
-            "body": json.dumps({"error": f"Failed to process chat: {str(e)}"}),
-            "headers": {
-                'Access-Control-Allow-Origin': allowed_origin,
-                'Content-Type': 'application/json'
-            }
-        }
+        log.exception("Error with Gemini chat", e)
+        response = pipeline.provider_error(e, f"Failed to process chat: {str(e)}", request.cors)
 
     return response
 
-def gemini_pro_chat(event, context):
+# Origin validation and CORS are handled by the Lambda Function URL config in
+# serverless.yml (allowedOrigins), so no CORS headers are set here
+@pipeline.handler(pipeline.api_key(api_secret_key),
+                  pipeline.parse_body, pipeline.prompt(), profiles.identity(server_api_key),
+                  ratelimit.limit("text"), token_budget.budget("gemini_pro_chat", "gemini-3-pro-preview"),
+                  jobs.accept("gemini_pro_chat"))
+def gemini_pro_chat(request):
     """Gemini Pro (most advanced) - Uses Lambda Function URL for longer timeout"""
-    print('gemini pro chat event: ', json.dumps(event))
-
-    event_headers = event.get("headers", None)
-    
-    # Validate API Key (optional - only if configured in conf.py)
-    if api_secret_key:  # Only validate if API key is configured
-        provided_api_key = event_headers.get("x-api-key") if event_headers else None
-        if not provided_api_key or provided_api_key != api_secret_key:
-            print('Invalid or missing API key')
-            return {
-                "statusCode": 403,
-                "body": json.dumps({"error": "Invalid or missing API key"}),
-                "headers": {
-                    # CORS handled by Lambda Function URL config (serverless.yml)
-                    'Content-Type': 'application/json'
-                }
-            }
-    
-    # Note: Origin validation is handled by Lambda Function URL CORS config in serverless.yml
-    # No need to validate origin in code - AWS does it based on allowedOrigins
-
-    event_body = event.get("body", None)
-
-    if event_body is not None:
-        event_body_json_load = json.loads(event_body)
-        prompt = event_body_json_load.get("prompt", None)
-    else:
-        prompt = event.get("prompt", None)
-
-    if not prompt:
-        return {
-            "statusCode": 400,
-            "status": "error",
-            "body": json.dumps({"error": "No prompt provided"}),
-            "headers": {
-                # CORS handled by Lambda Function URL config
-                'Content-Type': 'application/json'
-            }
-        }
+    prompt = request.data["prompt"]
 
     try:
         # Use Gemini Pro (most advanced model)
-        print(f'Processing prompt with Gemini Pro: {prompt}')
-        
-        # Configure generation settings for longer responses
+        log.payload("Prompt", prompt=prompt)
+        system = request.system
+
+        # Output budget picked by the budget stage for the request type
         generation_config = {
-            "max_output_tokens": 8192,  # Maximum tokens for output
+            "max_output_tokens": request.budget.max_output_tokens,
             "temperature": 0.3,  # Lower temperature for more consistent, factual responses
         }
-        
-        # Try Gemini 3 Pro Preview (if available)
-        model = genai.GenerativeModel('gemini-3-pro-preview')
-        response_gemini = model.generate_content(
-            prompt,
-            generation_config=generation_config
-        )
-        
-        # Check if response was blocked or incomplete
-        print(f'Gemini Pro finish_reason: {response_gemini.candidates[0].finish_reason}')
-        print(f'Gemini Pro safety_ratings: {response_gemini.candidates[0].safety_ratings}')
-        
-        # Get the full response text
-        response_text = response_gemini.text
-        print(f'Gemini Pro response length: {len(response_text)} characters')
-        print(f'Gemini Pro response preview: {response_text[:200]}...')
-
-        response = {
-            "statusCode": 200,
-            'status': "success",
-            "body": response_text,
-            "headers": {
-                # CORS is handled by Lambda Function URL config (serverless.yml)
-                # Don't set Access-Control-Allow-Origin here to avoid conflicts
-                'Content-Type': 'text/plain; charset=utf-8'
-            }
-        }
+
+        # Try Gemini 3 Pro Preview (falls back if the catalog says it is unavailable)
+        model_name = model_catalog.resolve('gemini-3-pro-preview')
+
+        # Identical (normalized) prompts are answered from the response cache
+        cache_key = response_cache.cache_key(prompt, model_name, generation_config, system)
+        response_text = None
+        if not response_cache.bypass_requested(request.headers):
+            response_text = response_cache.responses.get(cache_key)
+        cache_status = "HIT" if response_text is not None else "MISS"
+        served_by = model_name
+        metrics.model(model_name)
+        metrics.count("CacheHit", int(response_text is not None))
+
+        if response_text is None:
+            # Long system contexts are sent once and reused from Gemini's context cache
+            with metrics.phase("Provider"):
+                try:
+                    response_gemini = context_cache.generate_content(
+                        model_name,
+                        prompt,
+                        system,
+                        generation_config=generation_config
+                    )
+                except Exception as e:
+                    # Gemini is down or out of time: gpt-4o answers instead
+                    response_gemini = None
+                    response_text, served_by = chat_backends.fallback('gemini-3-pro-preview', prompt, e, system,
+                                                                      request.budget.max_output_tokens)
+
+            if response_gemini is not None:
+                metrics.usage(response_gemini)
+
+                # Check if response was blocked or incomplete
+                log.info("Gemini finished", model=model_name,
+                         finish_reason=response_gemini.candidates[0].finish_reason)
+                log.debug("Gemini safety ratings", safety_ratings=response_gemini.candidates[0].safety_ratings)
+
+                # Get the full response text
+                response_text = response_gemini.text
+                response_cache.responses.put(cache_key, response_text)
+        log.info("Chat answered", model=served_by, cache=cache_status, response_chars=len(response_text))
+        log.payload("Chat response", response=response_text)
+
+        response = pipeline.text_response(response_text, dict(request.budget.headers(), **{
+            'X-Cache': cache_status,
+            'X-Served-By': served_by
+        }))
     except Exception as e:
-        print(f"Error with Gemini Pro chat: {str(e)}")
-        print(f"Error type: {type(e).__name__}")
-        import traceback
-        print(f"Full traceback: {traceback.format_exc()}")
-        response = {
-            "statusCode": 500,
-            "status": "error",
-            "body": json.dumps({"error": f"Failed to process chat: {str(e)}"}),
-            "headers": {
-                # CORS is handled by Lambda Function URL config (serverless.yml)
-                'Content-Type': 'application/json'
-            }
-        }
+        log.exception("Error with Gemini Pro chat", e)
+        response = pipeline.provider_error(e, f"Failed to process chat: {str(e)}")
 
     return response
 
-def add_user_profile(event, context):
-    """Add user profile to DynamoDB - Server-to-server endpoint with API key auth"""
-    print('add user profile event: ', json.dumps(event))
+@pipeline.handler(pipeline.api_key(api_secret_key, cors='*'),
+                  pipeline.origin(echo=True), pipeline.parse_body, pipeline.prompt(),
+                  pipeline.validate(_compare_options, "compare"), profiles.identity(server_api_key),
+                  ratelimit.limit("text", _compare_backends))
+def compare_models(request):
+    """Same prompt answered by several chat backends at once, for picking the best copy"""
+    prompt = request.data["prompt"]
+    backends = request.compare["backends"]
 
-    event_headers = event.get("headers", None)
-    
-    # Validate Server API Key (required for this endpoint)
-    if not server_api_key or server_api_key == "your-secret-key-here":
-        print('ERROR: server_api_key not configured in conf.py')
-        return {
-            "statusCode": 500,
-            "body": json.dumps({"error": "Server configuration error"}),
-            "headers": {'Content-Type': 'application/json'}
-        }
-    
-    provided_api_key = event_headers.get("x-api-key") if event_headers else None
-    if not provided_api_key or provided_api_key != server_api_key:
-        print('Invalid or missing API key')
-        return {
-            "statusCode": 403,
-            "body": json.dumps({"error": "Invalid or missing API key"}),
-            "headers": {'Content-Type': 'application/json'}
-        }
+    try:
+        log.info("Comparing models", backends=backends, prompt_chars=len(prompt))
+        system = profiles.system_context(request.user_id)
+        chat_backends.prepare(backends)
+        start = time.perf_counter()
+        with metrics.phase("Provider"):
+            results = chat_backends.run(chat_backends.compare(prompt, backends, request.compare["timeout"],
+                                                              request.compare["deadline"], system))
+        elapsed_ms = round((time.perf_counter() - start) * 1000)
+        answered = sum(1 for result in results if result["status"] == "success")
+        log.info("Compare finished", elapsed_ms=elapsed_ms, answered=answered, backends=len(backends))
+
+        response = pipeline.json_response({
+            "prompt": prompt,
+            "results": results,
+            "answered": answered,
+            "elapsed_ms": elapsed_ms
+        }, request.cors, 200 if answered else 504)
+    except Exception as e:
+        log.exception("Error comparing models", e)
+        response = pipeline.provider_error(e, f"Failed to compare models: {str(e)}", request.cors)
 
-    # Parse request body
-    event_body = event.get("body", None)
-    if event_body is not None:
-        try:
-            body_data = json.loads(event_body)
-        except json.JSONDecodeError:
-            return {
-                "statusCode": 400,
-                "body": json.dumps({"error": "Invalid JSON in request body"}),
-                "headers": {'Content-Type': 'application/json'}
-            }
-    else:
-        body_data = event
+    return response
 
-    # Validate required fields
-    required_fields = ['UserID', 'Mobile', 'Email', 'RawBizChar', 'OptBizChar']
-    missing_fields = [field for field in required_fields if not body_data.get(field)]
-    
-    if missing_fields:
-        return {
-            "statusCode": 400,
-            "body": json.dumps({
-                "error": "Missing required fields",
-                "missing_fields": missing_fields
-            }),
-            "headers": {'Content-Type': 'application/json'}
-        }
+# Multi-turn chat: the server keeps the history, the client only sends the new message
+@pipeline.handler(pipeline.api_key(api_secret_key, cors='*'),
+                  pipeline.origin(echo=True), pipeline.parse_body, pipeline.prompt("message"),
+                  pipeline.validate(sessions.options, "session"), profiles.identity(server_api_key),
+                  ratelimit.limit("text"))
+def chat_session(request):
+    """One turn of a chat session stored in DynamoDB"""
+    if sessions.store is None:
+        log.error("SESSIONS_TABLE environment variable not set")
+        return pipeline.error(500, "Server configuration error", request.cors)
+
+    session_id = request.session["session_id"]
+    model_name = request.session["model"]
+    metrics.model(model_name)
+    try:
+        system = profiles.system_context(request.user_id)
+        result = sessions.turn(session_id, request.data["message"], model_name, system, request.session["new"])
+    except sessions.Conflict:
+        return pipeline.error(409, "Session was updated by another request, retry", request.cors,
+                              session_id=session_id)
+    except Exception as e:
+        log.exception("Error in chat session", e, session_id=session_id)
+        return pipeline.provider_error(e, f"Failed to process chat: {str(e)}", request.cors, session_id=session_id)
 
-    # Extract and validate fields
-    user_id = body_data.get('UserID').strip()
-    mobile = body_data.get('Mobile').strip()
-    email = body_data.get('Email').strip()
-    raw_biz_char = body_data.get('RawBizChar').strip()
-    opt_biz_char = body_data.get('OptBizChar').strip()
+    log.info("Session turn answered", session_id=session_id, turn=result["turn"], model=model_name,
+             history_tokens=result["history_tokens"], compacted=result["compacted"])
+    return pipeline.json_response(result, request.cors)
 
-    # Validate email format
-    email_pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    if not re.match(email_pattern, email):
-        return {
-            "statusCode": 400,
-            "body": json.dumps({
-                "error": "Invalid email format",
-                "field": "Email"
-            }),
-            "headers": {'Content-Type': 'application/json'}
-        }
+# Server-to-server: the server API key is required, a missing one is a config error
+@pipeline.handler(pipeline.api_key(server_api_key, required=True),
+                  pipeline.parse_body, pipeline.validate(profiles.validate, "profile"))
+def add_user_profile(request):
+    """Add user profile to DynamoDB - Server-to-server endpoint with API key auth"""
+    profile = request.profile
+    user_id = profile['UserID']
 
-    # Validate mobile format (basic validation - must contain digits)
-    mobile_pattern = r'^[\d\s\-\+\(\)]+$'
-    if not re.match(mobile_pattern, mobile) or len(re.sub(r'\D', '', mobile)) < 9:
-        return {
-            "statusCode": 400,
-            "body": json.dumps({
-                "error": "Invalid mobile format - must contain at least 9 digits",
-                "field": "Mobile"
-            }),
-            "headers": {'Content-Type': 'application/json'}
-        }
+    if not profiles.table_name():
+        log.error("USER_PROFILES_TABLE environment variable not set")
+        return pipeline.error(500, "Server configuration error")
 
     try:
-        # Initialize DynamoDB client
-        dynamodb = boto3.resource('dynamodb')
-        table_name = os.environ.get('USER_PROFILES_TABLE')
-        
-        if not table_name:
-            print('ERROR: USER_PROFILES_TABLE environment variable not set')
-            return {
-                "statusCode": 500,
-                "body": json.dumps({"error": "Server configuration error"}),
-                "headers": {'Content-Type': 'application/json'}
-            }
-        
-        table = dynamodb.Table(table_name)
-        
         # Put item to DynamoDB (overwrites if exists)
-        table.put_item(
-            Item={
-                'UserID': user_id,
-                'Mobile': mobile,
-                'Email': email,
-                'RawBizChar': raw_biz_char,
-                'OptBizChar': opt_biz_char
-            }
-        )
-        
-        print(f'Successfully added user profile for UserID: {user_id}')
-        
+        with metrics.phase("Provider"):
+            profiles.table().put_item(Item=profile)
+        # Chat requests in this container see the new profile right away
+        profiles.invalidate(user_id)
+
+        log.info("Added user profile", user_id=user_id)
+
         return {
             "statusCode": 200,
-            "body": json.dumps({
+            "body": pipeline.dumps({
                 "status": "success",
                 "message": "User profile added successfully",
                 "userId": user_id
             }),
-            "headers": {'Content-Type': 'application/json'}
+            "headers": dict(pipeline.JSON_HEADERS)
         }
-        
+
     except Exception as e:
-        print(f"Error storing user profile: {str(e)}")
-        import traceback
-        print(f"Full traceback: {traceback.format_exc()}")
-        return {
-            "statusCode": 500,
-            "body": json.dumps({
-                "error": "Failed to store user profile",
-                "details": str(e)
-            }),
-            "headers": {'Content-Type': 'application/json'}
-        }
+        log.exception("Error storing user profile", e, user_id=user_id)
+        return pipeline.error(500, "Failed to store user profile", details=str(e))
+
+
+def _bulk_records(request):
+    """Profiles of a JSON array or NDJSON body; direct invocations pass {"profiles": [...]}"""
+    event_body = request.event.get("body")
+    try:
+        if event_body is None:
+            request.records = profiles.parse_records(pipeline.dumps(request.event.get("profiles") or []))
+            return
+        if request.event.get("isBase64Encoded"):
+            event_body = base64.b64decode(event_body)
+        if isinstance(event_body, bytes):
+            event_body = event_body.decode("utf-8")
+        request.records = profiles.parse_records(event_body)
+    except ValueError as e:
+        raise pipeline.Rejected(pipeline.error(400, str(e)))
+
+
+# Server-to-server bulk import: a JSON array or NDJSON stream of profiles,
+# answered with a result per record (200 all written, 207 partly, 400 none valid)
+@pipeline.handler(pipeline.api_key(server_api_key, required=True), _bulk_records)
+def add_user_profiles_bulk(request):
+    """Add many user profiles to DynamoDB in BatchWriteItem chunks"""
+    if not profiles.table_name():
+        log.error("USER_PROFILES_TABLE environment variable not set")
+        return pipeline.error(500, "Server configuration error")
+
+    start = time.perf_counter()
+    counts, results = profiles.bulk_import(request.records)
+    elapsed_ms = round((time.perf_counter() - start) * 1000)
+    log.info("Bulk imported user profiles", elapsed_ms=elapsed_ms, **counts)
+
+    if counts["written"] + counts["superseded"] == counts["total"]:
+        status = 200
+    elif counts["written"]:
+        status = 207
+    elif counts["failed"]:
+        status = 500
+    else:
+        status = 400
+    return pipeline.json_response(dict(counts, results=results, elapsed_ms=elapsed_ms), status=status)
+
+# Polling for jobs submitted with "async": true; the job ID is the capability
+@pipeline.handler(pipeline.api_key(api_secret_key, cors='*'),
+                  pipeline.origin(echo=True), pipeline.validate(jobs.job_id, "job_id"))
+def job_status(request):
+    """Status of an asynchronous job, with the handler's response once it has finished"""
+    if jobs.store is None:
+        log.error("CACHE_TABLE environment variable not set")
+        return pipeline.error(500, "Server configuration error", request.cors)
+
+    job = jobs.status(request.job_id)
+    if job is None:
+        return pipeline.error(404, "Job not found or expired", request.cors, job_id=request.job_id)
+    headers = dict(request.cors)
+    if job["status"] not in jobs.DONE:
+        headers["Retry-After"] = str(jobs.JOB_POLL_INTERVAL)
+    return pipeline.json_response(job, headers)
+
+def job_worker(event, context):
+    """SQS worker: runs the jobs that the handlers queued"""
+    for record in event.get("Records", []):
+        jobs.run(pipeline.loads(record["body"]), context)
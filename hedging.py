@@ -0,0 +1,146 @@
+import asyncio
+import os
+import time
+from collections import deque
+
+import chat_backends
+import log
+
+# Opt-in hedged requests for the chat handlers. The prompt goes to the primary
+# backend; if it has not answered after a delay taken from its recent latency
+# percentile (or fails outright), the same prompt goes to a backup backend and
+# whichever complete answer arrives first wins. The loser is cancelled. A
+# primary that loses is still sampled, with the time it had taken when it was
+# cancelled as a lower bound, so slow calls keep the percentile honest.
+
+HEDGE_ENABLED = os.environ.get("HEDGE_ENABLED", "false").lower() == "true"
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", "95"))
+# Delay used until the primary has HEDGE_MIN_SAMPLES latencies recorded
+HEDGE_DEFAULT_DELAY = float(os.environ.get("HEDGE_DEFAULT_DELAY", "4"))
+HEDGE_MIN_DELAY = float(os.environ.get("HEDGE_MIN_DELAY", "0.5"))
+HEDGE_MIN_SAMPLES = int(os.environ.get("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_TIMEOUT = float(os.environ.get("HEDGE_TIMEOUT", "170"))
+
+WINDOW = 500
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class HedgeStats:
+    """Rolling latency samples and hedge/win counters for one primary backend"""
+
+    def __init__(self):
+        self.primary_latencies = deque(maxlen=WINDOW)
+        self.request_latencies = deque(maxlen=WINDOW)
+        self.requests = 0
+        self.hedged = 0
+        self.backup_wins = 0
+
+    def delay(self):
+        if len(self.primary_latencies) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        return max(HEDGE_MIN_DELAY, percentile(self.primary_latencies, HEDGE_PERCENTILE))
+
+    def summary(self):
+        return {
+            "requests": self.requests,
+            "hedge_rate": round(self.hedged / self.requests, 3) if self.requests else 0.0,
+            "backup_win_rate": round(self.backup_wins / self.hedged, 3) if self.hedged else 0.0,
+            "p50_ms": _ms(percentile(self.request_latencies, 50)),
+            "p99_ms": _ms(percentile(self.request_latencies, 99)),
+            "hedge_delay_ms": _ms(self.delay()),
+        }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000)
+
+
+_stats = {}
+
+
+def stats(primary):
+    if primary not in _stats:
+        _stats[primary] = HedgeStats()
+    return _stats[primary]
+
+
+def requested(request_data):
+    """Hedging is on for "hedge": true, or with HEDGE_ENABLED when the body has no "hedge"; anything else is off"""
+    return (request_data or {}).get("hedge", HEDGE_ENABLED) is True
+
+
+async def _timed(name, prompt, system=None, max_tokens=None):
+    start = time.perf_counter()
+    text = await chat_backends.call(name, prompt, system, max_tokens)
+    return name, text, time.perf_counter() - start
+
+
+async def race(prompt, primary, backup, delay, timeout=HEDGE_TIMEOUT, system=None, max_tokens=None):
+    """Return (text, winner, hedged) from the first complete answer"""
+    record = stats(primary)
+    primary_start = time.perf_counter()
+    primary_task = asyncio.ensure_future(_timed(primary, prompt, system, max_tokens))
+    done, _ = await asyncio.wait({primary_task}, timeout=delay)
+    if done and primary_task.exception() is None:
+        name, text, seconds = primary_task.result()
+        record.primary_latencies.append(seconds)
+        return text, name, False
+
+    if done:
+        log.warning("Primary backend failed, asking backup", primary=primary, backup=backup,
+                    error=str(primary_task.exception()))
+        pending = set()
+    else:
+        log.info("Primary backend slow, hedging", primary=primary, backup=backup, delay_ms=_ms(delay))
+        pending = {primary_task}
+    pending.add(asyncio.ensure_future(_timed(backup, prompt, system, max_tokens)))
+
+    error = primary_task.exception() if done else None
+    deadline = time.perf_counter() + timeout
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=max(0.0, deadline - time.perf_counter()),
+                                               return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                raise asyncio.TimeoutError(f"No answer from {primary} or {backup} within {timeout} seconds")
+            for task in done:
+                if task.exception() is not None:
+                    error = task.exception()
+                    continue
+                name, text, seconds = task.result()
+                if name == primary:
+                    record.primary_latencies.append(seconds)
+                return text, name, True
+        raise error
+    finally:
+        if primary_task in pending:
+            # Lost the race: it took at least this long
+            record.primary_latencies.append(time.perf_counter() - primary_start)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+def answer(prompt, primary, backup, system=None, max_tokens=None):
+    """Hedged answer to prompt in at most max_tokens; returns (text, served_by, hedged)"""
+    record = stats(primary)
+    chat_backends.prepare([primary, backup])
+    start = time.perf_counter()
+    text, winner, hedged = chat_backends.run(race(prompt, primary, backup, record.delay(), system=system,
+                                                       max_tokens=max_tokens))
+
+    record.requests += 1
+    record.request_latencies.append(time.perf_counter() - start)
+    if hedged:
+        record.hedged += 1
+        if winner == backup:
+            record.backup_wins += 1
+    log.info("Hedge stats", primary=primary, winner=winner, hedged=hedged, **record.summary())
+    return text, winner, hedged
@@ -0,0 +1,128 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import log
+import metrics
+import pipeline
+import resilience
+
+# Batch requests for the image endpoints: a list of prompts and/or a number of
+# variants per prompt. Variants are grouped into as few provider calls as each
+# model allows and the calls run concurrently, so a batch costs about as much
+# wall-clock time as its slowest call instead of the sum of all of them.
+
+MAX_BATCH_ITEMS = int(os.environ.get("IMAGE_BATCH_MAX_ITEMS", "16"))
+BATCH_CONCURRENCY = int(os.environ.get("IMAGE_BATCH_CONCURRENCY", "4"))
+
+# Most images a single provider call can return
+MAX_IMAGES_PER_CALL = {
+    "dall-e-3": 1,
+    "imagen-3.0-generate-001": 4,
+    "imagegeneration@006": 4,
+}
+
+
+def is_batch(request_data):
+    return "prompts" in request_data or "variants" in request_data
+
+
+def size(request_data):
+    """Number of images a request asks for, before validation (1 for a single image)"""
+    prompts = request_data.get("prompts")
+    variants = request_data.get("variants", 1)
+    count = (len(prompts) if isinstance(prompts, list) else 1) * (variants if isinstance(variants, int) else 1)
+    return min(max(count, 1), MAX_BATCH_ITEMS)
+
+
+def parse(request_data):
+    """Prompts, variants per prompt and concurrency; ValueError if invalid"""
+    prompts = request_data.get("prompts")
+    if prompts is None:
+        prompts = [request_data.get("prompt")]
+    if not isinstance(prompts, list) or not prompts or not all(isinstance(p, str) and p.strip() for p in prompts):
+        raise ValueError("prompts must be a non-empty list of prompts")
+
+    variants = request_data.get("variants", 1)
+    if not isinstance(variants, int) or variants < 1:
+        raise ValueError("variants must be a positive integer")
+    if len(prompts) * variants > MAX_BATCH_ITEMS:
+        raise ValueError(f"A batch can produce at most {MAX_BATCH_ITEMS} images")
+
+    concurrency = request_data.get("concurrency", BATCH_CONCURRENCY)
+    if not isinstance(concurrency, int) or concurrency < 1:
+        raise ValueError("concurrency must be a positive integer")
+    return prompts, variants, min(concurrency, BATCH_CONCURRENCY)
+
+
+def plan(prompts, variants, per_call):
+    """Split the batch into provider calls of at most per_call images each"""
+    calls = []
+    for prompt_index, prompt in enumerate(prompts):
+        for first_variant in range(0, variants, per_call):
+            calls.append((prompt_index, prompt, first_variant, min(per_call, variants - first_variant)))
+    return calls
+
+
+def run(calls, generate, concurrency):
+    """Run generate(prompt, count) for every call, collecting one result per image
+
+    Results are listed in request order (prompt_index, then variant), with
+    elapsed_ms saying when each finished; a failed call yields an error
+    result for each image it was meant to produce.
+    """
+    results = []
+    start = time.perf_counter()
+    # Worker threads keep the request's deadline for their provider calls
+    generate = resilience.bind(generate)
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {pool.submit(generate, prompt, count): (prompt_index, prompt, first_variant, count)
+                   for prompt_index, prompt, first_variant, count in calls}
+        for future in as_completed(futures):
+            prompt_index, prompt, first_variant, count = futures[future]
+            elapsed_ms = round((time.perf_counter() - start) * 1000)
+            try:
+                images = future.result()
+                error = None
+            except Exception as e:
+                log.warning("Error generating batch image", prompt_index=prompt_index, error=str(e))
+                images = []
+                error = f"Failed to generate image: {str(e)}"
+            for offset in range(count):
+                result = {
+                    "prompt_index": prompt_index,
+                    "variant": first_variant + offset,
+                    "prompt": prompt,
+                    "elapsed_ms": elapsed_ms,
+                }
+                if offset < len(images):
+                    result.update(images[offset], status="success")
+                else:
+                    result.update(status="error", error=error or "Provider returned fewer images than requested")
+                results.append(result)
+    results.sort(key=lambda result: (result["prompt_index"], result["variant"]))
+    return results
+
+
+def handle(request_data, model, generate, fields, headers):
+    """Validate a batch request, run it and build the Lambda response"""
+    try:
+        prompts, variants, concurrency = parse(request_data)
+    except ValueError as e:
+        return pipeline.error(400, str(e), headers)
+
+    calls = plan(prompts, variants, MAX_IMAGES_PER_CALL.get(model, 1))
+    log.info("Generating image batch", model=model, images=len(prompts) * variants, calls=len(calls),
+             concurrency=concurrency)
+    start = time.perf_counter()
+    results = run(calls, generate, concurrency)
+    succeeded = sum(1 for result in results if result["status"] == "success")
+    metrics.count("Images", succeeded)
+
+    return pipeline.json_response(dict(
+        fields,
+        results=results,
+        succeeded=succeeded,
+        failed=len(results) - succeeded,
+        elapsed_ms=round((time.perf_counter() - start) * 1000),
+    ), headers, 200 if succeeded else 500)
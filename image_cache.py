@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+import time
+import uuid
+
+import log
+import stores
+from cache import TTLCache
+
+# Generated images, content-addressed by a hash of model, prompt, enhanced
+# prompt and generation parameters. Bytes are written once to the blob store
+# (S3 in AWS, a directory offline) next to a small JSON metadata object. The
+# in-container index remembers metadata, bounded by entries, age and the
+# images' total bytes (IMAGE_CACHE_MAX_BYTES). An entry it evicts deletes its
+# blob only when nothing else may still use it: this container wrote it, no
+# other container has served it (they mark the metadata object "shared"), and
+# no URL this container handed out is still valid. The bucket's lifecycle
+# rule expires everything else after IMAGE_CACHE_TTL. Entries written by
+# other containers are found through their metadata object.
+
+IMAGE_CACHE_TTL = int(os.environ.get("IMAGE_CACHE_TTL", str(7 * 24 * 3600)))
+IMAGE_URL_EXPIRY = int(os.environ.get("IMAGE_URL_EXPIRY", "3600"))
+# Total bytes of the images in a container's index
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get("IMAGE_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+# Tells this container's blobs from the ones other containers wrote
+CONTAINER_ID = uuid.uuid4().hex
+
+
+def cache_key(model, prompt, enhanced_prompt=None, params=None):
+    payload = json.dumps({
+        "model": model,
+        "prompt": prompt,
+        "enhanced_prompt": enhanced_prompt,
+        "params": params or {},
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ImageCache:
+
+    def __init__(self, store, ttl=IMAGE_CACHE_TTL, max_entries=1000, max_bytes=None):
+        self.store = store
+        self.ttl = ttl
+        self.index = TTLCache(max_entries=max_entries, ttl=ttl, max_bytes=max_bytes, on_evict=self._evicted)
+        # Key -> when this container last handed out a URL for it
+        self._urls = {}
+
+    @property
+    def enabled(self):
+        return self.store is not None
+
+    def lookup(self, key):
+        """Metadata of a cached image, or None on a miss"""
+        if self.store is None:
+            return None
+        meta = self.index.get(key)
+        if meta is not None:
+            return meta
+        try:
+            raw = self.store.get(f"{key}.json")
+        except Exception as e:
+            log.warning("Image cache lookup failed", error=str(e))
+            return None
+        if raw is None:
+            return None
+        meta = json.loads(raw)
+        remaining = meta["created_at"] + self.ttl - time.time()
+        if remaining <= 0:
+            return None
+        if meta.get("owner") != CONTAINER_ID and not meta.get("shared"):
+            # Served by another container now: its writer must not delete it
+            meta = dict(meta, shared=True)
+            self._put_meta(key, meta)
+        self.index.set(key, meta, size=meta["size"], ttl=remaining)
+        return meta
+
+    def read(self, key):
+        """Image bytes, or None if the blob has gone or cannot be read (a miss either way)"""
+        try:
+            data = self.store.get(key)
+        except Exception as e:
+            log.warning("Image cache read failed", error=str(e))
+            return None
+        if data is None:
+            self.index.pop(key)
+        return data
+
+    def url(self, key):
+        self._urls[key] = time.time()
+        return self.store.url(key, expires_in=IMAGE_URL_EXPIRY)
+
+    def put(self, key, data, content_type, **details):
+        if self.store is None:
+            return
+        meta = dict(details, content_type=content_type, size=len(data), created_at=time.time(), owner=CONTAINER_ID)
+        try:
+            self.store.put(key, data, content_type=content_type)
+            self.store.put(f"{key}.json", json.dumps(meta).encode("utf-8"), content_type="application/json")
+        except Exception as e:
+            log.warning("Image cache write failed", error=str(e))
+            return
+        self.index.set(key, meta, size=len(data))
+
+    def _put_meta(self, key, meta):
+        try:
+            self.store.put(f"{key}.json", json.dumps(meta).encode("utf-8"), content_type="application/json")
+        except Exception as e:
+            log.warning("Image cache write failed", error=str(e))
+
+    def _evicted(self, key, meta):
+        url_at = self._urls.pop(key, None)
+        if meta.get("owner") != CONTAINER_ID:
+            return
+        if url_at is not None and time.time() - url_at < IMAGE_URL_EXPIRY:
+            return
+        # Another container may have marked it since this one wrote it
+        raw = self.store.get(f"{key}.json")
+        if raw is None or json.loads(raw).get("shared"):
+            return
+        self.store.delete(key)
+        self.store.delete(f"{key}.json")
+
+
+images = ImageCache(
+    stores.blob_store("images"),
+    max_entries=int(os.environ.get("IMAGE_CACHE_MAX_ENTRIES", "1000")),
+    max_bytes=IMAGE_CACHE_MAX_BYTES,
+)
@@ -0,0 +1,118 @@
+import base64
+import io
+import json
+
+# How generated images leave the Lambda. `data_url` keeps the original JSON
+# shape, `binary` returns the image itself (API Gateway decodes the base64 body
+# because of isBase64Encoded), and `presigned_url` returns a link to the copy
+# in the blob store. Encoding writes once into a BytesIO and the buffer is
+# shared (memoryview) with base64 and the cache instead of copied.
+
+OUTPUT_MODES = ("data_url", "binary", "presigned_url")
+
+FORMATS = {
+    "png": ("PNG", "image/png"),
+    "jpeg": ("JPEG", "image/jpeg"),
+    "webp": ("WEBP", "image/webp"),
+}
+
+DEFAULT_QUALITY = 85
+
+
+def options(body, allow_binary=True, store_enabled=True):
+    """Output mode, format and quality requested in the body; ValueError if invalid"""
+    body = body or {}
+    mode = body.get("output", "data_url")
+    if mode not in OUTPUT_MODES:
+        raise ValueError(f"output must be one of {', '.join(OUTPUT_MODES)}")
+    if mode == "binary" and not allow_binary:
+        raise ValueError("binary output is not available for batch requests")
+    if mode == "presigned_url" and not store_enabled:
+        raise ValueError("presigned_url output needs IMAGE_CACHE_BUCKET to be configured")
+
+    fmt = str(body.get("format", "png")).lower()
+    if fmt == "jpg":
+        fmt = "jpeg"
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+
+    quality = body.get("quality", DEFAULT_QUALITY)
+    if not isinstance(quality, int) or not 1 <= quality <= 100:
+        raise ValueError("quality must be an integer between 1 and 100")
+    if fmt == "png":
+        quality = None  # PNG is lossless; keep it out of cache keys
+    return {"output": mode, "format": fmt, "quality": quality}
+
+
+def encode(generated_image, fmt="png", quality=None):
+    """Encode a Vertex AI image, returning (bytes-like, content type)
+
+    PNG requests reuse the bytes Imagen already returned, skipping the
+    decode/re-encode round trip through PIL.
+    """
+    pil_format, content_type = FORMATS[fmt]
+    if fmt == "png":
+        original = getattr(generated_image, "_image_bytes", None)
+        if original:
+            return original, content_type
+
+    pil_image = generated_image._pil_image
+    save_options = {}
+    if fmt == "jpeg":
+        if pil_image.mode not in ("RGB", "L"):
+            pil_image = pil_image.convert("RGB")
+        save_options = {"quality": quality}
+    elif fmt == "webp":
+        save_options = {"quality": quality, "method": 4}
+
+    buffer = io.BytesIO()
+    pil_image.save(buffer, format=pil_format, **save_options)
+    return buffer.getbuffer(), content_type
+
+
+def build_response(mode, data, content_type, fields, headers, url=None):
+    """Lambda response carrying the image in the requested output mode
+
+    fields are the JSON metadata (prompt, model, ...) sent alongside the image.
+    """
+    if mode == "presigned_url":
+        return {
+            "statusCode": 200,
+            "status": "success",
+            "body": json.dumps(dict(fields, image_url=url, content_type=content_type)),
+            "headers": dict(headers, **{'Content-Type': 'application/json'}),
+        }
+
+    image_base64 = base64.b64encode(data).decode('ascii')
+
+    if mode == "binary":
+        return {
+            "statusCode": 200,
+            "status": "success",
+            "isBase64Encoded": True,
+            "body": image_base64,
+            "headers": dict(headers, **{
+                'Content-Type': content_type,
+                'X-Model': fields.get("model", ""),
+            }),
+        }
+
+    # Base64 is JSON-safe, so the image is spliced in instead of escaped by json.dumps
+    metadata = json.dumps(fields)
+    body = "".join((
+        '{"image_data": "data:', content_type, ';base64,', image_base64, '"',
+        ", " if fields else "", metadata[1:],
+    ))
+    return {
+        "statusCode": 200,
+        "status": "success",
+        "body": body,
+        "headers": dict(headers, **{'Content-Type': 'application/json'}),
+    }
+
+
+def batch_item(mode, data, content_type, url=None):
+    """JSON fields for one image of a batch response (binary is not available there)"""
+    if mode == "presigned_url":
+        return {"image_url": url, "content_type": content_type}
+    return {"image_data": f"data:{content_type};base64,{base64.b64encode(data).decode('ascii')}"}
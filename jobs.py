@@ -0,0 +1,309 @@
+import base64
+import hashlib
+import hmac
+import importlib
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import log
+import metrics
+import pipeline
+import providers
+import stores
+from conf import server_api_key
+
+# Asynchronous mode for long generations. A request to one of JOB_HANDLERS
+# with "async": true passes the handler's usual stages, then the last stage
+# (accept) records a queued job in the shared store, sends the event to the
+# jobs queue and answers 202 with the job ID. A worker (the job_worker
+# function, fed by SQS; a thread pool offline) runs the same handler on the
+# event and stores its response, which clients read from GET /jobs/{job_id}
+# or get POSTed to the webhook they sent. Large results (images) go to the
+# blob store and are served through a presigned URL; so do events too large
+# for an SQS message, which then carries the blob key instead. A job whose
+# message cannot be sent is deleted again and the client gets an error.
+
+JOB_HANDLERS = ("gemini_pro_chat", "image_generator", "gemini_image_generator", "nano_banana_generator")
+JOB_TTL = int(os.environ.get("JOB_TTL", str(24 * 3600)))
+# Suggested seconds between polls (Retry-After)
+JOB_POLL_INTERVAL = int(os.environ.get("JOB_POLL_INTERVAL", "2"))
+# Bodies larger than this go to the blob store; DynamoDB items stop at 400 KB
+JOB_INLINE_RESULT_BYTES = int(os.environ.get("JOB_INLINE_RESULT_BYTES", str(256 * 1024)))
+# SQS messages stop at 256 KB
+JOB_MAX_MESSAGE_BYTES = int(os.environ.get("JOB_MAX_MESSAGE_BYTES", str(256 * 1024)))
+JOB_RESULT_URL_EXPIRY = int(os.environ.get("JOB_RESULT_URL_EXPIRY", "3600"))
+JOB_LOCAL_WORKERS = int(os.environ.get("JOB_LOCAL_WORKERS", "4"))
+# Seconds the local queue gives each job, as the job_worker function's timeout does
+JOB_LOCAL_TIMEOUT = float(os.environ.get("JOB_LOCAL_TIMEOUT", "900"))
+
+# Webhooks only go to these domains (and their subdomains)
+JOB_WEBHOOK_DOMAINS = tuple(domain.strip() for domain in
+                            os.environ.get("JOB_WEBHOOK_DOMAINS", pipeline.ALLOWED_ORIGIN_DOMAIN).split(",")
+                            if domain.strip())
+WEBHOOK_SCHEMES = ("https",)
+WEBHOOK_TIMEOUT = 5
+WEBHOOK_ATTEMPTS = 3
+WEBHOOK_BACKOFF = 0.5
+
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+DONE = ("succeeded", "failed")
+
+
+class EventTooLarge(ValueError):
+    """The event does not fit in a queue message and there is no blob store to hold it"""
+
+
+def requested(request_data):
+    return request_data.get("async") is True
+
+
+def webhook(request_data):
+    """Webhook URL from the request, or None; ValueError if it is not allowed"""
+    url = request_data.get("webhook")
+    if url is None:
+        return None
+    parts = urlsplit(url) if isinstance(url, str) else None
+    host = (parts.hostname or "") if parts else ""
+    if parts is None or parts.scheme not in WEBHOOK_SCHEMES or \
+            not any(host == domain or host.endswith(f".{domain}") for domain in JOB_WEBHOOK_DOMAINS):
+        raise ValueError(f"webhook must be an {'/'.join(WEBHOOK_SCHEMES)} URL on {', '.join(JOB_WEBHOOK_DOMAINS)}")
+    return url
+
+
+def job_id(event):
+    """Job ID from the /jobs/{job_id} path; ValueError if malformed"""
+    value = (event.get("pathParameters") or {}).get("job_id") or event.get("job_id")
+    if not isinstance(value, str) or not JOB_ID_PATTERN.match(value):
+        raise ValueError("job_id must be the 32 character ID returned when the job was submitted")
+    return value
+
+
+class LocalContext:
+    """The part of a Lambda context that sets a job's deadline, for jobs the local queue runs"""
+
+    def __init__(self, timeout):
+        self.expires_at = time.monotonic() + timeout
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self.expires_at - time.monotonic()) * 1000))
+
+
+class LocalQueue:
+    """In-process stand-in for SQSQueue: a thread pool runs each job"""
+
+    def __init__(self, workers=JOB_LOCAL_WORKERS):
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def send(self, message):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job")
+        self._executor.submit(lambda: run(message, LocalContext(JOB_LOCAL_TIMEOUT)))
+
+
+class SQSQueue:
+    """Jobs as SQS messages, consumed by the job_worker function"""
+
+    def __init__(self, queue_url):
+        self.queue_url = queue_url
+
+    def send(self, message):
+        providers.get("sqs").send_message(QueueUrl=self.queue_url, MessageBody=pipeline.dumps(message))
+
+
+def job_queue():
+    """SQSQueue when JOBS_QUEUE_URL is set, LocalQueue when CACHE_STORE=local, else None"""
+    queue_url = os.environ.get("JOBS_QUEUE_URL")
+    if queue_url:
+        return SQSQueue(queue_url)
+    if os.environ.get("CACHE_STORE") == "local":
+        return LocalQueue()
+    return None
+
+
+store = stores.shared_store("job")
+queue = job_queue()
+results = stores.blob_store("jobs")
+
+
+def accept(name):
+    """Last stage of name's handler: queue requests that ask for "async" and answer 202"""
+    def accept_job(request):
+        # The worker's own invocation carries the job ID and runs normally
+        if request.event.get("job_id") or not requested(request.data):
+            return
+        if store is None or queue is None:
+            log.error("Jobs need CACHE_TABLE and JOBS_QUEUE_URL")
+            raise pipeline.Rejected(pipeline.error(500, "Server configuration error", request.cors))
+        try:
+            url = webhook(request.data)
+        except ValueError as e:
+            raise pipeline.Rejected(pipeline.error(400, str(e), request.cors))
+
+        try:
+            job = submit(name, request.event, url)
+        except EventTooLarge as e:
+            raise pipeline.Rejected(pipeline.error(413, str(e), request.cors))
+        except Exception as e:
+            log.exception("Could not queue job", e, handler=name)
+            raise pipeline.Rejected(pipeline.error(503, "Could not queue the job, please retry", request.cors))
+        log.info("Job queued", job_id=job["job_id"], handler=name, webhook=url is not None)
+        raise pipeline.Rejected(pipeline.json_response(
+            {"job_id": job["job_id"], "status": job["status"], "status_url": f"/jobs/{job['job_id']}"},
+            dict(request.cors, **{"Location": f"/jobs/{job['job_id']}", "Retry-After": str(JOB_POLL_INTERVAL)}),
+            202,
+        ))
+    accept_job.phase = "Submit"
+    return accept_job
+
+
+def _event_key(job_id):
+    return f"{job_id}.event"
+
+
+def _message(job_id, name, event, now):
+    """Queue message for the job; an event too large for it goes to the blob store"""
+    message = {"job_id": job_id, "handler": name, "event": event, "created_at": now}
+    size = len(pipeline.dumps(message).encode("utf-8"))
+    if size <= JOB_MAX_MESSAGE_BYTES:
+        return message
+    if results is None:
+        raise EventTooLarge(f"Request too large for an async job ({size} bytes, at most {JOB_MAX_MESSAGE_BYTES})")
+    results.put(_event_key(job_id), pipeline.dumps(event).encode("utf-8"), content_type="application/json")
+    return {"job_id": job_id, "handler": name, "event_blob": _event_key(job_id), "created_at": now}
+
+
+def submit(name, event, url=None):
+    """Record a queued job for handler name and send event to the queue
+
+    EventTooLarge if the event fits neither a message nor the blob store; if
+    sending fails the job is deleted and the error raised.
+    """
+    now = time.time()
+    job = {"job_id": uuid.uuid4().hex, "handler": name, "status": "queued", "created_at": now, "updated_at": now}
+    if url:
+        job["webhook"] = url
+    message = _message(job["job_id"], name, event, now)
+    store.put(job["job_id"], job, ttl=JOB_TTL)
+    try:
+        queue.send(message)
+    except Exception:
+        # Nothing will ever run it: it must not stay queued
+        store.delete(job["job_id"])
+        if "event_blob" in message:
+            results.delete(message["event_blob"])
+        raise
+    metrics.count("JobsSubmitted")
+    return job
+
+
+def _result(job_id, response):
+    """Stored form of a handler response: inline, or a blob key when too large"""
+    headers = {key: value for key, value in (response.get("headers") or {}).items()
+               if not key.startswith("Access-Control-")}
+    result = {"statusCode": response.get("statusCode", 200), "headers": headers}
+    body = response.get("body") or ""
+    if results is None or len(body.encode("utf-8")) <= JOB_INLINE_RESULT_BYTES:
+        result["body"] = body
+        if response.get("isBase64Encoded"):
+            result["isBase64Encoded"] = True
+        return result
+    data = base64.b64decode(body) if response.get("isBase64Encoded") else body.encode("utf-8")
+    results.put(job_id, data, content_type=headers.get("Content-Type", "application/octet-stream"))
+    result["blob"] = job_id
+    return result
+
+
+def _signature(body):
+    return "sha256=" + hmac.new(server_api_key.encode(), body, hashlib.sha256).hexdigest()
+
+
+def notify(url, job):
+    """POST the finished job to url, signed with the server API key; False if every attempt failed"""
+    # Imported here: urllib.request (http.client, ssl) is only needed by workers
+    import urllib.request
+
+    body = pipeline.dumps(job).encode("utf-8")
+    headers = {"Content-Type": "application/json"}
+    if server_api_key and server_api_key != pipeline.UNSET_SERVER_KEY:
+        headers["X-Signature"] = _signature(body)
+    for attempt in range(WEBHOOK_ATTEMPTS):
+        try:
+            with urllib.request.urlopen(urllib.request.Request(url, body, headers, method="POST"),
+                                        timeout=WEBHOOK_TIMEOUT) as response:
+                if response.status < 300:
+                    return True
+        except Exception as e:
+            log.warning("Webhook failed", job_id=job["job_id"], attempt=attempt + 1, error=str(e))
+        if attempt + 1 < WEBHOOK_ATTEMPTS:
+            time.sleep(random.uniform(0, WEBHOOK_BACKOFF * 2 ** attempt))
+    return False
+
+
+def view(job):
+    """Job as returned to clients: blob results become a fresh presigned URL"""
+    result = job.get("result")
+    if result and "blob" in result:
+        result = dict(result)
+        result["url"] = results.url(result.pop("blob"), expires_in=JOB_RESULT_URL_EXPIRY)
+        job = dict(job, result=result)
+    return job
+
+
+def status(job_id):
+    """The job, or None if it is unknown or expired"""
+    job = store.get(job_id)
+    return view(job) if job is not None else None
+
+
+def run(message, context=None):
+    """Worker side: run the job's handler on its event and store the response"""
+    job_id, name = message["job_id"], message["handler"]
+    if name not in JOB_HANDLERS:
+        log.error("Job for an unknown handler", job_id=job_id, handler=name)
+        return
+    job = store.get(job_id)
+    if job is None or job["status"] in DONE:
+        # Expired, or a redelivery of a job that already finished
+        return
+    started = time.time()
+    store.put(job_id, dict(job, status="running", updated_at=started), ttl=JOB_TTL)
+
+    try:
+        event = message.get("event")
+        if "event_blob" in message:
+            event = pipeline.loads(results.get(message["event_blob"]))
+        function = getattr(importlib.import_module("handler"), name)
+        response = function(dict(event, job_id=job_id), context) or {}
+    except Exception as e:
+        log.exception("Job failed", e, job_id=job_id, handler=name)
+        response = pipeline.error(500, f"Job failed: {str(e)}")
+
+    record = metrics.start("job_worker")
+    metrics.prop("Handler", name)
+    if record is not None:
+        record.add("JobWaitMs", round((started - message["created_at"]) * 1000, 2))
+        record.add("RunMs", round((time.time() - started) * 1000, 2))
+    code = response.get("statusCode", 200)
+    job = dict(job, status="succeeded" if code < 400 else "failed", updated_at=time.time())
+    with metrics.phase("Store"):
+        job["result"] = _result(job_id, response)
+        store.put(job_id, job, ttl=JOB_TTL)
+    log.info("Job finished", job_id=job_id, handler=name, status=job["status"], status_code=code)
+    if "event_blob" in message:
+        results.delete(message["event_blob"])
+
+    if job.get("webhook"):
+        with metrics.phase("Webhook"):
+            delivered = notify(job["webhook"], view(job))
+        metrics.count("WebhookFailed", int(not delivered))
+    metrics.finish(code)
+    log.flush()
@@ -0,0 +1,164 @@
+import atexit
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import traceback
+
+# Structured JSON logging for the Lambda functions. Each record is one JSON
+# line with a level, message, request id and fields. String fields are
+# truncated and API keys, emails and mobile numbers are redacted before they
+# are written. Records are buffered and written with a single stdout write at
+# the end of each invocation (or when the buffer fills up, or right away for
+# errors), so CloudWatch shipping stays off the response path. Full payloads
+# (events, prompts, responses) are DEBUG records, written for every request at
+# LOG_LEVEL=DEBUG and otherwise for a LOG_SAMPLE_RATE fraction of requests.
+
+LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "0"))
+# Longest string field written, in characters
+LOG_FIELD_LIMIT = int(os.environ.get("LOG_FIELD_LIMIT", "200"))
+LOG_BUFFER_BYTES = int(os.environ.get("LOG_BUFFER_BYTES", "65536"))
+
+MAX_ITEMS = 20
+MAX_DEPTH = 6
+REDACTED = "[REDACTED]"
+REDACT_KEYS = {"x-api-key", "authorization", "cookie", "api_key", "apikey", "email", "mobile"}
+EMAIL_PATTERN = re.compile(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}')
+PHONE_PATTERN = re.compile(r'\+?\(?\d[\d\s\-()]{7,}\d')
+
+_threshold = LEVELS.get(LOG_LEVEL, LEVELS["INFO"])
+_lock = threading.Lock()
+_buffer = []
+_buffered_bytes = 0
+_request_id = None
+_sampled = False
+
+
+def _redact_phone(match):
+    text = match.group(0)
+    return REDACTED if sum(ch.isdigit() for ch in text) >= 9 else text
+
+
+def _clean_text(text):
+    # Redact a little past the cut so an email or number is never left half visible
+    cleaned = text[:LOG_FIELD_LIMIT + 64]
+    if "@" in cleaned:
+        cleaned = EMAIL_PATTERN.sub(REDACTED, cleaned)
+    cleaned = PHONE_PATTERN.sub(_redact_phone, cleaned)
+    if len(text) > LOG_FIELD_LIMIT:
+        cleaned = f"{cleaned[:LOG_FIELD_LIMIT]}...(+{len(text) - LOG_FIELD_LIMIT} chars)"
+    return cleaned
+
+
+def clean(value, depth=0):
+    """value made safe to log: truncated, redacted and JSON-serializable"""
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, str):
+        return _clean_text(value)
+    if depth >= MAX_DEPTH:
+        return "..."
+    if isinstance(value, dict):
+        return {str(key): REDACTED if str(key).lower() in REDACT_KEYS else clean(item, depth + 1)
+                for key, item in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        items = [clean(item, depth + 1) for item in list(value)[:MAX_ITEMS]]
+        if len(value) > MAX_ITEMS:
+            items.append(f"...(+{len(value) - MAX_ITEMS} items)")
+        return items
+    return _clean_text(str(value))
+
+
+def enabled(level):
+    return LEVELS[level] >= _threshold
+
+
+def start(context=None):
+    """Begin an invocation: tag records with its request id and decide on sampling"""
+    global _request_id, _sampled
+    _request_id = getattr(context, "aws_request_id", None)
+    _sampled = enabled("DEBUG") or (LOG_SAMPLE_RATE > 0 and random.random() < LOG_SAMPLE_RATE)
+
+
+def write_line(line):
+    """Buffer an already formatted line (e.g. a metrics document) as it is"""
+    global _buffered_bytes
+    with _lock:
+        _buffer.append(line)
+        _buffered_bytes += len(line) + 1
+        full = _buffered_bytes >= LOG_BUFFER_BYTES
+    if full:
+        flush()
+
+
+def _write(level, message, fields):
+    global _buffered_bytes
+    record = {"level": level, "time": round(time.time(), 3), "msg": message}
+    if _request_id:
+        record["request_id"] = _request_id
+    for key, value in fields.items():
+        if key == "traceback":
+            record[key] = value  # truncating a traceback makes it useless
+        else:
+            record[key] = REDACTED if key.lower() in REDACT_KEYS else clean(value)
+    line = json.dumps(record, default=str)
+    with _lock:
+        _buffer.append(line)
+        _buffered_bytes += len(line) + 1
+        full = _buffered_bytes >= LOG_BUFFER_BYTES
+    if full or level == "ERROR":
+        flush()
+
+
+def debug(message, **fields):
+    if _threshold <= LEVELS["DEBUG"]:
+        _write("DEBUG", message, fields)
+
+
+def info(message, **fields):
+    if _threshold <= LEVELS["INFO"]:
+        _write("INFO", message, fields)
+
+
+def warning(message, **fields):
+    if _threshold <= LEVELS["WARNING"]:
+        _write("WARNING", message, fields)
+
+
+def error(message, **fields):
+    _write("ERROR", message, fields)
+
+
+def exception(message, e, **fields):
+    """ERROR record for e; the traceback is only included at DEBUG level"""
+    fields.update(error=str(e), error_type=type(e).__name__)
+    if enabled("DEBUG"):
+        fields["traceback"] = traceback.format_exc()
+    _write("ERROR", message, fields)
+
+
+def payload(message, **fields):
+    """DEBUG dump of large values, written only for sampled requests"""
+    if _sampled:
+        _write("DEBUG", message, fields)
+
+
+def flush():
+    global _buffered_bytes
+    with _lock:
+        if not _buffer:
+            return
+        text = "\n".join(_buffer) + "\n"
+        _buffer.clear()
+        _buffered_bytes = 0
+    sys.stdout.write(text)
+    sys.stdout.flush()
+
+
+atexit.register(flush)
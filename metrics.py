@@ -0,0 +1,188 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import log
+
+# Per-invocation metrics in CloudWatch Embedded Metric Format. The pipeline
+# opens a record for each request; handlers time their phases (Parse, Auth,
+# Provider, Encode, Serialize) and add counts such as tokens and image bytes.
+# At the end of the invocation the record is written as one EMF JSON line,
+# which CloudWatch turns into metrics with Function and Function+Model
+# dimensions. Lines go to `sink` (the log buffer by default); capture() swaps
+# in a list so the output can be checked offline. The open record lives in a
+# context variable: asyncio tasks inherit it, and worker threads get it by
+# running through resilience.bind().
+
+NAMESPACE = os.environ.get("METRICS_NAMESPACE", "BroadcustChatbot")
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() == "true"
+
+UNITS = {
+    "ColdStart": "Count",
+    "CacheHit": "Count",
+    "Error": "Count",
+    "InputTokens": "Count",
+    "OutputTokens": "Count",
+    "CachedTokens": "Count",
+    "Images": "Count",
+    "ImageBytes": "Bytes",
+    "ProfilesWritten": "Count",
+    "ProfilesFailed": "Count",
+    "BatchRetries": "Count",
+    "ProfileCacheHit": "Count",
+    "SessionCacheHit": "Count",
+    "SessionCompactions": "Count",
+    "HistoryTokens": "Count",
+    "JobsSubmitted": "Count",
+    "WebhookFailed": "Count",
+    "Throttled": "Count",
+    "ProviderRetries": "Count",
+    "CircuitOpen": "Count",
+    "Fallback": "Count",
+    "Coalesced": "Count",
+    "EstimatedInputTokens": "Count",
+    "TokensSaved": "Count",
+}
+
+# Module import is the start of the Lambda init phase
+_init_start = time.perf_counter()
+_cold = True
+_record = contextvars.ContextVar("metrics_record", default=None)
+
+sink = log.write_line
+
+
+class Record:
+    """Metrics of one invocation"""
+
+    def __init__(self, function):
+        global _cold
+        self.function = function
+        self.model = None
+        self.start = time.perf_counter()
+        self.values = {}
+        self.properties = {}
+        # Worker threads of the same request add to it concurrently
+        self._lock = threading.Lock()
+        self.cold = _cold
+        if _cold:
+            self.values["InitMs"] = round((self.start - _init_start) * 1000, 2)
+            _cold = False
+        self.values["ColdStart"] = 1 if self.cold else 0
+
+    def add(self, name, value):
+        with self._lock:
+            self.values[name] = round(self.values.get(name, 0) + value, 3)
+
+    def document(self, status):
+        values = dict(self.values, TotalMs=round((time.perf_counter() - self.start) * 1000, 2))
+        values["Error"] = 1 if status >= 500 else 0
+        dimensions = [["Function"]]
+        if self.model:
+            dimensions.insert(0, ["Function", "Model"])
+        document = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": NAMESPACE,
+                    "Dimensions": dimensions,
+                    "Metrics": [{"Name": name, "Unit": UNITS.get(name, "Milliseconds")} for name in values],
+                }],
+            },
+            "Function": self.function,
+            "StatusCode": status,
+        }
+        if self.model:
+            document["Model"] = self.model
+        document.update(self.properties)
+        document.update(values)
+        return document
+
+
+def current():
+    return _record.get()
+
+
+def claim_cold_start():
+    """True on the container's first invocation, whose record then reports a warm start (for warm-up pings)"""
+    global _cold
+    cold, _cold = _cold, False
+    return cold
+
+
+def start(function):
+    """Open the record for an invocation of function (a handler name)"""
+    record = Record(function) if METRICS_ENABLED else None
+    _record.set(record)
+    return record
+
+
+def finish(status):
+    """Write the current record as an EMF line"""
+    record = current()
+    _record.set(None)
+    if record is not None:
+        sink(json.dumps(record.document(status)))
+
+
+@contextmanager
+def phase(name, record=None):
+    """Add the time spent in the block to the <name>Ms metric"""
+    record = record or current()
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        if record is not None:
+            record.add(f"{name}Ms", round((time.perf_counter() - start_time) * 1000, 3))
+
+
+def count(name, value=1):
+    record = current()
+    if record is not None and value is not None:
+        record.add(name, value)
+
+
+def model(name):
+    """Add the Model dimension"""
+    record = current()
+    if record is not None:
+        record.model = name
+
+
+def prop(name, value):
+    """Searchable property on the EMF line (not a metric)"""
+    record = current()
+    if record is not None:
+        record.properties[name] = value
+
+
+def usage(response):
+    """Count tokens reported by a LangChain message or a Gemini response"""
+    usage_metadata = getattr(response, "usage_metadata", None)
+    if not usage_metadata:
+        return
+    if isinstance(usage_metadata, dict):
+        count("InputTokens", usage_metadata.get("input_tokens"))
+        count("OutputTokens", usage_metadata.get("output_tokens"))
+        # Input tokens read from the provider's prompt cache (part of InputTokens)
+        count("CachedTokens", (usage_metadata.get("input_token_details") or {}).get("cache_read"))
+    else:
+        count("InputTokens", getattr(usage_metadata, "prompt_token_count", None))
+        count("OutputTokens", getattr(usage_metadata, "candidates_token_count", None))
+        count("CachedTokens", getattr(usage_metadata, "cached_content_token_count", None))
+
+
+@contextmanager
+def capture():
+    """Collect the EMF documents in a list instead of writing them"""
+    global sink
+    documents = []
+    previous, sink = sink, lambda line: documents.append(json.loads(line))
+    try:
+        yield documents
+    finally:
+        sink = previous
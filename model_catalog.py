@@ -0,0 +1,116 @@
+import json
+import os
+import threading
+import time
+
+import log
+import providers
+
+# genai.list_models() is a network round trip, so the catalog is fetched at most
+# once per MODEL_CATALOG_TTL seconds, off the request path, and kept in memory
+# (and in MODEL_CATALOG_PATH so it survives a handler module reload).
+
+CATALOG_TTL = int(os.environ.get("MODEL_CATALOG_TTL", "3600"))
+CATALOG_PATH = os.environ.get("MODEL_CATALOG_PATH", "/tmp/gemini-model-catalog.json")
+
+# Models to try, in order, when a configured model is missing from the catalog
+FALLBACKS = {
+    "gemini-3-pro-preview": ["gemini-2.5-pro", "gemini-2.0-flash"],
+    "gemini-2.0-flash": ["gemini-2.0-flash-001", "gemini-2.5-flash"],
+}
+
+_models = None
+_fetched_at = 0.0
+_refreshing = False
+_lock = threading.Lock()
+
+
+def _load_file():
+    global _models, _fetched_at
+    if not CATALOG_PATH or not os.path.exists(CATALOG_PATH):
+        return
+    try:
+        with open(CATALOG_PATH) as f:
+            saved = json.load(f)
+        if time.time() - saved["fetched_at"] < CATALOG_TTL:
+            _models = set(saved["models"])
+            _fetched_at = saved["fetched_at"]
+    except Exception as e:
+        log.warning("Could not read model catalog", path=CATALOG_PATH, error=str(e))
+
+
+def _save_file():
+    if not CATALOG_PATH:
+        return
+    try:
+        with open(CATALOG_PATH, "w") as f:
+            json.dump({"fetched_at": _fetched_at, "models": sorted(_models)}, f)
+    except Exception as e:
+        log.warning("Could not write model catalog", path=CATALOG_PATH, error=str(e))
+
+
+def refresh():
+    """Fetch the model list from Gemini now"""
+    global _models, _fetched_at, _refreshing
+    try:
+        genai = providers.get("genai")
+        names = {m.name.split("/", 1)[-1] for m in genai.list_models()}
+        with _lock:
+            _models = names
+            _fetched_at = time.time()
+        _save_file()
+        log.info("Model catalog refreshed", models=len(names))
+    except Exception as e:
+        log.warning("Could not list models", error=str(e))
+    finally:
+        _refreshing = False
+
+
+def _refresh_in_background():
+    global _refreshing
+    with _lock:
+        if _refreshing:
+            return
+        _refreshing = True
+    threading.Thread(target=refresh, daemon=True).start()
+
+
+def models():
+    """Known model names, or None if the catalog has not been fetched yet
+
+    A missing or expired catalog is refreshed in a background thread; callers
+    never wait for it.
+    """
+    if _models is None:
+        _load_file()
+    if _models is None or time.time() - _fetched_at >= CATALOG_TTL:
+        _refresh_in_background()
+    return _models
+
+
+def load():
+    """Known model names, fetched now when the catalog is missing or expired (for warm-ups)"""
+    if _models is None:
+        _load_file()
+    if _models is None or time.time() - _fetched_at >= CATALOG_TTL:
+        refresh()
+    return _models
+
+
+def is_available(name):
+    """True/False once the catalog is known, None before that"""
+    known = models()
+    return None if known is None else name in known
+
+
+def resolve(name):
+    """Return name, or its first available fallback if the catalog lacks it"""
+    known = models()
+    if known is None or name in known:
+        return name
+    for fallback in FALLBACKS.get(name, []):
+        if fallback in known:
+            log.info("Model not available, falling back", model=name, fallback=fallback)
+            return fallback
+    log.warning("Model not in catalog and no fallback available, using it anyway", model=name)
+    return name
@@ -0,0 +1,225 @@
+import base64
+import functools
+import hmac
+import json
+import math
+
+import log
+import metrics
+import resilience
+import warmup
+
+try:
+    import orjson
+except ImportError:  # optional: the stdlib json module does the same job, slower
+    orjson = None
+
+# Request pipeline shared by the Lambda handlers. A handler lists the stages
+# its requests go through (origin, API key, body parsing, validation) and only
+# runs once every stage has passed, so a rejected request costs a few dict
+# lookups and never touches a provider SDK. Stages reject by raising Rejected
+# with the finished response.
+
+ALLOWED_ORIGIN_DOMAIN = "broadcust.co.il"
+DEFAULT_ORIGIN = 'https://broadcust.co.il'
+# Placeholder value shipped in the conf.py template
+UNSET_SERVER_KEY = "your-secret-key-here"
+
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+
+if orjson is not None:
+    def loads(data):
+        return orjson.loads(data)
+
+    def dumps(value):
+        return orjson.dumps(value).decode("utf-8")
+else:
+    loads = json.loads
+    dumps = json.dumps
+
+
+class Rejected(Exception):
+    """Raised by a stage (or handler) to answer with response right away"""
+
+    def __init__(self, response):
+        super().__init__(response.get("statusCode"))
+        self.response = response
+
+
+class Invalid(ValueError):
+    """Validation error; fields are added to the JSON error body"""
+
+    def __init__(self, message, **fields):
+        super().__init__(message)
+        self.fields = fields
+
+
+class Request:
+    """One invocation: the raw event, its headers, the parsed body and CORS headers"""
+
+    def __init__(self, event, context=None):
+        self.event = event
+        self.context = context
+        self.headers = event.get("headers") or {}
+        self.data = event
+        self.cors = {}
+
+
+def _serialize(payload):
+    with metrics.phase("Serialize"):
+        return dumps(payload)
+
+
+def json_response(payload, headers=None, status=200):
+    return {
+        "statusCode": status,
+        "status": "success" if status < 400 else "error",
+        "body": _serialize(payload),
+        "headers": dict(headers or {}, **JSON_HEADERS),
+    }
+
+
+def text_response(text, headers=None, status=200):
+    return {
+        "statusCode": status,
+        "status": "success" if status < 400 else "error",
+        "body": text,
+        "headers": dict(headers or {}, **{'Content-Type': 'text/plain; charset=utf-8'}),
+    }
+
+
+def error(status, message, headers=None, **fields):
+    return json_response(dict({"error": message}, **fields), headers, status)
+
+
+def provider_error(e, message, headers=None, **fields):
+    """error() for a failed provider call: 503 (with Retry-After) or 504 when the provider is down or slow"""
+    headers = dict(headers or {})
+    if isinstance(e, resilience.CircuitOpen):
+        headers["Retry-After"] = str(math.ceil(e.retry_after))
+    return error(resilience.status(e), message, headers, **fields)
+
+
+def origin(echo=False):
+    """Reject requests from other sites; CORS allows the caller's origin if echo, else the default"""
+    def check_origin(request):
+        event_origin = request.headers.get("origin")
+        if event_origin is None:
+            request.cors = {'Access-Control-Allow-Origin': DEFAULT_ORIGIN}
+        elif event_origin.endswith(ALLOWED_ORIGIN_DOMAIN):
+            request.cors = {'Access-Control-Allow-Origin': event_origin if echo else DEFAULT_ORIGIN}
+        else:
+            log.warning("Origin is not allowed", origin=event_origin)
+            raise Rejected({"statusCode": 403, 'error': "Invalid Origin"})
+    check_origin.phase = "Auth"
+    return check_origin
+
+
+def api_key(key, required=False, cors=None):
+    """Check x-api-key against key; an empty key disables the check unless required"""
+    headers = {'Access-Control-Allow-Origin': cors} if cors else {}
+
+    def check_api_key(request):
+        if not key or key == UNSET_SERVER_KEY:
+            if not required:
+                return
+            log.error("server_api_key not configured in conf.py")
+            raise Rejected(error(500, "Server configuration error", headers))
+        provided_api_key = request.headers.get("x-api-key")
+        if not provided_api_key or not hmac.compare_digest(provided_api_key.encode(), key.encode()):
+            log.warning("Invalid or missing API key")
+            raise Rejected(error(403, "Invalid or missing API key", headers))
+    check_api_key.phase = "Auth"
+    return check_api_key
+
+
+def parse_body(request):
+    """Parse the JSON body once; direct invocations without a body use the event itself"""
+    event_body = request.event.get("body")
+    if event_body is None:
+        return
+    if request.event.get("isBase64Encoded"):
+        event_body = base64.b64decode(event_body)
+    try:
+        data = loads(event_body)
+    except ValueError:
+        raise Rejected(error(400, "Invalid JSON in request body", request.cors))
+    if not isinstance(data, dict):
+        raise Rejected(error(400, "Request body must be a JSON object", request.cors))
+    request.data = data
+
+
+def prompt(field="prompt", unless=None):
+    """Require field to be a non-blank string (skipped when unless(data) is true)"""
+    def check_prompt(request):
+        if unless is not None and unless(request.data):
+            return
+        value = request.data.get(field)
+        if value is not None and not isinstance(value, str):
+            raise Rejected(error(400, f"{field} must be a string", request.cors))
+        if not value or not value.strip():
+            raise Rejected(error(400, f"No {field} provided", request.cors))
+    return check_prompt
+
+
+def validate(check, name):
+    """Store check(data) as request.<name>; Invalid/ValueError becomes a 400"""
+    def run_check(request):
+        try:
+            setattr(request, name, check(request.data))
+        except ValueError as e:
+            raise Rejected(error(400, str(e), request.cors, **getattr(e, "fields", {})))
+    return run_check
+
+
+def run_stages(request, stages, record=None):
+    """Run stages in order, each timed as its phase; Rejected propagates"""
+    for stage in stages:
+        with metrics.phase(getattr(stage, "phase", "Parse"), record):
+            stage(request)
+
+
+def handler(*stages):
+    """Turn function(request) into a Lambda handler that runs stages first
+
+    Stages are timed as the Auth or Parse phase (their `phase` attribute).
+    Keep-warm pings are answered by warmup.ping() instead. Any other exception
+    than Rejected from a stage or the function answers 500.
+    """
+    def decorate(function):
+        name = function.__name__
+
+        @functools.wraps(function)
+        def lambda_handler(event, context):
+            log.start(context)
+            if warmup.is_ping(event):
+                # Scheduled keep-warm pings skip the stages and the request metrics
+                try:
+                    return json_response(warmup.ping(name, event, context))
+                finally:
+                    log.flush()
+            record = metrics.start(name)
+            resilience.begin(event, context)
+            request = Request(event, context)
+            body = event.get("body")
+            log.info("Request", handler=name, path=event.get("rawPath"),
+                     body_bytes=len(body) if body else 0)
+            log.payload("Event", event=event)
+            response = None
+            try:
+                run_stages(request, stages, record)
+                response = function(request)
+            except Rejected as e:
+                log.info("Request rejected", handler=name, status=e.response.get("statusCode"))
+                response = e.response
+            except Exception as e:
+                # A JSON 500 with the CORS headers, not an invocation error the client sees as a 502
+                log.exception("Unhandled error", e, handler=name)
+                response = error(500, "Internal server error", request.cors)
+            finally:
+                metrics.finish(response.get("statusCode", 200) if response else 500)
+                log.flush()
+            return response
+        return lambda_handler
+    return decorate
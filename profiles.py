@@ -0,0 +1,275 @@
+import hmac
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import log
+import metrics
+import pipeline
+import providers
+from cache import TTLCache
+
+# User profiles in the USER_PROFILES_TABLE table (partition key UserID).
+# Single profiles are written with put_item; bulk imports are validated in one
+# pass and written in BatchWriteItem chunks of 25 by a few worker threads, with
+# the items DynamoDB leaves unprocessed retried after a jittered backoff. The
+# table handle and client are built once per container and reused while warm.
+#
+# The chat handlers take an optional UserID and send the business description
+# from that profile as system context. Profiles are read through an LRU in the
+# container (unknown UserIDs are remembered for a shorter time) so repeated
+# requests from the same user do not reach DynamoDB; writes in this container
+# drop the cached copy, other containers pick them up within PROFILE_CACHE_TTL.
+# The site-wide API key and Origin say nothing about who the user is, so a
+# UserID is only taken from server-to-server callers that also send
+# server_api_key in X-Server-Key (browsers cannot: CORS does not allow it).
+
+PROFILE_FIELDS = ['UserID', 'Mobile', 'Email', 'RawBizChar', 'OptBizChar']
+EMAIL_PATTERN = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+# Basic validation - digits, spaces and + - ( ) only
+MOBILE_PATTERN = re.compile(r'^[\d\s\-\+\(\)]+$')
+NON_DIGITS = re.compile(r'\D')
+
+# BatchWriteItem takes at most 25 put requests
+BATCH_SIZE = 25
+BULK_MAX_RECORDS = int(os.environ.get("PROFILES_BULK_MAX_RECORDS", "10000"))
+BULK_CONCURRENCY = int(os.environ.get("PROFILES_BULK_CONCURRENCY", "4"))
+BULK_MAX_ATTEMPTS = int(os.environ.get("PROFILES_BULK_MAX_ATTEMPTS", "6"))
+BULK_BACKOFF_BASE = float(os.environ.get("PROFILES_BULK_BACKOFF_BASE", "0.05"))
+BULK_BACKOFF_MAX = float(os.environ.get("PROFILES_BULK_BACKOFF_MAX", "2"))
+
+PROFILE_CACHE_TTL = int(os.environ.get("PROFILE_CACHE_TTL", "300"))
+PROFILE_MISS_TTL = int(os.environ.get("PROFILE_MISS_TTL", "60"))
+
+_table = None
+_lock = threading.Lock()
+
+# UserID -> profile item, or {} for a UserID that has no profile
+cached = TTLCache(max_entries=int(os.environ.get("PROFILE_CACHE_MAX_ENTRIES", "1024")), ttl=PROFILE_CACHE_TTL)
+
+
+def table_name():
+    return os.environ.get('USER_PROFILES_TABLE')
+
+
+def table():
+    """Table handle for USER_PROFILES_TABLE, built on first use"""
+    global _table
+    if _table is None or _table.name != table_name():
+        with _lock:
+            if _table is None or _table.name != table_name():
+                _table = providers.get("dynamodb").Table(table_name())
+    return _table
+
+
+def validate(data):
+    """Cleaned profile from a request body or bulk record; pipeline.Invalid if invalid"""
+    if not isinstance(data, dict):
+        raise pipeline.Invalid("Profile must be a JSON object")
+    missing_fields = [field for field in PROFILE_FIELDS
+                      if not isinstance(data.get(field), str) or not data[field].strip()]
+    if missing_fields:
+        raise pipeline.Invalid("Missing required fields", missing_fields=missing_fields)
+
+    profile = {field: data[field].strip() for field in PROFILE_FIELDS}
+    if not EMAIL_PATTERN.match(profile['Email']):
+        raise pipeline.Invalid("Invalid email format", field="Email")
+    mobile = profile['Mobile']
+    if not MOBILE_PATTERN.match(mobile) or len(NON_DIGITS.sub('', mobile)) < 9:
+        raise pipeline.Invalid("Invalid mobile format - must contain at least 9 digits", field="Mobile")
+    return profile
+
+
+def parse_records(body):
+    """Records of a JSON array or NDJSON body, as (record, error) pairs; ValueError if unusable
+
+    A line of NDJSON that is not valid JSON becomes an error for that record
+    only, so one bad line does not reject the whole import.
+    """
+    text = body.strip()
+    if not text:
+        raise ValueError("No profiles provided")
+    if text.startswith("["):
+        try:
+            records = pipeline.loads(text)
+        except ValueError:
+            raise ValueError("Invalid JSON in request body")
+        parsed = [(record, None) for record in records]
+    else:
+        parsed = []
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            try:
+                parsed.append((pipeline.loads(line), None))
+            except ValueError:
+                parsed.append((None, "Invalid JSON"))
+    if len(parsed) > BULK_MAX_RECORDS:
+        raise ValueError(f"A bulk import can hold at most {BULK_MAX_RECORDS} profiles")
+    return parsed
+
+
+def _report(index, record, status, **fields):
+    user_id = record.get("UserID") if isinstance(record, dict) else None
+    return dict({"index": index, "userId": user_id, "status": status}, **fields)
+
+
+def _attribute_values(profile):
+    return {field: {"S": value} for field, value in profile.items()}
+
+
+def _backoff(attempt):
+    # Full jitter: a random wait up to the exponential step
+    return random.uniform(0, min(BULK_BACKOFF_MAX, BULK_BACKOFF_BASE * 2 ** attempt))
+
+
+def _write_chunk(client, name, chunk):
+    """BatchWriteItem one chunk of (index, profile)
+
+    Returns {index: error} for what never got written and the number of retries.
+    """
+    requests = {profile['UserID']: {"PutRequest": {"Item": _attribute_values(profile)}} for _, profile in chunk}
+    indexes = {profile['UserID']: index for index, profile in chunk}
+    pending = list(requests.values())
+    error = None
+    for attempt in range(BULK_MAX_ATTEMPTS):
+        if attempt:
+            time.sleep(_backoff(attempt))
+        try:
+            response = client.batch_write_item(RequestItems={name: pending})
+        except Exception as e:
+            # Throttling and transient errors: retry the whole chunk
+            log.warning("BatchWriteItem failed", attempt=attempt + 1, items=len(pending), error=str(e))
+            error = str(e)
+            continue
+        pending = response.get("UnprocessedItems", {}).get(name, [])
+        if not pending:
+            return {}, attempt
+        error = "Unprocessed after retries"
+    failed = {indexes[request["PutRequest"]["Item"]["UserID"]["S"]]: error for request in pending}
+    return failed, BULK_MAX_ATTEMPTS - 1
+
+
+def write_batch(profiles, concurrency=None):
+    """Write [(index, profile)] in BatchWriteItem chunks; returns {index: error} for the failures"""
+    client = table().meta.client
+    name = table_name()
+    chunks = [profiles[start:start + BATCH_SIZE] for start in range(0, len(profiles), BATCH_SIZE)]
+    failed = {}
+    if not chunks:
+        return failed
+    with ThreadPoolExecutor(max_workers=min(concurrency or BULK_CONCURRENCY, len(chunks))) as pool:
+        for chunk_failures, retries in pool.map(lambda chunk: _write_chunk(client, name, chunk), chunks):
+            failed.update(chunk_failures)
+            metrics.count("BatchRetries", retries)
+    return failed
+
+
+def bulk_import(parsed, concurrency=None):
+    """Validate every record, write the valid ones and report per record
+
+    A UserID that appears more than once is written once, with its last
+    record; the earlier ones are reported as superseded.
+    """
+    results = [None] * len(parsed)
+    latest = {}
+    for index, (record, parse_error) in enumerate(parsed):
+        if parse_error:
+            results[index] = _report(index, record, "invalid", error=parse_error)
+            continue
+        try:
+            profile = validate(record)
+        except pipeline.Invalid as e:
+            results[index] = _report(index, record, "invalid", error=str(e), **e.fields)
+            continue
+        previous = latest.get(profile['UserID'])
+        if previous is not None:
+            results[previous[0]] = _report(previous[0], previous[1], "superseded", by=index)
+        latest[profile['UserID']] = (index, profile)
+
+    profiles = sorted(latest.values(), key=lambda item: item[0])
+    with metrics.phase("Provider"):
+        failed = write_batch(profiles, concurrency)
+    for index, profile in profiles:
+        if index in failed:
+            results[index] = _report(index, profile, "failed", error=failed[index])
+        else:
+            results[index] = _report(index, profile, "written")
+            invalidate(profile['UserID'])
+
+    counts = {"total": len(results), "written": 0, "invalid": 0, "superseded": 0, "failed": 0}
+    for result in results:
+        counts[result["status"]] += 1
+    metrics.count("ProfilesWritten", counts["written"])
+    metrics.count("ProfilesFailed", counts["failed"])
+    return counts, results
+
+
+def user_id(request_data):
+    """UserID of a chat request, or None; ValueError if it is not a string"""
+    value = request_data.get("UserID")
+    if value is None:
+        return None
+    if not isinstance(value, str) or not value.strip():
+        raise ValueError("UserID must be a non-empty string")
+    return value.strip()
+
+
+def identity(server_key):
+    """Stage: request.user_id from UserID, which only callers holding server_key may send"""
+    def check_user_id(request):
+        try:
+            request.user_id = user_id(request.data)
+        except ValueError as e:
+            raise pipeline.Rejected(pipeline.error(400, str(e), request.cors))
+        if request.user_id is None:
+            return
+        provided = request.headers.get("x-server-key")
+        if (not server_key or server_key == pipeline.UNSET_SERVER_KEY or not provided
+                or not hmac.compare_digest(provided.encode(), server_key.encode())):
+            log.warning("UserID sent without the server key")
+            raise pipeline.Rejected(pipeline.error(403, "UserID is only accepted from server callers", request.cors))
+    check_user_id.phase = "Auth"
+    return check_user_id
+
+
+def get(user_id):
+    """Profile for user_id (None if there is none), read through the container cache"""
+    profile = cached.get(user_id)
+    metrics.count("ProfileCacheHit", int(profile is not None))
+    if profile is not None:
+        return profile or None
+
+    with metrics.phase("Profile"):
+        profile = table().get_item(Key={"UserID": user_id}).get("Item")
+    cached.set(user_id, profile or {}, size=1, ttl=None if profile else PROFILE_MISS_TTL)
+    return profile
+
+
+def invalidate(user_id):
+    cached.pop(user_id)
+
+
+def system_context(user_id):
+    """System instruction describing the user's business, or None
+
+    A failed lookup is logged and the request goes on without context.
+    """
+    if not user_id or not table_name():
+        return None
+    try:
+        profile = get(user_id)
+    except Exception as e:
+        log.warning("User profile lookup failed", user_id=user_id, error=str(e))
+        return None
+    if profile is None:
+        log.info("No user profile", user_id=user_id)
+        return None
+    description = profile.get('OptBizChar') or profile.get('RawBizChar')
+    if not description:
+        return None
+    return ("You are writing for this business. Use the description below for context "
+            f"unless the user says otherwise.\nBusiness description: {description}")
@@ -0,0 +1,241 @@
+import os
+import threading
+
+import log
+import metrics
+from conf import open_api_api_key, gemini_api_key, gcp_project_id, gcp_region
+
+# Every function in serverless.yml boots handler.py, so provider SDKs are only
+# imported and configured the first time a handler asks for them. Instances are
+# kept at module level and reused by warm invocations of the same container.
+
+# Model settings the chat handlers also use as response cache keys
+LLM_MODEL = "gpt-4o"
+LLM_TEMPERATURE = 0.7
+
+# Kept-alive connections to the OpenAI API. Idle connections are reused for
+# this many seconds, which covers the gaps between most warm invocations;
+# the provider closes them on its side after a few minutes.
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_CONNECT_TIMEOUT = 5.0
+# Default for calls made outside resilience.call(), which passes its own
+OPENAI_TIMEOUT = float(os.environ.get("PROVIDER_TIMEOUT", "60"))
+
+_factories = {}
+_instances = {}
+_lock = threading.RLock()
+
+
+def provider(name):
+    """Register a zero-argument factory that builds the named provider"""
+    def register(factory):
+        _factories[name] = factory
+        return factory
+    return register
+
+
+def get(name):
+    """Return the named provider, building it on first use"""
+    instance = _instances.get(name)
+    if instance is not None:
+        return instance
+
+    with _lock:
+        instance = _instances.get(name)
+        if instance is None:
+            instance = _factories[name]()
+            _instances[name] = instance
+    return instance
+
+
+def loaded():
+    """Names of the providers built so far in this container"""
+    return list(_instances)
+
+
+def reset(name=None):
+    """Drop one (or every) built provider so the next get() rebuilds it"""
+    with _lock:
+        if name is None:
+            _instances.clear()
+        else:
+            _instances.pop(name, None)
+
+
+class HandleCache:
+    """Model handles keyed by model name, kept for warm invocations"""
+
+    def __init__(self, loader):
+        self._loader = loader
+        self._handles = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.builds = 0
+        self.invalidations = 0
+
+    def get(self, name):
+        """The handle for name, built on first use; counted as ModelCacheHit or ModelCacheBuild"""
+        handle = self._handles.get(name)
+        if handle is None:
+            with self._lock:
+                handle = self._handles.get(name)
+                if handle is None:
+                    handle = self._loader(name)
+                    self._handles[name] = handle
+                    self.builds += 1
+                    metrics.count("ModelCacheBuild")
+                    return handle
+        with self._lock:
+            self.hits += 1
+        metrics.count("ModelCacheHit")
+        return handle
+
+    def invalidate(self, name):
+        """Forget a handle that failed so the next get() rebuilds it"""
+        with self._lock:
+            if self._handles.pop(name, None) is not None:
+                self.invalidations += 1
+
+    def warm(self, names):
+        """Build handles up front, e.g. during the Lambda init phase"""
+        for name in names:
+            try:
+                self.get(name)
+            except Exception as e:
+                log.warning("Could not warm model", model=name, error=str(e))
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "builds": self.builds,
+            "invalidations": self.invalidations,
+            "cached": sorted(self._handles),
+        }
+
+
+def _http_limits():
+    import httpx
+
+    return httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+                        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY)
+
+
+@provider("http")
+def _http():
+    import httpx
+
+    # One pool for every OpenAI call in the container, so warm invocations skip the TLS handshake
+    return httpx.Client(limits=_http_limits(), timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT))
+
+
+@provider("http_async")
+def _http_async():
+    import httpx
+
+    return httpx.AsyncClient(limits=_http_limits(),
+                             timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT))
+
+
+@provider("openai_client")
+def _openai_client():
+    from openai import OpenAI
+
+    os.environ["OPENAI_API_KEY"] = open_api_api_key
+    # resilience.call() retries and sets the timeout of each call
+    return OpenAI(
+        api_key=open_api_api_key,
+        timeout=OPENAI_TIMEOUT,
+        max_retries=0,
+        http_client=get("http"),
+    )
+
+
+@provider("llm")
+def _llm():
+    from langchain_openai import ChatOpenAI
+
+    os.environ["OPENAI_API_KEY"] = open_api_api_key
+    return ChatOpenAI(temperature=LLM_TEMPERATURE, model_name=LLM_MODEL, streaming=False,
+                      request_timeout=OPENAI_TIMEOUT, max_retries=0,
+                      http_client=get("http"), http_async_client=get("http_async"))
+
+
+@provider("dynamodb")
+def _dynamodb():
+    import boto3
+
+    return boto3.resource('dynamodb')
+
+
+@provider("s3")
+def _s3():
+    import boto3
+
+    return boto3.client('s3')
+
+
+@provider("sqs")
+def _sqs():
+    import boto3
+
+    return boto3.client('sqs')
+
+
+@provider("lambda")
+def _lambda():
+    import boto3
+
+    return boto3.client('lambda')
+
+
+@provider("genai")
+def _genai():
+    import google.generativeai as genai
+
+    # Configure Gemini; its gRPC channel stays open for warm invocations and
+    # resilience.call() sets the timeout of each request
+    genai.configure(api_key=gemini_api_key)
+    return genai
+
+
+@provider("vertexai")
+def _vertexai():
+    import vertexai
+
+    # Initialize Vertex AI
+    try:
+        # Use environment variables first, then fall back to conf.py
+        project_id = os.environ.get("GCP_PROJECT_ID", gcp_project_id)
+        region = os.environ.get("GCP_REGION", gcp_region)
+
+        # For AWS Lambda, explicitly set credentials path
+        # This tells Google Cloud SDK where to find the service account key
+        credentials_path = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS",
+                                          "/var/task/vertex-ai-key.json")
+
+        if os.path.exists(credentials_path):
+            os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = credentials_path
+            log.info("Using GCP credentials", path=credentials_path)
+        else:
+            log.warning("GCP credentials file not found", path=credentials_path)
+
+        # Initialize Vertex AI - will use the credentials file
+        vertexai.init(project=project_id, location=region)
+        log.info("Vertex AI initialized", project=project_id, region=region)
+    except Exception as e:
+        log.warning("Vertex AI initialization failed", error=str(e))
+
+    return vertexai
+
+
+@provider("image_generation_model")
+def _image_generation_model():
+    get("vertexai")
+    from vertexai.preview.vision_models import ImageGenerationModel
+
+    return ImageGenerationModel
+
+
+# Vertex AI image models, e.g. imagen-3.0-generate-001 and imagegeneration@006
+image_models = HandleCache(lambda name: get("image_generation_model").from_pretrained(name))
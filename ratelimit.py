@@ -0,0 +1,250 @@
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import log
+import metrics
+import pipeline
+import providers
+
+# Admission control per client (the source IP API Gateway saw). Each budget
+# is a token bucket of BUDGETS[name] = (requests per minute, burst) per
+# client, kept in the CACHE_TABLE table so every container draws from the
+# same bucket. The API key and Origin are the same for every browser on the
+# site, and a client can change or drop them, so they are not keys; all
+# traffic also draws from one site-wide bucket of GLOBAL_BUDGETS[name], a
+# coarse cap on what the site spends. A container takes a few tokens at a
+# time (a lease) and spends them without calling DynamoDB; once a bucket is
+# empty it remembers when the next token is due and answers 429 until then
+# without a lookup. Both run as a pipeline stage before any provider call.
+# The stream server, which serves requests on threads, also caps each
+# client's requests in flight.
+
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "true").lower() == "true"
+
+BUDGETS = {
+    "text": (int(os.environ.get("RATE_LIMIT_TEXT_PER_MINUTE", "60")),
+             int(os.environ.get("RATE_LIMIT_TEXT_BURST", "20"))),
+    "image": (int(os.environ.get("RATE_LIMIT_IMAGE_PER_MINUTE", "10")),
+              int(os.environ.get("RATE_LIMIT_IMAGE_BURST", "5"))),
+}
+GLOBAL_BUDGETS = {
+    "text": (int(os.environ.get("RATE_LIMIT_TEXT_GLOBAL_PER_MINUTE", "1200")),
+             int(os.environ.get("RATE_LIMIT_TEXT_GLOBAL_BURST", "200"))),
+    "image": (int(os.environ.get("RATE_LIMIT_IMAGE_GLOBAL_PER_MINUTE", "120")),
+              int(os.environ.get("RATE_LIMIT_IMAGE_GLOBAL_BURST", "40"))),
+}
+GLOBAL_TENANT = "site"
+# Most tokens a container leases at once (a quarter of the burst if smaller)
+RATE_LIMIT_LEASE = int(os.environ.get("RATE_LIMIT_LEASE", "5"))
+# Leased tokens not spent within this many seconds are dropped
+LEASE_TTL = 10
+RATE_LIMIT_MAX_IN_FLIGHT = int(os.environ.get("RATE_LIMIT_MAX_IN_FLIGHT", "4"))
+
+# Optimistic writes to a bucket before giving up (another container keeps winning)
+UPDATE_ATTEMPTS = 3
+
+
+class Throttled(Exception):
+    """The tenant is over its budget; retry after retry_after seconds"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"retry after {retry_after:.2f}s")
+        self.retry_after = retry_after
+
+
+def tenant(event):
+    """Who a request is charged to: the source IP in the request context, which clients cannot set"""
+    source_ip = (((event or {}).get("requestContext") or {}).get("http") or {}).get("sourceIp")
+    return "ip:" + source_ip if source_ip else "anonymous"
+
+
+def _refill(tokens, updated_at, now, rate, burst):
+    return min(burst, tokens + max(0.0, now - updated_at) * rate)
+
+
+class LocalBucketStore:
+    """In-process stand-in for DynamoDBBucketStore"""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, want, rate, burst):
+        """Take up to want whole tokens; (granted, tokens left)"""
+        now = time.time()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (burst, now))
+            tokens = _refill(tokens, updated_at, now, rate, burst)
+            granted = min(want, int(tokens))
+            self._buckets[key] = (tokens - granted, now)
+            return granted, tokens - granted
+
+
+class DynamoDBBucketStore:
+    """Buckets as CACHE_TABLE items, updated with a conditional put on the previous UpdatedAt"""
+
+    def __init__(self, table_name):
+        self.table_name = table_name
+        self._table = None
+
+    @property
+    def table(self):
+        if self._table is None:
+            self._table = providers.get("dynamodb").Table(self.table_name)
+        return self._table
+
+    def take(self, key, want, rate, burst):
+        """Take up to want whole tokens; (granted, tokens left)"""
+        key = f"rate#{key}"
+        for _ in range(UPDATE_ATTEMPTS):
+            item = self.table.get_item(Key={"CacheKey": key}, ConsistentRead=True).get("Item")
+            now = time.time()
+            # Stored in thousandths so the values stay integers (boto3 wants Decimal for floats)
+            tokens = burst if item is None else _refill(int(item["Tokens"]) / 1000, int(item["UpdatedAt"]) / 1000,
+                                                        now, rate, burst)
+            granted = min(want, int(tokens))
+            if not granted and item is not None:
+                return 0, tokens
+            condition = {"ConditionExpression": "attribute_not_exists(CacheKey)"}
+            if item is not None:
+                condition = {"ConditionExpression": "attribute_not_exists(CacheKey) OR UpdatedAt = :updated",
+                             "ExpressionAttributeValues": {":updated": item["UpdatedAt"]}}
+            try:
+                self.table.put_item(Item={
+                    "CacheKey": key,
+                    "Tokens": int((tokens - granted) * 1000),
+                    "UpdatedAt": int(now * 1000),
+                    # A bucket left alone this long is full again, so the item can go
+                    "ExpiresAt": int(now + burst / rate + 60),
+                }, **condition)
+            except Exception as e:
+                if getattr(e, "response", {}).get("Error", {}).get("Code") == "ConditionalCheckFailedException":
+                    continue
+                raise
+            return granted, tokens - granted
+        return 0, 0.0
+
+
+def bucket_store():
+    """DynamoDBBucketStore when CACHE_TABLE is set, else LocalBucketStore (per container)"""
+    table_name = os.environ.get("CACHE_TABLE")
+    if table_name:
+        return DynamoDBBucketStore(table_name)
+    return LocalBucketStore()
+
+
+class Limiter:
+    """Token buckets per budget and tenant, with this container's leases in front of the store"""
+
+    def __init__(self, store, budgets=BUDGETS, lease=RATE_LIMIT_LEASE):
+        self.store = store
+        self.budgets = budgets
+        self.lease = lease
+        # key -> [tokens, expires_at]
+        self._leases = {}
+        # key -> time the shared bucket has a token again
+        self._blocked = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, budget, who, cost=1):
+        """Charge cost tokens to who's budget; Throttled if it cannot be paid"""
+        per_minute, burst = self.budgets[budget]
+        rate = per_minute / 60
+        # A request bigger than the burst could never pass; charge it the whole burst
+        cost = min(cost, burst)
+        key = f"{budget}#{who}"
+        now = time.time()
+        with self._lock:
+            tokens, expires_at = self._leases.get(key, (0, 0))
+            if expires_at <= now:
+                tokens = 0
+            if tokens >= cost:
+                self._leases[key] = [tokens - cost, expires_at]
+                return
+            blocked = self._blocked.get(key, 0)
+            if blocked > now:
+                raise Throttled(blocked - now)
+
+        want = max(cost - tokens, min(self.lease, max(1, burst // 4)))
+        try:
+            granted, left = self.store.take(key, want, rate, burst)
+        except Exception as e:
+            # Fail open: a store outage must not take the API down with it
+            log.warning("Rate limit store failed", budget=budget, error=str(e))
+            return
+
+        now = time.time()
+        with self._lock:
+            # Another thread may have spent or topped up the lease meanwhile
+            tokens, expires_at = self._leases.get(key, (0, 0))
+            tokens = (tokens if expires_at > now else 0) + granted
+            if tokens >= cost:
+                self._leases[key] = [tokens - cost, now + LEASE_TTL]
+                return
+            # Keep what was granted for the retry and wait for the rest
+            self._leases[key] = [tokens, now + LEASE_TTL]
+            # The shared bucket holds left (< 1) tokens and refills at rate
+            retry_after = (cost - tokens - left) / rate
+            self._blocked[key] = now + retry_after
+        raise Throttled(retry_after)
+
+
+class InFlight:
+    """Requests in progress per tenant in this process"""
+
+    def __init__(self, limit=RATE_LIMIT_MAX_IN_FLIGHT):
+        self.limit = limit
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def hold(self, who):
+        with self._lock:
+            if self._counts.get(who, 0) >= self.limit:
+                raise Throttled(1.0)
+            self._counts[who] = self._counts.get(who, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._counts[who] -= 1
+                if not self._counts[who]:
+                    del self._counts[who]
+
+
+limiter = Limiter(bucket_store())
+site_limiter = Limiter(bucket_store(), GLOBAL_BUDGETS)
+in_flight = InFlight()
+
+
+def charge(budget, who, cost=1):
+    """Charge cost tokens to who's bucket, then to the site-wide one; Throttled if either is empty"""
+    limiter.acquire(budget, who, cost)
+    site_limiter.acquire(budget, GLOBAL_TENANT, cost)
+
+
+def throttled_response(error, headers=None):
+    """429 with Retry-After for a Throttled error"""
+    return pipeline.error(429, "Rate limit exceeded, retry later", dict(headers or {}, **{
+        "Retry-After": str(math.ceil(error.retry_after)),
+    }), retry_after=round(error.retry_after, 2))
+
+
+def limit(budget, cost=None):
+    """Stage charging each request cost(request) tokens (1 by default) of the tenant's budget"""
+    def check_rate_limit(request):
+        # Async jobs were charged when they were submitted
+        if not RATE_LIMIT_ENABLED or request.event.get("job_id"):
+            return
+        who = tenant(request.event)
+        try:
+            charge(budget, who, cost(request) if cost else 1)
+        except Throttled as e:
+            metrics.count("Throttled")
+            log.warning("Rate limited", budget=budget, tenant=who, retry_after=round(e.retry_after, 2))
+            raise pipeline.Rejected(throttled_response(e, request.cors))
+    check_rate_limit.phase = "RateLimit"
+    return check_rate_limit
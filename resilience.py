@@ -0,0 +1,328 @@
+import asyncio
+import contextvars
+import os
+import random
+import threading
+import time
+
+import log
+import metrics
+
+# Deadlines, retries and circuit breakers for provider calls. call() runs one
+# SDK call with a timeout per attempt: OpenAI and Gemini get it as their own
+# timeout argument, Vertex AI image calls (which take none) run on a worker
+# thread that is abandoned when it passes. No attempt outlives the request's
+# deadline, which the pipeline sets from the Lambda's remaining time, capped
+# below API Gateway's 30 seconds on httpApi routes. Async jobs have nobody
+# waiting on a connection, so their attempts may take all the time the worker
+# has left instead of ATTEMPT_TIMEOUTS. Timeouts, connection errors, 429s and
+# 5xx are retried with exponential backoff and full jitter; anything else is
+# raised at once, and so is a timeout whose abandoned call is still running
+# (another attempt would pay for a second generation). Each provider has a circuit breaker that
+# opens after BREAKER_THRESHOLD retryable failures in a row and then fails
+# calls immediately with CircuitOpen, until BREAKER_COOLDOWN has passed and a
+# single trial call gets through.
+
+PROVIDER_MAX_ATTEMPTS = int(os.environ.get("PROVIDER_MAX_ATTEMPTS", "3"))
+# Seconds per attempt; Gemini Pro writes long answers and gets longer, an
+# Imagen call that has not answered in 20 seconds is stuck
+PROVIDER_TIMEOUT = float(os.environ.get("PROVIDER_TIMEOUT", "60"))
+IMAGE_PROVIDER_TIMEOUT = float(os.environ.get("IMAGE_PROVIDER_TIMEOUT", "20"))
+ATTEMPT_TIMEOUTS = {
+    "gemini-3-pro-preview": float(os.environ.get("PRO_PROVIDER_TIMEOUT", "600")),
+    "imagen-3.0-generate-001": IMAGE_PROVIDER_TIMEOUT,
+    "imagegeneration@006": IMAGE_PROVIDER_TIMEOUT,
+}
+# Full jitter: the nth retry waits uniform(0, min(cap, base * 2 ** (n - 1))) seconds
+PROVIDER_BACKOFF = float(os.environ.get("PROVIDER_BACKOFF", "0.5"))
+PROVIDER_BACKOFF_CAP = float(os.environ.get("PROVIDER_BACKOFF_CAP", "4"))
+# A retry needs at least this many seconds left before the deadline
+MIN_ATTEMPT_SECONDS = 1.0
+
+BREAKER_THRESHOLD = int(os.environ.get("BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(os.environ.get("BREAKER_COOLDOWN", "30"))
+
+# httpApi routes are cut off by API Gateway after 30 seconds
+API_GATEWAY_TIMEOUT = 30
+# Seconds kept back from the deadline to build and return the response
+DEADLINE_MARGIN = float(os.environ.get("DEADLINE_MARGIN", "1"))
+
+RETRYABLE_STATUS = (408, 429, 500, 502, 503, 504)
+# openai, httpx and google.api_core errors worth another attempt
+RETRYABLE_ERRORS = (
+    "APIConnectionError", "APITimeoutError", "RateLimitError", "InternalServerError",
+    "ConnectError", "ConnectTimeout", "ReadTimeout", "RemoteProtocolError",
+    "ServiceUnavailable", "DeadlineExceeded", "TooManyRequests", "ResourceExhausted",
+    "BadGateway", "GatewayTimeout",
+)
+
+
+class CircuitOpen(Exception):
+    """The provider's breaker is open; retry after retry_after seconds"""
+
+    def __init__(self, provider, retry_after):
+        super().__init__(f"{provider} is unavailable, retry after {retry_after:.0f}s")
+        self.provider = provider
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(TimeoutError):
+    """No time left for (another) attempt before the request's deadline"""
+
+
+class Abandoned(DeadlineExceeded):
+    """An attempt timed out while its call goes on running on its worker thread"""
+
+    def __init__(self, message, thread):
+        super().__init__(message)
+        self.thread = thread
+
+
+def provider_of(model_name):
+    """Breaker name for a model: openai, gemini or vertex"""
+    if model_name.startswith(("gpt-", "dall-e", "o1", "o3")):
+        return "openai"
+    if model_name.startswith("gemini"):
+        return "gemini"
+    return "vertex"
+
+
+def status_code(error):
+    """HTTP status carried by an SDK error, if any"""
+    for name in ("status_code", "code"):
+        value = getattr(error, name, None)
+        if isinstance(value, int) and 100 <= value < 600:
+            return value
+    return None
+
+
+def retryable(error):
+    if isinstance(error, CircuitOpen):
+        return False
+    if isinstance(error, (TimeoutError, ConnectionError, asyncio.TimeoutError)):
+        return True
+    code = status_code(error)
+    if code is not None:
+        return code in RETRYABLE_STATUS
+    return any(cls.__name__ in RETRYABLE_ERRORS for cls in type(error).__mro__)
+
+
+def timed_out(error):
+    return isinstance(error, (TimeoutError, asyncio.TimeoutError)) or status_code(error) in (408, 504) or \
+        any(cls.__name__ in ("APITimeoutError", "ConnectTimeout", "ReadTimeout", "DeadlineExceeded",
+                             "GatewayTimeout") for cls in type(error).__mro__)
+
+
+def degraded(error):
+    """True if error says the provider is down or slow (not that the request was bad)"""
+    return isinstance(error, CircuitOpen) or retryable(error)
+
+
+def status(error):
+    """HTTP status for a failed provider call: 504 slow, 503 down or throttling, else 500"""
+    if isinstance(error, CircuitOpen):
+        return 503
+    if timed_out(error):
+        return 504
+    return 503 if retryable(error) else 500
+
+
+class CircuitBreaker:
+    """Closed, then open after threshold failures in a row, then one trial call per cooldown"""
+
+    def __init__(self, name, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_at = None
+        self.opened = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Raise CircuitOpen unless a call may go through now"""
+        with self._lock:
+            if self.state == "closed":
+                return
+            now = time.monotonic()
+            # A trial that never came back stops counting after a cooldown
+            if self.trial_at is None or now - self.trial_at >= self.cooldown:
+                if self.state == "half_open" or now - self.opened_at >= self.cooldown:
+                    self.state = "half_open"
+                    self.trial_at = now
+                    return
+            self.rejected += 1
+            retry_after = max(1.0, self.opened_at + self.cooldown - now)
+        metrics.count("CircuitOpen")
+        raise CircuitOpen(self.name, retry_after)
+
+    def success(self):
+        with self._lock:
+            if self.state != "closed":
+                log.info("Circuit closed", provider=self.name)
+            self.state = "closed"
+            self.failures = 0
+            self.trial_at = None
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= self.threshold):
+                if self.state == "closed":
+                    log.warning("Circuit opened", provider=self.name, failures=self.failures)
+                    self.opened += 1
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self.trial_at = None
+
+    def stats(self):
+        return {"state": self.state, "failures": self.failures, "opened": self.opened, "rejected": self.rejected}
+
+
+breakers = {name: CircuitBreaker(name) for name in ("openai", "gemini", "vertex")}
+
+_local = threading.local()
+
+
+def begin(event=None, context=None):
+    """Set this thread's request deadline from the Lambda context and the route"""
+    budgets = []
+    if context is not None and hasattr(context, "get_remaining_time_in_millis"):
+        budgets.append(context.get_remaining_time_in_millis() / 1000)
+    domain = ((event or {}).get("requestContext") or {}).get("domainName") or ""
+    # Async jobs run the same event from the worker, which has no gateway in front of it
+    job = bool((event or {}).get("job_id"))
+    if ".execute-api." in domain and not job:
+        budgets.append(API_GATEWAY_TIMEOUT)
+    _local.deadline = time.monotonic() + min(budgets) - DEADLINE_MARGIN if budgets else None
+    _local.job = job
+
+
+def remaining():
+    """Seconds left before this thread's request deadline, or None without one"""
+    deadline = getattr(_local, "deadline", None)
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def bind(function):
+    """function, run with the calling thread's deadline and metrics record (for worker threads)"""
+    deadline = getattr(_local, "deadline", None)
+    job = getattr(_local, "job", False)
+    context = contextvars.copy_context()
+
+    def bound(*args, **kwargs):
+        _local.deadline, _local.job = deadline, job
+        try:
+            # A copy per call: several workers may run it at once
+            return context.copy().run(function, *args, **kwargs)
+        finally:
+            _local.deadline, _local.job = None, False
+    return bound
+
+
+def _timeout(model_name):
+    """Seconds the next attempt may take; DeadlineExceeded if the deadline has passed"""
+    timeout = ATTEMPT_TIMEOUTS.get(model_name, PROVIDER_TIMEOUT)
+    left = remaining()
+    if left is None:
+        return timeout
+    if left <= 0:
+        raise DeadlineExceeded(f"No time left to call {model_name}")
+    if getattr(_local, "job", False):
+        return left
+    return min(timeout, left)
+
+
+def _arguments(provider, kwargs, timeout):
+    """kwargs with the per-attempt timeout in the form the provider's SDK takes it"""
+    if provider == "openai":
+        return dict(kwargs, timeout=timeout)
+    if provider == "gemini":
+        return dict(kwargs, request_options=dict(kwargs.get("request_options") or {}, timeout=timeout))
+    return kwargs
+
+
+def _run_bounded(function, timeout, args, kwargs):
+    """function(*args, **kwargs) on its own thread, waited on for at most timeout seconds"""
+    outcome = {}
+
+    def target():
+        try:
+            outcome["result"] = function(*args, **kwargs)
+        except BaseException as e:
+            outcome["error"] = e
+
+    # A thread per call, not a pool: a call that hangs keeps its thread until
+    # it returns, and must not leave later calls queued behind it
+    thread = threading.Thread(target=contextvars.copy_context().run, args=(target,), name="provider-call",
+                              daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        raise Abandoned(f"No answer within {timeout:.1f} seconds", thread)
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["result"]
+
+
+def _retry_delay(breaker, model_name, number, attempts, error):
+    """Seconds to wait before attempt number + 1 after error; re-raise error when it is final"""
+    if not retryable(error):
+        # The provider answered: a bad request says nothing about its health
+        breaker.success()
+        raise error
+    breaker.failure()
+    delay = random.uniform(0, min(PROVIDER_BACKOFF_CAP, PROVIDER_BACKOFF * 2 ** (number - 1)))
+    left = remaining()
+    if number >= attempts or (left is not None and left < delay + MIN_ATTEMPT_SECONDS):
+        raise error
+    if isinstance(error, Abandoned) and error.thread.is_alive():
+        # Still generating, and billed: a second call would cost as much again
+        raise error
+    log.warning("Provider call failed, retrying", model=model_name, attempt=number, delay=round(delay, 2),
+                error=str(error))
+    metrics.count("ProviderRetries")
+    return delay
+
+
+def call(model_name, function, *args, attempts=None, **kwargs):
+    """function(*args, **kwargs) against model_name's provider, with a timeout, retries and its breaker"""
+    attempts = attempts or PROVIDER_MAX_ATTEMPTS
+    provider = provider_of(model_name)
+    breaker = breakers[provider]
+    for number in range(1, attempts + 1):
+        breaker.allow()
+        timeout = _timeout(model_name)
+        try:
+            if provider == "vertex":
+                result = _run_bounded(function, timeout, args, kwargs)
+            else:
+                result = function(*args, **_arguments(provider, kwargs, timeout))
+        except Exception as e:
+            time.sleep(_retry_delay(breaker, model_name, number, attempts, e))
+            continue
+        breaker.success()
+        return result
+
+
+async def acall(model_name, function, *args, attempts=1, **kwargs):
+    """Async call() for coroutine functions; one attempt by default, as hedging and compare race instead"""
+    provider = provider_of(model_name)
+    breaker = breakers[provider]
+    for number in range(1, attempts + 1):
+        breaker.allow()
+        timeout = _timeout(model_name)
+        try:
+            result = await asyncio.wait_for(function(*args, **_arguments(provider, kwargs, timeout)), timeout)
+        except Exception as e:
+            await asyncio.sleep(_retry_delay(breaker, model_name, number, attempts, e))
+            continue
+        breaker.success()
+        return result
+
+
+def stats():
+    return {name: breaker.stats() for name, breaker in breakers.items()}
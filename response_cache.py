@@ -0,0 +1,73 @@
+import hashlib
+import json
+import os
+
+import log
+import stores
+from cache import TTLCache
+
+# Chat responses keyed by normalized prompt, model and generation config. The
+# first tier is an LRU inside the container; the optional second tier is the
+# shared store (DynamoDB in AWS) so other containers can reuse answers too.
+
+RESPONSE_CACHE_TTL = int(os.environ.get("RESPONSE_CACHE_TTL", "3600"))
+
+
+def normalize_prompt(prompt):
+    """Collapse whitespace so trivially different copies share an entry"""
+    return " ".join(prompt.split()) if isinstance(prompt, str) else prompt
+
+
+def cache_key(prompt, model, generation_config=None, system=None):
+    parts = [model, normalize_prompt(prompt), generation_config or {}]
+    if system:
+        # Answers written for one user's business are not reused for another
+        parts.append(system)
+    payload = json.dumps(parts, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+
+    def __init__(self, local, shared=None, ttl=RESPONSE_CACHE_TTL):
+        self.local = local
+        self.shared = shared
+        self.ttl = ttl
+
+    def get(self, key):
+        text = self.local.get(key)
+        if text is not None or self.shared is None:
+            return text
+        try:
+            text = self.shared.get(key)
+        except Exception as e:
+            log.warning("Response cache shared tier read failed", error=str(e))
+            return None
+        if text is not None:
+            self.local.set(key, text)
+        return text
+
+    def put(self, key, text):
+        self.local.set(key, text)
+        if self.shared is None:
+            return
+        try:
+            self.shared.put(key, text, ttl=self.ttl)
+        except Exception as e:
+            log.warning("Response cache shared tier write failed", error=str(e))
+
+
+responses = ResponseCache(
+    TTLCache(
+        max_entries=int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "256")),
+        max_bytes=int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", str(16 * 1024 * 1024))),
+        ttl=RESPONSE_CACHE_TTL,
+    ),
+    shared=stores.shared_store("response"),
+)
+
+
+def bypass_requested(event_headers):
+    """Clients can force a fresh answer with Cache-Control: no-cache"""
+    cache_control = (event_headers or {}).get("cache-control", "")
+    return "no-cache" in cache_control or "no-store" in cache_control
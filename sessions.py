@@ -0,0 +1,294 @@
+import os
+import re
+import threading
+import time
+import uuid
+
+import chat_backends
+import context_cache
+import log
+import metrics
+import model_catalog
+import providers
+import tokens
+from cache import TTLCache
+
+# Multi-turn chat sessions. History lives in the SESSIONS_TABLE table as one
+# item per turn (partition key SessionID, sort key Turn), so a turn appends a
+# single item instead of rewriting the conversation; item 0 holds the summary
+# of the turns that were compacted away. Containers keep the sessions they
+# served in an LRU and only read DynamoDB on a miss or when another container
+# has written the turn they were about to write (the put is conditional).
+# Once the history passes SESSION_TOKEN_BUDGET the oldest turns are folded
+# into the summary (or just dropped, a sliding window), so what is sent to the
+# model stays about the same size however long the conversation gets.
+
+SESSION_TOKEN_BUDGET = int(os.environ.get("SESSION_TOKEN_BUDGET", "4000"))
+# Compaction keeps this share of the budget, so it does not run every turn
+SESSION_KEEP_FRACTION = float(os.environ.get("SESSION_KEEP_FRACTION", "0.5"))
+SESSION_SUMMARIZE = os.environ.get("SESSION_SUMMARIZE", "true").lower() == "true"
+SESSION_SUMMARY_MODEL = os.environ.get("SESSION_SUMMARY_MODEL", "gemini-2.0-flash")
+SESSION_TTL = int(os.environ.get("SESSION_TTL", str(7 * 24 * 3600)))
+
+SESSION_MODELS = ("gemini-2.0-flash", "gpt-4o")
+DEFAULT_MODEL = "gemini-2.0-flash"
+SESSION_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{8,128}$')
+
+SUMMARY_GENERATION_CONFIG = {
+    "max_output_tokens": 512,
+    "temperature": 0.2,
+}
+
+
+class Conflict(Exception):
+    """Another request wrote the same turn of the session first"""
+
+
+class Session:
+    """Summary of the compacted turns plus the turns after it"""
+
+    def __init__(self, session_id, summary="", through=0, turns=None):
+        self.session_id = session_id
+        self.summary = summary
+        # Last turn folded into the summary
+        self.through = through
+        # (turn, user message, assistant answer), oldest first
+        self.turns = turns or []
+
+    @property
+    def next_turn(self):
+        return (self.turns[-1][0] if self.turns else self.through) + 1
+
+    def history_tokens(self):
+        return tokens.estimate_tokens(self.summary) + \
+            sum(tokens.estimate_tokens(user) + tokens.estimate_tokens(assistant) for _, user, assistant in self.turns)
+
+
+def _conditional_check_failed(error):
+    return getattr(error, "response", {}).get("Error", {}).get("Code") == "ConditionalCheckFailedException"
+
+
+class LocalSessionStore:
+    """In-process stand-in for DynamoDBSessionStore"""
+
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def load(self, session_id):
+        with self._lock:
+            summary, through, turns = self._sessions.get(session_id, ("", 0, {}))
+            return Session(session_id, summary, through,
+                           [(turn, *turns[turn]) for turn in sorted(turns) if turn > through])
+
+    def append(self, session_id, turn, user, assistant, model_name):
+        with self._lock:
+            summary, through, turns = self._sessions.setdefault(session_id, ("", 0, {}))
+            if turn in turns:
+                raise Conflict(session_id)
+            turns[turn] = (user, assistant)
+
+    def save_summary(self, session_id, summary, through):
+        with self._lock:
+            _, _, turns = self._sessions.setdefault(session_id, ("", 0, {}))
+            self._sessions[session_id] = (summary, through, turns)
+
+
+class DynamoDBSessionStore:
+    """One item per turn in a DynamoDB table, expired through its TTL attribute"""
+
+    def __init__(self, table_name, ttl=SESSION_TTL):
+        self.table_name = table_name
+        self.ttl = ttl
+        self._table = None
+
+    @property
+    def table(self):
+        if self._table is None:
+            self._table = providers.get("dynamodb").Table(self.table_name)
+        return self._table
+
+    def load(self, session_id):
+        item = self.table.get_item(Key={"SessionID": session_id, "Turn": 0}).get("Item") or {}
+        through = int(item.get("Through", 0))
+        turns = []
+        query = {
+            "KeyConditionExpression": "SessionID = :session AND #turn > :through",
+            "ExpressionAttributeNames": {"#turn": "Turn"},
+            "ExpressionAttributeValues": {":session": session_id, ":through": through},
+        }
+        while True:
+            page = self.table.query(**query)
+            turns += [(int(row["Turn"]), row["User"], row["Assistant"]) for row in page.get("Items", [])]
+            if "LastEvaluatedKey" not in page:
+                break
+            query["ExclusiveStartKey"] = page["LastEvaluatedKey"]
+        return Session(session_id, item.get("Summary", ""), through, turns)
+
+    def append(self, session_id, turn, user, assistant, model_name):
+        try:
+            self.table.put_item(Item={
+                "SessionID": session_id,
+                "Turn": turn,
+                "User": user,
+                "Assistant": assistant,
+                "Model": model_name,
+                "ExpiresAt": int(time.time() + self.ttl),
+            }, ConditionExpression="attribute_not_exists(SessionID)")
+        except Exception as e:
+            if _conditional_check_failed(e):
+                raise Conflict(session_id)
+            raise
+
+    def save_summary(self, session_id, summary, through):
+        self.table.put_item(Item={
+            "SessionID": session_id,
+            "Turn": 0,
+            "Summary": summary,
+            "Through": through,
+            "ExpiresAt": int(time.time() + self.ttl),
+        })
+
+
+def session_store():
+    """DynamoDBSessionStore when SESSIONS_TABLE is set, LocalSessionStore when CACHE_STORE=local, else None"""
+    table_name = os.environ.get("SESSIONS_TABLE")
+    if table_name:
+        return DynamoDBSessionStore(table_name)
+    if os.environ.get("CACHE_STORE") == "local":
+        return LocalSessionStore()
+    return None
+
+
+store = session_store()
+# Sessions served by this container, newest turns included
+recent = TTLCache(max_entries=int(os.environ.get("SESSION_CACHE_MAX_ENTRIES", "256")),
+                  ttl=int(os.environ.get("SESSION_CACHE_TTL", "1800")))
+
+
+def options(request_data):
+    """Session ID (a new one if none was sent) and model; ValueError if invalid"""
+    session_id = request_data.get("session_id")
+    new = session_id is None
+    if new:
+        session_id = uuid.uuid4().hex
+    elif not isinstance(session_id, str) or not SESSION_ID_PATTERN.match(session_id):
+        raise ValueError("session_id must be 8-128 letters, digits, '-' or '_'")
+    model_name = request_data.get("model", DEFAULT_MODEL)
+    if model_name not in SESSION_MODELS:
+        raise ValueError(f"model must be one of {', '.join(SESSION_MODELS)}")
+    return {"session_id": session_id, "model": model_name, "new": new}
+
+
+def load(session_id, fresh=False, new=False):
+    """Session from this container's LRU, or from the store; new sessions start empty without a read"""
+    if new:
+        session = Session(session_id)
+        recent.set(session_id, session, size=1)
+        return session
+    session = None if fresh else recent.get(session_id)
+    metrics.count("SessionCacheHit", int(session is not None))
+    if session is None:
+        with metrics.phase("Session"):
+            session = store.load(session_id)
+        recent.set(session_id, session, size=1)
+    return session
+
+
+def _summarize(summary, turns):
+    transcript = "\n".join(f"User: {user}\nAssistant: {assistant}" for _, user, assistant in turns)
+    prompt = ("Update the summary of this conversation with the new exchanges. Keep names, facts, "
+              "decisions and open questions; drop small talk. Answer with the summary only.\n\n"
+              f"Summary so far:\n{summary or '(none)'}\n\nNew exchanges:\n{transcript}")
+    response = context_cache.generate_content(SESSION_SUMMARY_MODEL, prompt,
+                                              generation_config=SUMMARY_GENERATION_CONFIG)
+    metrics.usage(response)
+    return response.text.strip()
+
+
+def compact(session, budget=SESSION_TOKEN_BUDGET):
+    """Fold the oldest turns into the summary once the history passes budget; True if it did"""
+    if session.history_tokens() <= budget:
+        return False
+    keep = budget * SESSION_KEEP_FRACTION
+    dropped = []
+    while session.turns and session.history_tokens() > keep:
+        dropped.append(session.turns.pop(0))
+    if not dropped:
+        return False
+
+    summary = session.summary
+    if SESSION_SUMMARIZE:
+        try:
+            with metrics.phase("Summarize"):
+                summary = _summarize(session.summary, dropped)
+        except Exception as e:
+            # Fall back to the sliding window: the dropped turns are just gone
+            log.warning("Session summary failed", session_id=session.session_id, error=str(e))
+    session.summary = summary
+    session.through = dropped[-1][0]
+    with metrics.phase("Session"):
+        store.save_summary(session.session_id, session.summary, session.through)
+    metrics.count("SessionCompactions")
+    log.info("Session compacted", session_id=session.session_id, dropped_turns=len(dropped),
+             through=session.through, history_tokens=session.history_tokens())
+    return True
+
+
+def _system(system, summary):
+    if not summary:
+        return system
+    earlier = f"Summary of the earlier conversation:\n{summary}"
+    return f"{system}\n\n{earlier}" if system else earlier
+
+
+def _ask(model_name, session, message, system):
+    system = _system(system, session.summary)
+    if model_name == "gpt-4o":
+        messages = [("system", system)] if system else []
+        for _, user, assistant in session.turns:
+            messages += [("human", user), ("ai", assistant)]
+        messages.append(("human", message))
+        msg = chat_backends.invoke(messages, system)
+        metrics.usage(msg)
+        return msg.content
+
+    contents = []
+    for _, user, assistant in session.turns:
+        contents += [{"role": "user", "parts": [user]}, {"role": "model", "parts": [assistant]}]
+    contents.append({"role": "user", "parts": [message]})
+    response = context_cache.generate_content(model_catalog.resolve(model_name), contents, system,
+                                              generation_config=chat_backends.GEMINI_GENERATION_CONFIG)
+    metrics.usage(response)
+    return response.text
+
+
+def turn(session_id, message, model_name=DEFAULT_MODEL, system=None, new=False):
+    """Answer message in the session and append the turn; Conflict if another request keeps winning"""
+    fresh = False
+    for _ in range(2):
+        session = load(session_id, fresh, new and not fresh)
+        compacted = compact(session)
+        metrics.count("HistoryTokens", session.history_tokens())
+        with metrics.phase("Provider"):
+            answer = _ask(model_name, session, message, system)
+        number = session.next_turn
+        try:
+            with metrics.phase("Session"):
+                store.append(session_id, number, message, answer, model_name)
+        except Conflict:
+            # This container's copy is behind: reload and answer with the full history
+            log.warning("Session turn conflict", session_id=session_id, turn=number)
+            recent.pop(session_id)
+            fresh = True
+            continue
+        session.turns.append((number, message, answer))
+        return {
+            "session_id": session_id,
+            "turn": number,
+            "answer": answer,
+            "model": model_name,
+            "history_tokens": session.history_tokens(),
+            "compacted": compacted,
+        }
+    raise Conflict(session_id)
@@ -0,0 +1,144 @@
+import os
+import threading
+import time
+from concurrent.futures import Future, wait
+
+import log
+import metrics
+import resilience
+import stores
+
+# Single-flight calls: identical requests that arrive while one is in flight
+# wait for its result instead of starting their own provider call. Inside a
+# container the first caller for a key runs compute() and the rest wait on
+# its future. Across containers that caller also takes a short lease on the
+# key in the shared store (the CACHE_TABLE table in AWS); whoever holds the
+# lease calls the provider and writes share(result) onto the lease item, and
+# the other containers poll the item until it is done, then rebuild the result
+# with load(). A leader that fails deletes its lease, and one that dies lets
+# it expire, so a waiting container takes over. Each caller served this way
+# counts as a saved provider call in the Coalesced metric.
+
+SINGLE_FLIGHT_ENABLED = os.environ.get("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+# Seconds a lease is held; a container that dies mid-call blocks others this long at most
+SINGLE_FLIGHT_LEASE = int(os.environ.get("SINGLE_FLIGHT_LEASE", "30"))
+# Seconds a finished result stays on the lease item for callers that arrive late
+SINGLE_FLIGHT_RESULT_TTL = int(os.environ.get("SINGLE_FLIGHT_RESULT_TTL", "10"))
+# Seconds between reads of another container's lease
+SINGLE_FLIGHT_POLL = float(os.environ.get("SINGLE_FLIGHT_POLL", "0.25"))
+
+
+class Flights:
+    """Calls in flight by key, in this container and (with a lease store) across containers"""
+
+    def __init__(self, leases=None):
+        self.leases = leases
+        self._futures = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.local = 0
+        self.remote = 0
+
+    def run(self, key, compute, share=None, load=None):
+        """(result, coalesced): compute() once for all concurrent callers with key
+
+        share(result) is what other containers receive, load(shared) turns it
+        back into a result (None to compute after all); without share the call
+        is only coalesced inside this container. A key of None runs compute()
+        on its own.
+        """
+        if key is None or not SINGLE_FLIGHT_ENABLED:
+            return compute(), False
+        with self._lock:
+            future = self._futures.get(key)
+            leader = future is None
+            if leader:
+                future = self._futures[key] = Future()
+        if not leader:
+            result = self._follow(future)
+            self._tally("local")
+            metrics.count("Coalesced")
+            return result, True
+        try:
+            result, coalesced = self._lead(key, compute, share, load)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._futures.pop(key, None)
+        future.set_result(result)
+        metrics.count("Coalesced", int(coalesced))
+        return result, coalesced
+
+    def _follow(self, future):
+        """The result of this container's call in flight, waited on until the request's deadline"""
+        with metrics.phase("Coalesce"):
+            left = resilience.remaining()
+            done, _ = wait([future], timeout=None if left is None else max(0.0, left))
+        if not done:
+            raise resilience.DeadlineExceeded("No time left waiting for an identical request")
+        return future.result()
+
+    def _lead(self, key, compute, share, load):
+        """compute() under key's lease, or the result of the container holding it"""
+        if self.leases is None or share is None:
+            return self._compute(compute), False
+        leased = False
+        until = time.monotonic() + SINGLE_FLIGHT_LEASE
+        left = resilience.remaining()
+        if left is not None:
+            until = min(until, time.monotonic() + left)
+        with metrics.phase("Coalesce"):
+            try:
+                while time.monotonic() < until:
+                    if self.leases.add(key, {"state": "running"}, ttl=SINGLE_FLIGHT_LEASE):
+                        leased = True
+                        break
+                    item = self.leases.get(key)
+                    while item is not None and item.get("state") == "running" and time.monotonic() < until:
+                        time.sleep(SINGLE_FLIGHT_POLL)
+                        item = self.leases.get(key)
+                    if item is not None and item.get("state") == "done":
+                        result = load(item["value"]) if load else item["value"]
+                        if result is not None:
+                            self._tally("remote")
+                            return result, True
+                        break
+                    # Gone: the leader failed, so try to take over
+            except Exception as e:
+                # Fail open: without the lease each container calls the provider itself
+                log.warning("Single-flight lease failed", error=str(e))
+        if not leased:
+            return self._compute(compute), False
+        try:
+            result = self._compute(compute)
+        except BaseException:
+            self._release(key)
+            raise
+        try:
+            self.leases.put(key, {"state": "done", "value": share(result)}, ttl=SINGLE_FLIGHT_RESULT_TTL)
+        except Exception as e:
+            log.warning("Single-flight result write failed", error=str(e))
+            self._release(key)
+        return result, False
+
+    def _compute(self, compute):
+        self._tally("calls")
+        return compute()
+
+    def _tally(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _release(self, key):
+        try:
+            self.leases.delete(key)
+        except Exception as e:
+            log.warning("Single-flight lease release failed", error=str(e))
+
+    def stats(self):
+        return {"calls": self.calls, "local": self.local, "remote": self.remote, "in_flight": len(self._futures)}
+
+
+flights = Flights(stores.shared_store("flight"))
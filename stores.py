@@ -0,0 +1,197 @@
+import json
+import os
+import threading
+import time
+
+import providers
+
+# Shared key-value stores that outlive a single container. DynamoDBStore keeps
+# items in the CACHE_TABLE table (partition key CacheKey, TTL attribute
+# ExpiresAt); LocalStore is an in-process stand-in for offline runs. Keys are
+# prefixed with a namespace so several features can share one table.
+
+
+class LocalStore:
+    """In-process stand-in for DynamoDBStore"""
+
+    def __init__(self, namespace=""):
+        self.namespace = namespace
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def _key(self, key):
+        return f"{self.namespace}#{key}" if self.namespace else key
+
+    def get(self, key):
+        item = self._items.get(self._key(key))
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.time():
+            self.delete(key)
+            return None
+        return value
+
+    def put(self, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._items[self._key(key)] = (value, expires_at)
+
+    def add(self, key, value, ttl=None):
+        """put() unless key holds an item that has not expired; True if it did"""
+        now = time.time()
+        with self._lock:
+            item = self._items.get(self._key(key))
+            if item is not None and (item[1] is None or item[1] > now):
+                return False
+            self._items[self._key(key)] = (value, now + ttl if ttl else None)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(self._key(key), None)
+
+
+class DynamoDBStore:
+    """JSON values in a DynamoDB table, expired through its TTL attribute"""
+
+    def __init__(self, table_name, namespace=""):
+        self.table_name = table_name
+        self.namespace = namespace
+        self._table = None
+
+    @property
+    def table(self):
+        if self._table is None:
+            self._table = providers.get("dynamodb").Table(self.table_name)
+        return self._table
+
+    def _key(self, key):
+        return f"{self.namespace}#{key}" if self.namespace else key
+
+    def get(self, key):
+        item = self.table.get_item(Key={"CacheKey": self._key(key)}).get("Item")
+        if item is None:
+            return None
+        # DynamoDB deletes expired items lazily, so check the TTL ourselves
+        expires_at = item.get("ExpiresAt")
+        if expires_at is not None and int(expires_at) <= time.time():
+            return None
+        return json.loads(item["Value"])
+
+    def put(self, key, value, ttl=None):
+        item = {"CacheKey": self._key(key), "Value": json.dumps(value)}
+        if ttl:
+            item["ExpiresAt"] = int(time.time() + ttl)
+        self.table.put_item(Item=item)
+
+    def add(self, key, value, ttl=None):
+        """put() unless key holds an item that has not expired; True if it did"""
+        now = int(time.time())
+        item = {"CacheKey": self._key(key), "Value": json.dumps(value)}
+        if ttl:
+            item["ExpiresAt"] = now + ttl
+        try:
+            self.table.put_item(Item=item, ConditionExpression="attribute_not_exists(CacheKey) OR ExpiresAt <= :now",
+                                ExpressionAttributeValues={":now": now})
+        except Exception as e:
+            if getattr(e, "response", {}).get("Error", {}).get("Code") == "ConditionalCheckFailedException":
+                return False
+            raise
+        return True
+
+    def delete(self, key):
+        self.table.delete_item(Key={"CacheKey": self._key(key)})
+
+
+def shared_store(namespace):
+    """DynamoDBStore when CACHE_TABLE is set, LocalStore when CACHE_STORE=local, else None"""
+    table_name = os.environ.get("CACHE_TABLE")
+    if table_name:
+        return DynamoDBStore(table_name, namespace)
+    if os.environ.get("CACHE_STORE") == "local":
+        return LocalStore(namespace)
+    return None
+
+
+# Blob stores hold large values (generated images) by key. S3BlobStore is used
+# in AWS; FileBlobStore is the filesystem stand-in for offline runs.
+
+
+class FileBlobStore:
+    """Blobs as files under a local directory"""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, key)
+
+    def put(self, key, data, content_type="application/octet-stream"):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def url(self, key, expires_in=3600):
+        return "file://" + os.path.abspath(self._path(key))
+
+
+class S3BlobStore:
+    """Blobs as objects in an S3 bucket, shared through presigned URLs"""
+
+    def __init__(self, bucket, prefix=""):
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def _key(self, key):
+        return f"{self.prefix}{key}"
+
+    def put(self, key, data, content_type="application/octet-stream"):
+        # botocore rejects memoryviews, so encoder buffers are copied once here
+        body = data if isinstance(data, (bytes, bytearray)) else bytes(data)
+        providers.get("s3").put_object(Bucket=self.bucket, Key=self._key(key), Body=body,
+                                       ContentType=content_type)
+
+    def get(self, key):
+        s3 = providers.get("s3")
+        try:
+            return s3.get_object(Bucket=self.bucket, Key=self._key(key))["Body"].read()
+        except s3.exceptions.NoSuchKey:
+            return None
+
+    def delete(self, key):
+        providers.get("s3").delete_object(Bucket=self.bucket, Key=self._key(key))
+
+    def url(self, key, expires_in=3600):
+        return providers.get("s3").generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": self._key(key)},
+            ExpiresIn=expires_in,
+        )
+
+
+def blob_store(prefix):
+    """S3BlobStore when IMAGE_CACHE_BUCKET is set, FileBlobStore when IMAGE_CACHE_DIR is set, else None"""
+    bucket = os.environ.get("IMAGE_CACHE_BUCKET")
+    if bucket:
+        return S3BlobStore(bucket, prefix=f"{prefix}/")
+    directory = os.environ.get("IMAGE_CACHE_DIR")
+    if directory:
+        return FileBlobStore(os.path.join(directory, prefix))
+    return None
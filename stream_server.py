@@ -0,0 +1,161 @@
+import json
+import math
+import os
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import log
+import metrics
+import pipeline
+import profiles
+import ratelimit
+import streaming
+import token_budget
+from conf import api_secret_key, server_api_key
+
+# HTTP server for the streaming Gemini Pro function. The Python Lambda runtime
+# cannot stream responses itself, so this runs behind the AWS Lambda Web
+# Adapter (see Dockerfile.stream) with the function URL in RESPONSE_STREAM mode
+# and writes each chunk to the client as soon as Gemini produces it.
+
+HEALTH_PATH = os.environ.get("AWS_LWA_READINESS_CHECK_PATH", "/healthz")
+
+# The same stages as gemini_pro_chat, split around the rate limit
+STAGES = (pipeline.api_key(api_secret_key), pipeline.parse_body, pipeline.prompt())
+ANSWER_STAGES = (profiles.identity(server_api_key),
+                 token_budget.budget("gemini_pro_chat", streaming.PRO_MODEL))
+
+
+class StreamingChatHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode("utf-8")
+        self.status = status
+        self.send_response(status)
+        # CORS is handled by Lambda Function URL config (serverless.yml)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_response(self, response):
+        """Send a finished pipeline response, e.g. a stage's rejection"""
+        payload = (response.get("body") or "").encode("utf-8")
+        self.status = response["statusCode"]
+        self.send_response(self.status)
+        for name, value in (response.get("headers") or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_request(self, code="-", size="-"):
+        """Access lines go through log.py with the other records; the adapter's health checks are left out"""
+        if self.path != HEALTH_PATH:
+            log.info("HTTP request", method=self.command, path=self.path, status=getattr(code, "value", code))
+
+    def log_message(self, format, *args):
+        # Only errors get here (e.g. a malformed request), outside any POST that would flush them
+        log.warning("HTTP server error", error=format % args, client=self.client_address[0])
+        log.flush()
+
+    def do_GET(self):
+        if self.path == HEALTH_PATH:
+            self._send_json(200, {"status": "ok"})
+        else:
+            self._send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        metrics.start("gemini_pro_chat_stream")
+        self.status = 200
+        try:
+            self._stream_chat()
+        finally:
+            metrics.finish(self.status)
+            log.flush()
+
+    def _stream_chat(self):
+        length = int(self.headers.get("content-length") or 0)
+        # The Lambda Web Adapter passes the Function URL's request context (with the source IP) as a header
+        request_context = pipeline.loads(self.headers.get("x-amzn-request-context") or "{}")
+        request = pipeline.Request({"headers": self.headers, "body": self.rfile.read(length) or b"{}",
+                                    "requestContext": request_context})
+        try:
+            pipeline.run_stages(request, STAGES)
+        except pipeline.Rejected as e:
+            log.info("Request rejected", handler="gemini_pro_chat_stream", status=e.response.get("statusCode"))
+            self._send_response(e.response)
+            return
+
+        # Same text budget as gemini_pro_chat, plus a cap on each tenant's streams in flight
+        who = ratelimit.tenant(request.event)
+        try:
+            if not ratelimit.RATE_LIMIT_ENABLED:
+                return self._answer(request)
+            ratelimit.charge("text", who)
+            with ratelimit.in_flight.hold(who):
+                self._answer(request)
+        except ratelimit.Throttled as e:
+            metrics.count("Throttled")
+            log.warning("Rate limited", budget="text", tenant=who, retry_after=round(e.retry_after, 2))
+            self._send_json(429, {"error": "Rate limit exceeded, retry later", "retry_after": round(e.retry_after, 2)},
+                            {"Retry-After": str(math.ceil(e.retry_after))})
+
+    def _answer(self, request):
+        # The profile context and the token budget, as gemini_pro_chat gets them
+        try:
+            pipeline.run_stages(request, ANSWER_STAGES)
+        except pipeline.Rejected as e:
+            self._send_response(e.response)
+            return
+        body = request.data
+        prompt = body["prompt"]
+        system = request.system
+        generation_config = dict(streaming.PRO_GENERATION_CONFIG,
+                                 max_output_tokens=request.budget.max_output_tokens)
+
+        sse = "text/event-stream" in self.headers.get("accept", "") or body.get("format") == "sse"
+        log.info("Streaming prompt with Gemini Pro", framing="sse" if sse else "chunked text", prompt_chars=len(prompt))
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream" if sse else "text/plain; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        for name, value in request.budget.headers().items():
+            self.send_header(name, value)
+        self.end_headers()
+
+        metrics.model(streaming.PRO_MODEL)
+        start = time.perf_counter()
+        first_chunk = True
+        try:
+            with metrics.phase("Provider"):
+                for frame in streaming.frames(streaming.gemini_chunks(prompt, generation_config=generation_config,
+                                                                         system=system), sse):
+                    self.wfile.write(streaming.http_chunk(frame))
+                    self.wfile.flush()
+                    if first_chunk:
+                        metrics.count("FirstChunkMs", round((time.perf_counter() - start) * 1000, 2))
+                        first_chunk = False
+        except Exception as e:
+            # Without the terminating chunk the client sees a truncated response
+            log.exception("Error with Gemini Pro stream", e)
+            self.status = 500
+            self.close_connection = True
+            return
+        self.wfile.write(streaming.LAST_CHUNK)
+        self.wfile.flush()
+
+
+def serve(port=None):
+    server = ThreadingHTTPServer(("0.0.0.0", port or int(os.environ.get("PORT", "8080"))), StreamingChatHandler)
+    log.info("Streaming server listening", port=server.server_address[1])
+    log.flush()
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    serve()
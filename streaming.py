@@ -0,0 +1,77 @@
+import json
+
+import context_cache
+import log
+import model_catalog
+
+# Streamed Gemini Pro generation, shared by stream_server.py. Text is yielded
+# as Gemini produces it and framed either as Server-Sent Events or as plain
+# text inside HTTP/1.1 chunked transfer encoding.
+
+PRO_MODEL = 'gemini-3-pro-preview'
+
+PRO_GENERATION_CONFIG = {
+    "max_output_tokens": 8192,  # Maximum tokens for output
+    "temperature": 0.3,  # Lower temperature for more consistent, factual responses
+}
+
+LAST_CHUNK = b"0\r\n\r\n"
+
+
+def gemini_chunks(prompt, model_name=PRO_MODEL, generation_config=PRO_GENERATION_CONFIG, system=None):
+    """Yield response text from Gemini as it is generated"""
+    response_gemini = context_cache.generate_content(
+        model_catalog.resolve(model_name),
+        prompt,
+        system,
+        generation_config=generation_config,
+        stream=True
+    )
+
+    length = 0
+    for chunk in response_gemini:
+        try:
+            text = chunk.text
+        except ValueError:
+            # Chunks without text parts (e.g. the final safety/finish chunk)
+            continue
+        if text:
+            length += len(text)
+            yield text
+
+    log.info("Gemini Pro stream finished", finish_reason=response_gemini.candidates[0].finish_reason,
+             response_chars=length)
+
+
+def sse_event(data, event=None):
+    """Encode one Server-Sent Event; multi-line data becomes several data: lines"""
+    lines = [f"event: {event}"] if event else []
+    lines += [f"data: {line}" for line in data.split("\n")]
+    return ("\n".join(lines) + "\n\n").encode("utf-8")
+
+
+def http_chunk(data):
+    """Frame bytes as one HTTP/1.1 chunk"""
+    return f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n"
+
+
+def frames(chunks, sse):
+    """Turn text chunks into response body frames
+
+    With SSE a failure mid-stream is reported as an `error` event and the
+    stream ends with a `done` event. Plain text has no way to signal an error
+    after the status line, so the exception propagates and the caller drops
+    the connection without the terminating chunk.
+    """
+    if not sse:
+        for text in chunks:
+            yield text.encode("utf-8")
+        return
+
+    try:
+        for text in chunks:
+            yield sse_event(text)
+    except Exception as e:
+        log.exception("Error while streaming Gemini Pro chat", e)
+        yield sse_event(json.dumps({"error": f"Failed to process chat: {str(e)}"}), event="error")
+    yield sse_event("[DONE]", event="done")
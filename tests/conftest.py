@@ -0,0 +1,23 @@
+"""Tests run offline: benchmarks/fakes.py stands in for the provider SDKs and conf.py"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import fakes  # noqa: E402
+import log  # noqa: E402
+
+fakes.install(scale=0)
+os.environ.update(MODEL_CATALOG_PATH="", CACHE_STORE="local")
+
+
+@pytest.fixture(autouse=True)
+def reset_fakes():
+    """Each test starts with fakes that neither fail nor wait"""
+    yield
+    # Log lines are buffered per invocation; write what is left while pytest still captures it
+    log.flush()
+    for setting in (fakes.MODEL_LATENCY, fakes.ERROR_RATE, fakes.ERROR_STATUS, fakes.HANG_RATE, fakes.calls):
+        setting.clear()
@@ -0,0 +1,17 @@
+import pytest
+
+import hedging
+
+
+@pytest.mark.parametrize("value", [False, "false", "0", "no", 1, "true", None])
+def test_only_true_turns_hedging_on(value):
+    assert hedging.requested({"hedge": value}) is False
+
+
+def test_hedge_true_or_the_function_default(monkeypatch):
+    assert hedging.requested({"hedge": True}) is True
+    assert hedging.requested({}) is False
+
+    monkeypatch.setattr(hedging, "HEDGE_ENABLED", True)
+    assert hedging.requested({}) is True
+    assert hedging.requested({"hedge": False}) is False
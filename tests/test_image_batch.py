@@ -0,0 +1,66 @@
+import json
+
+import image_batch
+from benchmarks.events import http_event
+
+
+def _generate(failing=(), short=()):
+    """generate(prompt, count) that fails for prompts in failing and returns one image too few for short"""
+    def generate(prompt, count):
+        if prompt in failing:
+            raise RuntimeError(f"{prompt} was rejected")
+        return [{"image_url": f"https://images.example/{prompt}/{index}"}
+                for index in range(count - 1 if prompt in short else count)]
+    return generate
+
+
+def test_failed_call_yields_an_error_per_image():
+    calls = image_batch.plan(["cake", "bread", "pie"], 2, 1)
+    results = image_batch.run(calls, _generate(failing={"bread"}), concurrency=4)
+
+    assert [(result["prompt_index"], result["variant"]) for result in results] == \
+        [(0, 0), (0, 1), (1, 0), (1, 1), (2, 0), (2, 1)]
+    assert [result["status"] for result in results] == ["success", "success", "error", "error", "success", "success"]
+    assert results[2]["error"] == "Failed to generate image: bread was rejected"
+    assert results[4]["image_url"] == "https://images.example/pie/0"
+
+
+def test_missing_images_are_errors():
+    calls = image_batch.plan(["cake"], 4, 4)
+    results = image_batch.run(calls, _generate(short={"cake"}), concurrency=1)
+
+    assert [result["status"] for result in results] == ["success", "success", "success", "error"]
+    assert results[3]["error"] == "Provider returned fewer images than requested"
+
+
+def test_partial_failure_is_200_and_total_failure_500():
+    request = {"prompts": ["cake", "bread"]}
+    partial = image_batch.handle(request, "dall-e-3", _generate(failing={"bread"}), {"model": "dall-e-3"}, {})
+    failed = image_batch.handle(request, "dall-e-3", _generate(failing={"cake", "bread"}), {"model": "dall-e-3"}, {})
+
+    assert partial["statusCode"] == 200
+    body = json.loads(partial["body"])
+    assert (body["succeeded"], body["failed"], body["model"]) == (1, 1, "dall-e-3")
+    assert failed["statusCode"] == 500
+    assert json.loads(failed["body"])["succeeded"] == 0
+
+
+def test_invalid_batch_is_400():
+    response = image_batch.handle({"prompts": ["cake"], "variants": 0}, "dall-e-3", _generate(), {}, {})
+
+    assert response["statusCode"] == 400
+    assert json.loads(response["body"])["error"] == "variants must be a positive integer"
+
+
+def test_handler_reports_a_rejected_prompt_per_image():
+    import handler
+    from benchmarks import fakes
+
+    fakes.ERROR_RATE["imagen-3.0-generate-001"] = 1.0
+    fakes.ERROR_STATUS["imagen-3.0-generate-001"] = 400
+    response = handler.gemini_image_generator(http_event({"prompts": ["cake", "bread"], "variants": 2}), None)
+
+    body = json.loads(response["body"])
+    assert response["statusCode"] == 500
+    assert body["failed"] == 4
+    assert all(result["error"].startswith("Failed to generate image:") for result in body["results"])
@@ -0,0 +1,64 @@
+import pytest
+
+import image_cache
+import stores
+
+
+@pytest.fixture
+def store(tmp_path):
+    return stores.FileBlobStore(str(tmp_path))
+
+
+def _container(monkeypatch, name):
+    monkeypatch.setattr(image_cache, "CONTAINER_ID", name)
+
+
+def test_total_bytes_bound_deletes_the_oldest_unshared_blob(store, monkeypatch):
+    _container(monkeypatch, "a")
+    cache = image_cache.ImageCache(store, max_bytes=10)
+    cache.put("first", b"123456", "image/png")
+    cache.put("second", b"123456", "image/png")
+
+    assert cache.index.bytes == 6
+    assert store.get("first") is None and store.get("first.json") is None
+    assert cache.lookup("first") is None
+    assert cache.read("second") == b"123456"
+
+
+def test_blob_another_container_served_is_kept(store, monkeypatch):
+    _container(monkeypatch, "a")
+    writer = image_cache.ImageCache(store, max_bytes=10)
+    writer.put("first", b"123456", "image/png")
+
+    _container(monkeypatch, "b")
+    reader = image_cache.ImageCache(store, max_bytes=10)
+    assert reader.lookup("first")["shared"] is True
+
+    _container(monkeypatch, "a")
+    writer.put("second", b"123456", "image/png")
+    assert "first" not in writer.index._entries
+    assert store.get("first") == b"123456"
+    # The reader's own eviction never deletes what it did not write
+    _container(monkeypatch, "b")
+    reader.put("third", b"123456", "image/png")
+    assert store.get("first") == b"123456"
+
+
+def test_blob_with_a_valid_url_is_kept(store, monkeypatch):
+    _container(monkeypatch, "a")
+    cache = image_cache.ImageCache(store, max_bytes=10)
+    cache.put("first", b"123456", "image/png")
+    cache.url("first")
+    cache.put("second", b"123456", "image/png")
+
+    assert store.get("first") == b"123456"
+
+
+def test_store_errors_are_a_miss():
+    class Broken:
+        def get(self, key):
+            raise RuntimeError("AccessDenied")
+
+    cache = image_cache.ImageCache(Broken())
+    assert cache.lookup("first") is None
+    assert cache.read("first") is None
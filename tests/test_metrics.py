@@ -0,0 +1,100 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import providers
+import resilience
+from benchmarks.events import http_event
+
+
+def _emf(function, status, body):
+    with metrics.capture() as documents:
+        metrics.start(function)
+        body()
+        metrics.finish(status)
+    assert len(documents) == 1
+    return documents[0]
+
+
+def test_document_shape():
+    def body():
+        metrics.model("gemini-2.0-flash")
+        metrics.prop("Handler", "gemini_chat")
+        metrics.count("InputTokens", 12)
+        metrics.count("InputTokens", 30)
+        metrics.count("ImageBytes", 2048)
+        with metrics.phase("Provider"):
+            pass
+
+    document = _emf("gemini_chat", 200, body)
+
+    aws = document["_aws"]
+    assert isinstance(aws["Timestamp"], int)
+    [directive] = aws["CloudWatchMetrics"]
+    assert directive["Namespace"] == metrics.NAMESPACE
+    assert directive["Dimensions"] == [["Function", "Model"], ["Function"]]
+    units = {metric["Name"]: metric["Unit"] for metric in directive["Metrics"]}
+    # Every metric named in the directive is a top-level member, and the other way round
+    assert set(units) == set(document) - {"_aws", "Function", "Model", "StatusCode", "Handler"}
+    assert units["InputTokens"] == "Count"
+    assert units["ImageBytes"] == "Bytes"
+    assert units["ProviderMs"] == units["TotalMs"] == "Milliseconds"
+    assert (document["Function"], document["Model"], document["StatusCode"]) == ("gemini_chat", "gemini-2.0-flash", 200)
+    assert document["Handler"] == "gemini_chat"
+    assert document["InputTokens"] == 42
+    assert document["Error"] == 0
+    assert document["ColdStart"] in (0, 1)
+
+
+def test_without_model_only_function_dimension_and_5xx_is_an_error():
+    document = _emf("add_user_profile", 503, lambda: None)
+
+    assert document["_aws"]["CloudWatchMetrics"][0]["Dimensions"] == [["Function"]]
+    assert "Model" not in document
+    assert document["Error"] == 1
+
+
+def test_bound_worker_threads_add_to_the_request_record():
+    def work(_):
+        metrics.count("Images")
+        with metrics.phase("Provider"):
+            pass
+
+    def body():
+        with ThreadPoolExecutor(4) as pool:
+            list(pool.map(resilience.bind(work), range(8)))
+        # Unbound threads have no record of their own
+        thread = threading.Thread(target=metrics.count, args=("Images",))
+        thread.start()
+        thread.join()
+
+    document = _emf("gemini_image_generator", 200, body)
+
+    assert document["Images"] == 8
+    assert "ProviderMs" in document
+
+
+def test_batch_handler_reports_worker_metrics():
+    import handler
+
+    with metrics.capture() as documents:
+        response = handler.gemini_image_generator(http_event({"prompts": ["cake", "bread"], "variants": 2}), None)
+
+    assert response["statusCode"] == 200
+    [document] = documents
+    assert document["Images"] == 4
+    assert "ProviderMs" in document
+    assert document["Model"] == "imagen-3.0-generate-001"
+
+
+def test_model_handle_hits_and_builds_are_counted():
+    handles = providers.HandleCache(lambda name: object())
+
+    def body():
+        handles.get("imagen-3.0-generate-001")
+        handles.get("imagen-3.0-generate-001")
+        handles.get("imagen-3.0-generate-001")
+
+    document = _emf("gemini_image_generator", 200, body)
+    assert (document["ModelCacheBuild"], document["ModelCacheHit"]) == (1, 2)
+    assert (handles.builds, handles.hits) == (1, 2)
@@ -0,0 +1,50 @@
+import json
+
+import pytest
+
+import handler
+import pipeline
+from benchmarks.events import http_event, sample_events
+
+
+def _call(function, body):
+    response = function(http_event(body), None)
+    return response["statusCode"], json.loads(response["body"]).get("error")
+
+
+@pytest.mark.parametrize("function, field", [
+    (handler.chatbot, "question"),
+    (handler.image_generator, "prompt"),
+    (handler.gemini_image_generator, "prompt"),
+    (handler.gemini_chat, "prompt"),
+    (handler.compare_models, "prompt"),
+    (handler.chat_session, "message"),
+])
+@pytest.mark.parametrize("value", [123, ["a"], {"x": 1}, True])
+def test_prompt_that_is_not_a_string_is_a_400(function, field, value):
+    assert _call(function, {field: value}) == (400, f"{field} must be a string")
+
+
+@pytest.mark.parametrize("value", [None, "", "   \n"])
+def test_missing_or_blank_prompt_is_a_400(value):
+    assert _call(handler.gemini_chat, {"prompt": value}) == (400, "No prompt provided")
+
+
+def test_sample_events_still_pass_the_stages():
+    events = sample_events()
+    assert handler.gemini_chat(events["gemini_chat"], None)["statusCode"] == 200
+
+
+def test_unexpected_error_in_a_stage_is_a_500_with_cors():
+    def broken(request):
+        raise KeyError("boom")
+
+    @pipeline.handler(pipeline.origin(), broken)
+    def answer(request):
+        return pipeline.json_response({})
+
+    response = answer(http_event({"prompt": "hi"}), None)
+
+    assert response["statusCode"] == 500
+    assert json.loads(response["body"]) == {"error": "Internal server error"}
+    assert "Access-Control-Allow-Origin" in response["headers"]
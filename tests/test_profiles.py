@@ -0,0 +1,82 @@
+import json
+
+import pytest
+
+import metrics
+import profiles
+from benchmarks import fakes
+from benchmarks.events import SERVER_API_KEY, ndjson_event, profile_records
+
+TABLE = "test-profiles"
+
+
+class ScriptedClient:
+    """BatchWriteItem that leaves the first unprocessed[n] items of call n unprocessed"""
+
+    def __init__(self, *unprocessed, error_calls=()):
+        self.unprocessed = list(unprocessed)
+        self.error_calls = error_calls
+        self.batches = []
+
+    def batch_write_item(self, RequestItems):
+        [(name, requests)] = RequestItems.items()
+        self.batches.append([request["PutRequest"]["Item"]["UserID"]["S"] for request in requests])
+        if len(self.batches) in self.error_calls:
+            raise RuntimeError("ProvisionedThroughputExceededException")
+        left = self.unprocessed.pop(0) if self.unprocessed else 0
+        return {"UnprocessedItems": {name: requests[:left]} if left else {}}
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(profiles, "BULK_BACKOFF_BASE", 0.0)
+
+
+def _chunk(count):
+    return list(enumerate(profiles.validate(record) for record in profile_records(count)))
+
+
+def test_unprocessed_items_are_retried_until_written():
+    client = ScriptedClient(3, 1)
+    failed, retries = profiles._write_chunk(client, TABLE, _chunk(5))
+
+    assert (failed, retries) == ({}, 2)
+    assert [len(batch) for batch in client.batches] == [5, 3, 1]
+    # Only what DynamoDB left unprocessed goes out again
+    assert client.batches[1] == client.batches[0][:3]
+
+
+def test_items_still_unprocessed_after_every_attempt_fail():
+    client = ScriptedClient(*[2] * profiles.BULK_MAX_ATTEMPTS)
+    failed, retries = profiles._write_chunk(client, TABLE, _chunk(4))
+
+    assert failed == {0: "Unprocessed after retries", 1: "Unprocessed after retries"}
+    assert retries == profiles.BULK_MAX_ATTEMPTS - 1
+    assert len(client.batches) == profiles.BULK_MAX_ATTEMPTS
+
+
+def test_failed_call_retries_the_whole_chunk():
+    client = ScriptedClient(error_calls=(1,))
+    failed, retries = profiles._write_chunk(client, TABLE, _chunk(3))
+
+    assert (failed, retries) == ({}, 1)
+    assert client.batches[0] == client.batches[1]
+
+
+def test_bulk_import_writes_everything_and_counts_retries(monkeypatch):
+    monkeypatch.setenv("USER_PROFILES_TABLE", TABLE)
+    # One writer thread, so the seeded fake leaves the same items unprocessed every run
+    monkeypatch.setattr(profiles, "BULK_CONCURRENCY", 1)
+    fakes.seed(1)
+    fakes.ERROR_RATE["dynamodb.unprocessed"] = 0.3
+    import handler
+
+    with metrics.capture() as documents:
+        response = handler.add_user_profiles_bulk(
+            ndjson_event(profile_records(60), headers={"x-api-key": SERVER_API_KEY}), None)
+
+    body = json.loads(response["body"])
+    assert response["statusCode"] == 200
+    assert (body["written"], body["failed"]) == (60, 0)
+    assert len(fakes.dynamodb_items(TABLE)) == 60
+    assert documents[0]["BatchRetries"] > 0
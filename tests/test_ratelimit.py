@@ -0,0 +1,134 @@
+import json
+import types
+
+import pytest
+
+import pipeline
+import ratelimit
+from benchmarks.events import http_event
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit, "time", types.SimpleNamespace(time=clock.time))
+    return clock
+
+
+def _limiter(per_minute=60, burst=5, lease=1):
+    return ratelimit.Limiter(ratelimit.LocalBucketStore(), {"text": (per_minute, burst)}, lease=lease)
+
+
+def _admitted(limiter, who, requests):
+    admitted = 0
+    for _ in range(requests):
+        try:
+            limiter.acquire("text", who)
+            admitted += 1
+        except ratelimit.Throttled:
+            pass
+    return admitted
+
+
+def test_burst_then_deny_with_retry_after(clock):
+    limiter = _limiter(per_minute=60, burst=5)
+
+    assert _admitted(limiter, "ip:1", 5) == 5
+    with pytest.raises(ratelimit.Throttled) as denied:
+        limiter.acquire("text", "ip:1")
+    assert denied.value.retry_after == pytest.approx(1.0)
+
+
+def test_refill_at_the_configured_rate(clock):
+    limiter = _limiter(per_minute=60, burst=5)
+    _admitted(limiter, "ip:1", 5)
+
+    clock.now += 0.5
+    assert _admitted(limiter, "ip:1", 1) == 0
+    clock.now += 2.5
+    # Three seconds at one token a second
+    assert _admitted(limiter, "ip:1", 10) == 3
+    clock.now += 3600
+    # Never more than the burst
+    assert _admitted(limiter, "ip:1", 10) == 5
+
+
+def test_tenants_have_their_own_buckets(clock):
+    limiter = _limiter(burst=2)
+
+    assert _admitted(limiter, "ip:1", 5) == 2
+    assert _admitted(limiter, "ip:2", 5) == 2
+
+
+def test_leases_are_spent_without_the_store(clock):
+    limiter = _limiter(burst=20, lease=5)
+    takes = []
+    take = limiter.store.take
+    limiter.store.take = lambda *args: takes.append(args) or take(*args)
+
+    assert _admitted(limiter, "ip:1", 10) == 10
+    assert len(takes) == 2
+
+
+def test_store_outage_fails_open(clock):
+    limiter = _limiter(burst=1)
+
+    def broken(*args):
+        raise RuntimeError("table unreachable")
+    limiter.store.take = broken
+
+    assert _admitted(limiter, "ip:1", 3) == 3
+
+
+def test_tenant_is_the_source_ip_whatever_the_key_and_origin():
+    first = http_event({}, {"x-api-key": "one", "origin": "https://a.broadcust.co.il"})
+    second = http_event({}, {"x-api-key": "two", "origin": "https://b.broadcust.co.il"})
+    second["requestContext"]["http"]["sourceIp"] = "198.51.100.7"
+
+    assert ratelimit.tenant(first) == "ip:203.0.113.10"
+    assert ratelimit.tenant(second) == "ip:198.51.100.7"
+    assert ratelimit.tenant({"headers": {"x-api-key": "one"}}) == "anonymous"
+
+
+def _charged(who, requests):
+    admitted = 0
+    for _ in range(requests):
+        try:
+            ratelimit.charge("text", who)
+            admitted += 1
+        except ratelimit.Throttled:
+            pass
+    return admitted
+
+
+def test_site_wide_budget_caps_all_clients(clock, monkeypatch):
+    monkeypatch.setattr(ratelimit, "limiter", _limiter(burst=5))
+    monkeypatch.setattr(ratelimit, "site_limiter", _limiter(burst=6))
+
+    admitted = sum(_charged(f"ip:{number}", 2) for number in range(5))
+    assert admitted == 6
+
+
+def test_stage_answers_429_with_retry_after(clock, monkeypatch):
+    monkeypatch.setattr(ratelimit, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(ratelimit, "limiter", _limiter(burst=1))
+    monkeypatch.setattr(ratelimit, "site_limiter", _limiter(burst=100))
+    stage = ratelimit.limit("text")
+
+    stage(pipeline.Request(http_event({"prompt": "first"})))
+    with pytest.raises(pipeline.Rejected) as rejected:
+        # A new Origin and API key do not make it another client
+        stage(pipeline.Request(http_event({"prompt": "second"}, {"origin": "https://x.broadcust.co.il",
+                                                                 "x-api-key": "rotated"})))
+    response = rejected.value.response
+    assert response["statusCode"] == 429
+    assert response["headers"]["Retry-After"] == "1"
+    assert json.loads(response["body"])["retry_after"] == pytest.approx(1.0)
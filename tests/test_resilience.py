@@ -0,0 +1,157 @@
+import threading
+import time
+import types
+
+import pytest
+
+import metrics
+import resilience
+from benchmarks.events import API_DOMAIN
+from benchmarks.fakes import FakeProviderError
+
+IMAGE_MODEL = "imagen-3.0-generate-001"
+
+
+class Context:
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def get_remaining_time_in_millis(self):
+        return self.seconds * 1000
+
+
+class Flaky:
+    """Fails with status for the first failures calls, then answers"""
+
+    def __init__(self, failures, status=503):
+        self.failures = failures
+        self.status = status
+        self.calls = 0
+
+    def __call__(self, **kwargs):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise FakeProviderError("Simulated error", self.status)
+        return "answer"
+
+
+@pytest.fixture(autouse=True)
+def fresh(monkeypatch):
+    """Closed breakers, no backoff and no deadline"""
+    for name in resilience.breakers:
+        monkeypatch.setitem(resilience.breakers, name, resilience.CircuitBreaker(name, threshold=3, cooldown=10))
+    monkeypatch.setattr(resilience, "PROVIDER_BACKOFF", 0.0)
+    resilience.begin()
+    yield
+    resilience.begin()
+
+
+def _retries(function):
+    with metrics.capture() as documents:
+        metrics.start("test")
+        try:
+            function()
+        finally:
+            metrics.finish(200)
+    return documents[0].get("ProviderRetries", 0)
+
+
+def test_retryable_errors_are_retried_until_an_answer():
+    flaky = Flaky(2)
+    result = []
+    retries = _retries(lambda: result.append(resilience.call("gpt-4o", flaky)))
+
+    assert result == ["answer"]
+    assert (flaky.calls, retries) == (3, 2)
+    assert resilience.breakers["openai"].failures == 0
+
+
+def test_retries_stop_after_max_attempts():
+    flaky = Flaky(5)
+    with pytest.raises(FakeProviderError):
+        resilience.call("gpt-4o", flaky, attempts=3)
+
+    assert flaky.calls == 3
+
+
+def test_bad_request_is_not_retried_and_leaves_the_breaker_closed():
+    flaky = Flaky(1, status=400)
+    with pytest.raises(FakeProviderError):
+        resilience.call("gpt-4o", flaky)
+
+    assert flaky.calls == 1
+    assert resilience.breakers["openai"].failures == 0
+
+
+def test_breaker_opens_then_lets_one_trial_through(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(resilience, "time", types.SimpleNamespace(monotonic=lambda: now[0], sleep=lambda _: None))
+    breaker = resilience.breakers["gemini"]
+
+    with pytest.raises(FakeProviderError):
+        resilience.call("gemini-2.0-flash", Flaky(10), attempts=3)
+    assert breaker.state == "open"
+
+    # Open: calls fail at once, without reaching the provider
+    flaky = Flaky(0)
+    with pytest.raises(resilience.CircuitOpen) as rejected:
+        resilience.call("gemini-2.0-flash", flaky)
+    assert flaky.calls == 0
+    assert rejected.value.retry_after == pytest.approx(10)
+
+    # After the cooldown one trial call goes through; while it runs, others are still rejected
+    now[0] += 10
+    breaker.allow()
+    assert breaker.state == "half_open"
+    with pytest.raises(resilience.CircuitOpen):
+        breaker.allow()
+
+    # A failed trial opens it again, a good one closes it
+    breaker.failure()
+    assert breaker.state == "open"
+    now[0] += 10
+    assert resilience.call("gemini-2.0-flash", flaky) == "answer"
+    assert breaker.state == "closed"
+
+
+def test_abandoned_image_call_is_not_retried(monkeypatch):
+    monkeypatch.setitem(resilience.ATTEMPT_TIMEOUTS, IMAGE_MODEL, 0.05)
+    calls = []
+
+    def slow(**kwargs):
+        calls.append(1)
+        time.sleep(0.3)
+
+    with pytest.raises(resilience.Abandoned):
+        resilience.call(IMAGE_MODEL, slow)
+    assert len(calls) == 1
+
+
+def test_sync_requests_cap_each_attempt():
+    resilience.begin({"requestContext": {"domainName": API_DOMAIN}}, Context(900))
+
+    assert resilience._timeout(IMAGE_MODEL) == resilience.IMAGE_PROVIDER_TIMEOUT
+    assert resilience.remaining() == pytest.approx(resilience.API_GATEWAY_TIMEOUT - resilience.DEADLINE_MARGIN,
+                                                   abs=0.1)
+
+
+def test_jobs_give_an_attempt_the_time_left():
+    resilience.begin({"job_id": "0" * 32, "requestContext": {"domainName": API_DOMAIN}}, Context(900))
+    expected = 900 - resilience.DEADLINE_MARGIN
+
+    assert resilience._timeout(IMAGE_MODEL) == pytest.approx(expected, abs=0.1)
+    # Worker threads of the job get the same
+    timeouts = []
+    thread = threading.Thread(target=resilience.bind(lambda: timeouts.append(resilience._timeout(IMAGE_MODEL))))
+    thread.start()
+    thread.join()
+    assert timeouts[0] == pytest.approx(expected, abs=0.1)
+
+
+def test_no_time_left_is_deadline_exceeded():
+    resilience.begin({}, Context(resilience.DEADLINE_MARGIN / 2))
+    flaky = Flaky(0)
+
+    with pytest.raises(resilience.DeadlineExceeded):
+        resilience.call("gpt-4o", flaky)
+    assert flaky.calls == 0
@@ -0,0 +1,56 @@
+import pytest
+
+import handler
+import resilience
+import response_cache
+import singleflight
+from benchmarks import fakes
+from benchmarks.events import http_event
+from cache import TTLCache
+
+
+@pytest.fixture(autouse=True)
+def fresh(monkeypatch):
+    """An empty response cache, no shared flight results, closed breakers and no backoff"""
+    monkeypatch.setattr(response_cache, "responses", response_cache.ResponseCache(TTLCache(max_entries=16)))
+    monkeypatch.setattr(singleflight, "flights", singleflight.Flights())
+    for name in resilience.breakers:
+        monkeypatch.setitem(resilience.breakers, name, resilience.CircuitBreaker(name, threshold=100, cooldown=10))
+    monkeypatch.setattr(resilience, "PROVIDER_BACKOFF", 0.0)
+
+
+def _ask(function, body):
+    response = function(http_event(body), None)
+    assert response["statusCode"] == 200, response
+    return response["headers"]["X-Cache"], response["headers"]["X-Served-By"]
+
+
+@pytest.mark.parametrize("function, model, backup, field", [
+    (handler.chatbot, "gpt-4o", "gemini-2.0-flash", "question"),
+    (handler.gemini_chat, "gemini-2.0-flash", "gpt-4o", "prompt"),
+    (handler.gemini_pro_chat, "gemini-3-pro-preview", "gpt-4o", "prompt"),
+])
+def test_fallback_answers_are_not_cached_under_the_primary(function, model, backup, field):
+    body = {field: f"Write a slogan for a bakery ({model})"}
+    fakes.ERROR_RATE[model] = 1.0
+    fakes.ERROR_STATUS[model] = 503
+    assert _ask(function, body) == ("MISS", backup)
+
+    fakes.ERROR_RATE.clear()
+    assert _ask(function, body) == ("MISS", model)
+    assert _ask(function, body) == ("HIT", model)
+
+
+@pytest.mark.parametrize("function, model, backup, field", [
+    (handler.chatbot, "gpt-4o", "gemini-2.0-flash", "question"),
+    (handler.gemini_chat, "gemini-2.0-flash", "gpt-4o", "prompt"),
+])
+def test_backup_wins_of_a_hedge_are_not_cached_under_the_primary(function, model, backup, field):
+    body = {field: f"Write a hedged slogan for a bakery ({model})", "hedge": True}
+    fakes.ERROR_RATE[model] = 1.0
+    fakes.ERROR_STATUS[model] = 503
+    assert _ask(function, body) == ("MISS", backup)
+
+    fakes.ERROR_RATE.clear()
+    assert _ask(function, body) == ("MISS", model)
+    assert _ask(function, body) == ("HIT", model)
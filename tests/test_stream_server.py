@@ -0,0 +1,45 @@
+import http.client
+import json
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import stream_server
+
+
+@pytest.fixture
+def port():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), stream_server.StreamingChatHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+def _request(port, method, path, body=None):
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    connection.request(method, path, body=body and json.dumps(body), headers={"Content-Type": "application/json"})
+    response = connection.getresponse()
+    response.read()
+    connection.close()
+    return response.status
+
+
+def test_access_lines_go_through_the_structured_log(port, capsys):
+    assert _request(port, "GET", stream_server.HEALTH_PATH) == 200
+    assert _request(port, "POST", "/", {"prompt": "Write a campaign plan"}) == 200
+
+    # The handler thread writes its log lines once the response is out
+    out = err = ""
+    for _ in range(100):
+        captured = capsys.readouterr()
+        out, err = out + captured.out, err + captured.err
+        access = [record for record in map(json.loads, out.splitlines()) if record.get("msg") == "HTTP request"]
+        if access:
+            break
+        time.sleep(0.01)
+    assert err == ""
+    # One line for the POST; health checks are not logged
+    assert [(record["method"], record["path"], record["status"]) for record in access] == [("POST", "/", 200)]
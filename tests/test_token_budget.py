@@ -0,0 +1,48 @@
+import json
+
+import pytest
+
+import pipeline
+import token_budget
+from benchmarks.events import http_event
+
+
+def _budget(data, endpoint="chatbot", model="gpt-4o", field="question"):
+    """The request after the parse and budget stages"""
+    request = pipeline.Request(http_event(data))
+    pipeline.run_stages(request, [pipeline.parse_body, token_budget.budget(endpoint, model, field)])
+    return request
+
+
+def _rejected(data, **kwargs):
+    with pytest.raises(pipeline.Rejected) as rejected:
+        _budget(data, **kwargs)
+    response = rejected.value.response
+    return response["statusCode"], json.loads(response["body"])["error"]
+
+
+@pytest.mark.parametrize("value", [123, ["a"], {"x": 1}, None])
+def test_text_that_is_not_a_string_is_a_400(value):
+    assert _rejected({"question": value}) == (400, "question must be a string")
+    assert _rejected({"prompt": value}, endpoint="gemini_chat", model="gemini-2.0-flash",
+                     field="prompt") == (400, "prompt must be a string")
+
+
+def test_length_and_compact_are_checked():
+    assert _rejected({"question": "hi", "length": 5})[0] == 400
+    assert _rejected({"question": "hi", "compact": "yes"}) == (400, "compact must be true or false")
+
+
+def test_only_compact_requests_get_the_endpoint_budget(monkeypatch):
+    monkeypatch.setitem(token_budget.PROMPT_TOKEN_BUDGETS, "chatbot", 50)
+    question = " ".join(f"word{number}" for number in range(400))
+
+    untouched = _budget({"question": question})
+    assert untouched.data["question"] == question
+    assert untouched.budget.saved_tokens == 0
+    assert untouched.budget.max_output_tokens is None
+
+    compacted = _budget({"question": question, "compact": True, "length": "short"})
+    assert compacted.budget.prompt_tokens <= 50
+    assert compacted.budget.saved_tokens > 0
+    assert compacted.budget.headers()["X-Max-Output-Tokens"] == str(token_budget.OUTPUT_TOKENS["short"])
@@ -0,0 +1,131 @@
+import json
+
+import pytest
+
+import handler
+import metrics
+import pipeline
+import providers
+import warmup
+from benchmarks import fakes
+from benchmarks.events import http_event
+
+FUNCTION_ARN = "arn:aws:lambda:us-east-1:123456789012:function:python-chatbot-api-dev-gemini_chat"
+
+
+class Context:
+    invoked_function_arn = FUNCTION_ARN
+    aws_request_id = "test"
+
+    def get_remaining_time_in_millis(self):
+        return 900000
+
+
+@pytest.fixture(autouse=True)
+def no_hold(monkeypatch):
+    monkeypatch.setattr(warmup, "WARMUP_HOLD", 0.0)
+    monkeypatch.setitem(fakes.LAMBDA, "invoke", None)
+
+
+def _ping(function, event):
+    with metrics.capture() as documents:
+        response = function(event, Context())
+    return response, documents
+
+
+def test_ping_skips_the_stages_and_the_request_metrics():
+    calls = []
+
+    def spy(request):
+        calls.append(request)
+
+    @pipeline.handler(spy)
+    def answer(request):
+        calls.append(request)
+        return pipeline.json_response({})
+
+    response, documents = _ping(answer, {"warmup": True, "concurrency": 1})
+
+    assert response["statusCode"] == 200
+    body = json.loads(response["body"])
+    assert (body["warm"], body["function"], body["containers"]) == (True, "answer", 1)
+    assert calls == []
+    assert documents == []
+
+
+def test_ping_to_a_handler_needs_no_key_or_body():
+    response, documents = _ping(handler.gemini_chat, {"warmup": True, "concurrency": 1})
+
+    assert response["statusCode"] == 200
+    assert json.loads(response["body"])["warm"] is True
+    assert documents == []
+    assert fakes.calls == {}
+
+
+def test_only_true_is_a_ping():
+    assert not warmup.is_ping({"warmup": "true"})
+    assert not warmup.is_ping({"body": json.dumps({"warmup": True})})
+    assert not warmup.is_ping(None)
+
+
+def test_ping_fans_out_to_concurrency_containers():
+    invoked = []
+
+    def invoke(function_name, payload):
+        invoked.append((function_name, json.loads(payload)))
+        body = {"warm": True, "containers": 1, "cold_containers": 1}
+        return json.dumps({"statusCode": 200, "body": json.dumps(body)}).encode()
+
+    fakes.LAMBDA["invoke"] = invoke
+    response, _ = _ping(handler.gemini_chat, {"warmup": True, "concurrency": 3})
+
+    body = json.loads(response["body"])
+    assert body["containers"] == 3
+    assert body["cold_containers"] >= 2
+    # Fanned-out pings do not fan out again
+    assert invoked == [(FUNCTION_ARN, {"warmup": True, "fanout": False})] * 2
+
+
+@pytest.fixture
+def cold_container(monkeypatch):
+    """No provider built or connected yet; builds and connections from here on are recorded"""
+    built, connects = [], []
+    monkeypatch.setattr(providers, "_instances", {})
+    monkeypatch.setattr(providers, "image_models", providers.HandleCache(providers.image_models._loader))
+    for name, factory in list(providers._factories.items()):
+        monkeypatch.setitem(providers._factories, name, lambda name=name, factory=factory: built.append(name) or factory())
+    monkeypatch.setattr(fakes, "connected", set())
+    connect = fakes._connect
+
+    def new_connection(service):
+        if service not in fakes.connected:
+            connects.append(service)
+        connect(service)
+
+    monkeypatch.setattr(fakes, "_connect", new_connection)
+    return built, connects
+
+
+@pytest.mark.parametrize("function, models, names, body", [
+    (handler.gemini_chat, ["gemini-2.0-flash"], ["dynamodb"], {"prompt": "Write a slogan for a bakery"}),
+    (handler.gemini_image_generator, ["imagen-3.0-generate-001"], [], {"prompt": "A bakery at dawn"}),
+])
+def test_first_request_after_a_ping_builds_and_connects_nothing(cold_container, monkeypatch, function, models,
+                                                                 names, body):
+    built, connects = cold_container
+    monkeypatch.setattr(warmup, "WARM_MODELS", models)
+    monkeypatch.setattr(warmup, "WARM_PROVIDERS", names)
+    _ping(function, {"warmup": True, "concurrency": 1})
+    assert built and connects
+
+    built.clear()
+    connects.clear()
+    image_builds = providers.image_models.builds
+    with metrics.capture() as documents:
+        response = function(http_event(body), Context())
+
+    assert response["statusCode"] == 200
+    assert built == []
+    assert connects == []
+    assert providers.image_models.builds == image_builds
+    assert "ModelCacheBuild" not in documents[0]
@@ -0,0 +1,96 @@
+import os
+
+import log
+import metrics
+import pipeline
+import profiles
+import tokens
+
+# Token budgets for the chat endpoints, checked offline before the model is
+# called. The budget stage estimates the prompt's tokens, and a prompt over
+# what the model's context window leaves after the profile context and the
+# answer is compacted by tokens.compact(). Callers that send "compact": true
+# opt in to their endpoint's tighter prompt budget. It also picks
+# max_output_tokens from the request type: clients send "length" (short,
+# standard or long), else the model's usual limit applies. Estimated input
+# tokens and the tokens compaction saved go back as response headers.
+
+# Prompt tokens per endpoint for requests that opt in, not counting the profile context
+PROMPT_TOKEN_BUDGETS = {
+    "chatbot": int(os.environ.get("CHAT_PROMPT_TOKENS", "8000")),
+    "gemini_chat": int(os.environ.get("CHAT_PROMPT_TOKENS", "8000")),
+    "gemini_pro_chat": int(os.environ.get("PRO_PROMPT_TOKENS", "32000")),
+}
+
+OUTPUT_TOKENS = {
+    "short": int(os.environ.get("SHORT_OUTPUT_TOKENS", "512")),
+    "standard": int(os.environ.get("STANDARD_OUTPUT_TOKENS", "2048")),
+    "long": int(os.environ.get("LONG_OUTPUT_TOKENS", "8192")),
+}
+# max_output_tokens without a "length", as each model was called before budgets (None: no cap)
+DEFAULT_OUTPUT_TOKENS = {
+    "gpt-4o": None,
+    "gemini-2.0-flash": 8192,
+    "gemini-3-pro-preview": 8192,
+}
+
+
+class Budget:
+    """Token accounting of one request"""
+
+    def __init__(self, max_output_tokens, prompt_tokens, system_tokens=0, saved_tokens=0):
+        self.max_output_tokens = max_output_tokens
+        self.prompt_tokens = prompt_tokens
+        self.system_tokens = system_tokens
+        self.saved_tokens = saved_tokens
+
+    @property
+    def input_tokens(self):
+        return self.prompt_tokens + self.system_tokens
+
+    def headers(self):
+        headers = {
+            'X-Input-Tokens': str(self.input_tokens),
+            'X-Tokens-Saved': str(self.saved_tokens),
+        }
+        if self.max_output_tokens is not None:
+            headers['X-Max-Output-Tokens'] = str(self.max_output_tokens)
+        return headers
+
+
+def budget(endpoint, model, field="prompt"):
+    """Stage fitting request.data[field] into model's context window, or endpoint's budget when asked to compact
+
+    Sets request.budget and request.system.
+    """
+    message = f"length must be one of {', '.join(OUTPUT_TOKENS)}"
+
+    def check_budget(request):
+        if not isinstance(request.data.get(field), str):
+            raise pipeline.Rejected(pipeline.error(400, f"{field} must be a string", request.cors))
+        length = request.data.get("length")
+        if length is not None and (not isinstance(length, str) or length not in OUTPUT_TOKENS):
+            raise pipeline.Rejected(pipeline.error(400, message, request.cors))
+        compact = request.data.get("compact", False)
+        if not isinstance(compact, bool):
+            raise pipeline.Rejected(pipeline.error(400, "compact must be true or false", request.cors))
+        max_output_tokens = OUTPUT_TOKENS[length] if length else DEFAULT_OUTPUT_TOKENS.get(model)
+        # Looked up once here; the handler sends the same context
+        request.system = profiles.system_context(getattr(request, "user_id", None))
+        system_tokens = tokens.estimate_tokens(request.system)
+        limit = tokens.CONTEXT_WINDOWS[model] - (max_output_tokens or 0) - system_tokens
+        if compact:
+            limit = min(limit, PROMPT_TOKEN_BUDGETS[endpoint])
+        if limit <= 0:
+            raise pipeline.Rejected(pipeline.error(400, "The profile context leaves no room for a prompt",
+                                                   request.cors))
+        text, before, after = tokens.compact(request.data[field], limit)
+        if after < before:
+            log.info("Prompt compacted", endpoint=endpoint, tokens_before=before, tokens_after=after, limit=limit)
+            # A copy: for direct invocations data is the event itself
+            request.data = dict(request.data, **{field: text})
+        request.budget = Budget(max_output_tokens, after, system_tokens, before - after)
+        metrics.count("EstimatedInputTokens", request.budget.input_tokens)
+        metrics.count("TokensSaved", request.budget.saved_tokens)
+    check_budget.phase = "Budget"
+    return check_budget
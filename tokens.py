@@ -0,0 +1,83 @@
+import math
+import re
+
+# Rough token counts for deciding what is worth caching or trimming before a
+# request is sent; the providers report the exact numbers afterwards. English
+# averages about 4 characters per token, Hebrew and other non-Latin scripts
+# closer to 2. compact() shrinks a prompt that is over its budget.
+
+CHARS_PER_TOKEN = 4
+NON_ASCII_CHARS_PER_TOKEN = 2
+
+
+def estimate_tokens(text):
+    """Approximate number of tokens in text"""
+    if not text:
+        return 0
+    # Counted in C: encoding drops the non-ASCII characters
+    non_ascii = 0 if text.isascii() else len(text) - len(text.encode("ascii", "ignore"))
+    return math.ceil((len(text) - non_ascii) / CHARS_PER_TOKEN + non_ascii / NON_ASCII_CHARS_PER_TOKEN)
+
+
+# Context windows in tokens, shared by input and output
+CONTEXT_WINDOWS = {
+    "gpt-4o": 128000,
+    "gemini-2.0-flash": 1048576,
+    "gemini-3-pro-preview": 1048576,
+}
+
+# A line holding nothing but whitespace separates paragraphs
+BLANK_LINE = re.compile(r"\n[^\S\n]*\n")
+# Put where compact() cut text out of the middle
+TRUNCATION_MARK = "\n\n[...]\n\n"
+
+
+def paragraphs(text):
+    """Non-empty paragraphs of text, runs of spaces inside each line collapsed to one"""
+    result = []
+    for block in BLANK_LINE.split(text):
+        lines = (" ".join(line.split()) for line in block.splitlines())
+        block = "\n".join(line for line in lines if line)
+        if block:
+            result.append(block)
+    return result
+
+
+def truncate(text, limit):
+    """text cut down to limit tokens by dropping its middle; the start and the question at the end stay"""
+    if estimate_tokens(text) <= limit:
+        return text
+    if limit <= estimate_tokens(TRUNCATION_MARK):
+        return ""
+    # First guess from text's own characters per token, then shrink until it fits
+    chars = len(text) * (limit - estimate_tokens(TRUNCATION_MARK)) // estimate_tokens(text)
+    while True:
+        tail = chars // 2
+        cut = text[:chars - tail] + TRUNCATION_MARK + text[len(text) - tail:]
+        if chars <= 0 or estimate_tokens(cut) <= limit:
+            return cut
+        chars -= max(1, chars // 50)
+
+
+def compact(text, limit):
+    """(text, tokens before, tokens after) with text brought within limit tokens
+
+    Stops at the first step that fits: collapsing whitespace, then dropping
+    repeated paragraphs, then cutting the middle out. Text already within the
+    limit is returned untouched.
+    """
+    before = estimate_tokens(text)
+    if before <= limit:
+        return text, before, before
+    parts = paragraphs(text)
+    text = "\n\n".join(parts)
+    if estimate_tokens(text) > limit:
+        seen = set()
+        unique = []
+        for part in parts:
+            if part.casefold() not in seen:
+                seen.add(part.casefold())
+                unique.append(part)
+        text = "\n\n".join(unique)
+    text = truncate(text, limit)
+    return text, before, estimate_tokens(text)
@@ -0,0 +1,162 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import log
+import metrics
+import model_catalog
+import providers
+import resilience
+
+# Keep-warm pings and init-phase prewarming. A function lists the models its
+# requests call in WARM_MODELS and any other provider it needs in
+# WARM_PROVIDERS. prewarm() runs while handler.py is imported: it builds those
+# SDK clients and model handles (and the Gemini model catalog) and opens their
+# connections with one cheap call each, so the first request finds them
+# ready. A scheduled event with {"warmup": true, "concurrency": N} is a ping:
+# pipeline.handler() answers it before any stage runs and without request
+# metrics, after warming the container the same way (a provider closes idle
+# connections after a few minutes). The first ping of a round invokes its own
+# function N - 1 more times at once; each of those holds its container for
+# WARMUP_HOLD seconds so they cannot share one, which keeps N containers warm.
+
+WARM_MODELS = [name.strip() for name in os.environ.get("WARM_MODELS", "").split(",") if name.strip()]
+WARM_PROVIDERS = [name.strip() for name in os.environ.get("WARM_PROVIDERS", "").split(",") if name.strip()]
+# Containers a ping keeps warm when its event does not say
+WARMUP_CONCURRENCY = int(os.environ.get("WARMUP_CONCURRENCY", "1"))
+WARMUP_MAX_CONCURRENCY = int(os.environ.get("WARMUP_MAX_CONCURRENCY", "10"))
+# Seconds each fanned-out ping keeps its container busy
+WARMUP_HOLD = float(os.environ.get("WARMUP_HOLD", "0.1"))
+# Seconds per connection-opening call; init waits this long at most, slower ones finish in the background
+WARMUP_TIMEOUT = float(os.environ.get("WARMUP_TIMEOUT", "3"))
+
+
+def is_ping(event):
+    return isinstance(event, dict) and event.get("warmup") is True
+
+
+def _warm_gemini(model_name):
+    model_catalog.load()
+    # count_tokens is free and opens the channel generate_content uses
+    providers.get("genai").GenerativeModel(model_name).count_tokens(
+        "ping", request_options={"timeout": WARMUP_TIMEOUT})
+
+
+def _warm_openai(model_name):
+    if model_name == providers.LLM_MODEL:
+        providers.get("llm")
+    # The chat and image clients share this connection pool
+    providers.get("openai_client").with_options(timeout=WARMUP_TIMEOUT).models.list()
+
+
+def _warm_vertex(model_name):
+    providers.image_models.get(model_name)
+
+
+MODEL_WARMERS = {
+    "gemini": _warm_gemini,
+    "openai": _warm_openai,
+    "vertex": _warm_vertex,
+}
+
+
+def _warm_dynamodb():
+    dynamodb = providers.get("dynamodb")
+    table_name = os.environ.get("CACHE_TABLE")
+    if table_name:
+        # A missing key: one cheap read to open the connection
+        dynamodb.Table(table_name).get_item(Key={"CacheKey": "warmup"})
+
+
+PROVIDER_WARMERS = {
+    "dynamodb": _warm_dynamodb,
+}
+
+
+def _tasks(models, names):
+    """(name, zero-argument warmer) for each model and provider"""
+    tasks = [(name, lambda name=name: MODEL_WARMERS[resilience.provider_of(name)](name)) for name in models]
+    tasks += [(name, PROVIDER_WARMERS.get(name, lambda name=name: providers.get(name))) for name in names]
+    return tasks
+
+
+def _run(name, warmer):
+    try:
+        warmer()
+        return True
+    except Exception as e:
+        log.warning("Could not warm", target=name, error=str(e))
+        return False
+
+
+def warm(models=None, names=None, timeout=None):
+    """Build and connect models and providers (WARM_MODELS, WARM_PROVIDERS) concurrently
+
+    Returns the names warmed; waits at most timeout seconds, the rest go on
+    in the background.
+    """
+    tasks = _tasks(WARM_MODELS if models is None else models, WARM_PROVIDERS if names is None else names)
+    if not tasks:
+        return []
+    pool = ThreadPoolExecutor(len(tasks), thread_name_prefix="warmup")
+    futures = {pool.submit(_run, name, warmer): name for name, warmer in tasks}
+    done, _ = wait(futures, timeout=timeout)
+    pool.shutdown(wait=False)
+    return [futures[future] for future in futures if future in done and future.result()]
+
+
+def prewarm():
+    """Warm this container during the Lambda init phase"""
+    if not WARM_MODELS and not WARM_PROVIDERS:
+        return
+    start = time.perf_counter()
+    warmed = warm(timeout=WARMUP_TIMEOUT)
+    log.info("Prewarmed", warmed=warmed, elapsed_ms=round((time.perf_counter() - start) * 1000, 1))
+    log.flush()
+
+
+def _fan_out(context, count):
+    """Ping this function count more times at once; the payloads that came back"""
+    function_arn = getattr(context, "invoked_function_arn", None)
+    if not function_arn:
+        log.warning("Cannot fan out a warm-up ping without the function ARN")
+        return []
+    client = providers.get("lambda")
+    payload = json.dumps({"warmup": True, "fanout": False}).encode()
+
+    def invoke(_):
+        try:
+            response = client.invoke(FunctionName=function_arn, Payload=payload)
+            return json.loads(json.loads(response["Payload"].read())["body"])
+        except Exception as e:
+            log.warning("Warm-up invocation failed", error=str(e))
+            return None
+
+    with ThreadPoolExecutor(count, thread_name_prefix="warmup-fanout") as pool:
+        return [result for result in pool.map(invoke, range(count)) if result is not None]
+
+
+def ping(function, event, context=None):
+    """Warm this container for a ping event and, unless it was fanned out itself, concurrency - 1 more"""
+    start = time.perf_counter()
+    cold = metrics.claim_cold_start()
+    warmed = warm()
+    concurrency = min(int(event.get("concurrency", WARMUP_CONCURRENCY)), WARMUP_MAX_CONCURRENCY)
+    others = []
+    if event.get("fanout", True) and concurrency > 1:
+        others = _fan_out(context, concurrency - 1)
+    else:
+        time.sleep(WARMUP_HOLD)
+    containers = 1 + len(others)
+    cold_containers = int(cold) + sum(other["cold_containers"] for other in others)
+    log.info("Warm-up ping", function=function, cold=cold, warmed=warmed, containers=containers,
+             cold_containers=cold_containers)
+    return {
+        "warm": True,
+        "function": function,
+        "warmed": warmed,
+        "containers": containers,
+        "cold_containers": cold_containers,
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 1),
+    }